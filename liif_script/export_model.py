@@ -0,0 +1,286 @@
+"""
+This module contains the functionality to export a trained Liif model into an
+optimized CPU artifact, and to check its speed and quality against the fp32
+model on the test split. Is meant to be uses as an extra script for the git
+project https://github.com/yinboc/liif, next to infer.py.
+
+The exported directory holds the encoder and the imnet layers as TorchScript
+modules (the imnet Linear layers quantized to int8 unless --no-quantize is
+given) and can be used anywhere a checkpoint is expected by infer.py and
+infer_server.py:
+
+    <checkpoint name>-cpu-int8/
+        export.json             model spec, precision and export options
+        encoder.pt
+        imnet.pt
+        export_report.json      speed and PSNR against the fp32 checkpoint
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import copy
+import json
+import math
+import os
+import time
+
+import torch
+
+import models
+from infer import (DEFAULT_BATCH_SIZE, DEFAULT_QUERY_CHUNK, ENCODER_FILE, EXPORT_META_NAME, IMNET_FILE,
+                   configure_device, decode_image, encode, list_images, load_model, load_model_spec, query)
+from infer_cache import coord_cell
+from liif_query import patch_query_rgb
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+DEFAULT_TEST_DIR = os.path.join('load', 'test_64_256')
+DEFAULT_LR_KEY = 'lr_64'
+DEFAULT_HR_KEY = 'hr_256'
+DEFAULT_MAX_IMAGES = 100
+# Largest PSNR loss, in dB, accepted without flagging the export
+DEFAULT_MAX_PSNR_DROP = 0.05
+REPORT_NAME = 'export_report.json'
+WARMUP_RUNS = 2
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def quantize_dynamic(module: torch.nn.Module) -> torch.nn.Module:
+    """This function quantizes the weights of the Linear layers of a module to int8.
+    The activations are quantized on the fly, so no calibration data is needed.
+
+    Args:
+        module (torch.nn.Module): module to quantize
+
+    Returns:
+        torch.nn.Module: the quantized module
+    """
+    # torch.ao.quantization since 1.10, torch.quantization before
+    quantization = torch.ao.quantization if hasattr(torch, 'ao') else torch.quantization
+    return quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _script(module: torch.nn.Module, example: torch.Tensor) -> torch.jit.ScriptModule:
+    """This function traces a module with an example input and freezes it, folding
+    its weights into the graph as constants."""
+    with torch.no_grad():
+        traced = torch.jit.trace(module, example)
+    return torch.jit.freeze(traced) if hasattr(torch.jit, 'freeze') else traced
+
+
+def build_export(model: torch.nn.Module, quantize: bool = True, bf16: bool = False,
+                 input_size: int = 64) -> torch.nn.Module:
+    """This function returns an optimized copy of a liif model running on cpu: its
+    encoder and imnet layers are replaced by TorchScript modules, the Linear layers of
+    the imnet are quantized to int8 and bf16 autocast is enabled if requested.
+
+    Args:
+        model (torch.nn.Module): fp32 liif model
+        quantize (bool, optional): quantize the imnet to int8. Defaults to True.
+        bf16 (bool, optional): run the model under bf16 autocast. Defaults to False.
+        input_size (int, optional): side of the example image used to trace the encoder. Defaults to 64.
+
+    Returns:
+        torch.nn.Module: the optimized model
+    """
+    exported = copy.deepcopy(model).cpu().eval()
+    exported.encoder = _script(exported.encoder, torch.zeros(1, 3, input_size, input_size))
+    if getattr(exported, 'imnet', None) is not None:
+        layers = exported.imnet.layers
+        if quantize:
+            layers = quantize_dynamic(layers)
+        first = next(module for module in model.imnet.layers.modules() if isinstance(module, torch.nn.Linear))
+        exported.imnet.layers = _script(layers, torch.zeros(256, first.in_features))
+    exported.precision = 'bf16' if bf16 else 'fp32'
+    return exported
+
+
+def save_export(exported: torch.nn.Module, model_spec: dict, export_dir: str, quantize: bool,
+                source: str) -> None:
+    """This function writes an optimized model into a directory readable by infer.load_model.
+
+    Args:
+        exported (torch.nn.Module): model returned by build_export
+        model_spec (dict): 'model' spec of the checkpoint
+        export_dir (str): directory where the model is written
+        quantize (bool): whether the imnet was quantized
+        source (str): checkpoint the model was exported from
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    torch.jit.save(exported.encoder, os.path.join(export_dir, ENCODER_FILE))
+    has_imnet = getattr(exported, 'imnet', None) is not None
+    if has_imnet:
+        torch.jit.save(exported.imnet.layers, os.path.join(export_dir, IMNET_FILE))
+    meta = {'model': {'name': model_spec['name'], 'args': model_spec['args']}, 'precision': exported.precision,
+            'quantized': quantize and has_imnet, 'imnet': has_imnet, 'source': os.path.abspath(source),
+            'torch': torch.__version__}
+    with open(os.path.join(export_dir, EXPORT_META_NAME), 'w') as meta_file:
+        json.dump(meta, meta_file, indent=1)
+
+
+def load_test_split(test_dir: str, lr_key: str = DEFAULT_LR_KEY, hr_key: str = DEFAULT_HR_KEY,
+                    max_images: int = DEFAULT_MAX_IMAGES) -> tuple:
+    """This function decodes the first images of the test split that have both a low
+    and a high resolution version.
+
+    Args:
+        test_dir (str): prepared split directory, e.g. 'load/test_64_256'
+        lr_key (str, optional): folder of the inputs. Defaults to DEFAULT_LR_KEY.
+        hr_key (str, optional): folder of the ground truth. Defaults to DEFAULT_HR_KEY.
+        max_images (int, optional): largest number of images used. Defaults to DEFAULT_MAX_IMAGES.
+
+    Raises:
+        FileNotFoundError: raised if no pair of images could be found
+
+    Returns:
+        tuple: (inputs, ground truths) as lists of (3, h, w) tensors in [0, 1]
+    """
+    hr_paths = {os.path.splitext(os.path.basename(path))[0]: path
+                for path in list_images(os.path.join(test_dir, hr_key))}
+    pairs = [(path, hr_paths[os.path.splitext(os.path.basename(path))[0]])
+             for path in list_images(os.path.join(test_dir, lr_key))
+             if os.path.splitext(os.path.basename(path))[0] in hr_paths][:max_images]
+    if not pairs:
+        raise FileNotFoundError(f"No '{lr_key}'/'{hr_key}' pairs could be found in '{test_dir}'!!")
+    return [decode_image(lr) for lr, _ in pairs], [decode_image(hr) for _, hr in pairs]
+
+
+def evaluate(model: torch.nn.Module, inputs: list, targets: list, batch_size: int = DEFAULT_BATCH_SIZE,
+             query_chunk: int = DEFAULT_QUERY_CHUNK) -> dict:
+    """This function infers the inputs at the size of their targets and measures the
+    time spent in the model and the PSNR of the outputs. The first batch is run a few
+    times before measuring, so lazy initializations and TorchScript profiling runs are
+    not counted.
+
+    Args:
+        model (torch.nn.Module): liif model on cpu
+        inputs (list): (3, h, w) input tensors in [0, 1] of the same size
+        targets (list): (3, H, W) ground truth tensors in [0, 1] of the same size
+        batch_size (int, optional): number of images encoded together. Defaults to DEFAULT_BATCH_SIZE.
+        query_chunk (int, optional): query points of the whole batch per call. Defaults to DEFAULT_QUERY_CHUNK.
+
+    Returns:
+        dict: 'ms_per_image' and mean 'psnr' in dB
+    """
+    _, h, w = targets[0].shape
+    coord, cell = coord_cell(h, w, torch.device('cpu'))
+
+    def predict(batch: list) -> torch.Tensor:
+        inp = torch.stack(batch)
+        n = inp.shape[0]
+        encode(model, (inp - 0.5) / 0.5)
+        preds = query(model, coord.unsqueeze(0).expand(n, -1, -1), cell.unsqueeze(0).expand(n, -1, -1), query_chunk)
+        return (preds * 0.5 + 0.5).clamp(0, 1).view(n, h, w, 3).permute(0, 3, 1, 2)
+
+    for _ in range(WARMUP_RUNS):
+        predict(inputs[:batch_size])
+
+    psnrs = []
+    elapsed = 0.0
+    for position in range(0, len(inputs), batch_size):
+        start = time.perf_counter()
+        preds = predict(inputs[position:position + batch_size])
+        elapsed += time.perf_counter() - start
+        # Compared as the 8 bit images that are actually stored
+        preds = torch.round(preds * 255) / 255
+        mse = (preds - torch.stack(targets[position:position + batch_size])).pow(2).mean(dim=(1, 2, 3))
+        psnrs += [-10 * math.log10(max(value, 1e-10)) for value in mse.tolist()]
+    return {'ms_per_image': 1000 * elapsed / len(inputs), 'psnr': sum(psnrs) / len(psnrs)}
+
+
+def export_model(model_path: str, export_dir: str = None, quantize: bool = True, bf16: bool = False,
+                 test_dir: str = DEFAULT_TEST_DIR, max_images: int = DEFAULT_MAX_IMAGES,
+                 batch_size: int = DEFAULT_BATCH_SIZE, max_psnr_drop: float = DEFAULT_MAX_PSNR_DROP) -> dict:
+    """This function exports a checkpoint into an optimized CPU artifact and compares it
+    with the fp32 model on the test split. The comparison is stored next to the export.
+
+    Args:
+        model_path (str): the trained liif model checkpoint path
+        export_dir (str, optional): output directory. Defaults to '<checkpoint>-cpu-<precision>'.
+        quantize (bool, optional): quantize the imnet to int8. Defaults to True.
+        bf16 (bool, optional): run the model under bf16 autocast. Defaults to False.
+        test_dir (str, optional): prepared test split directory. Defaults to DEFAULT_TEST_DIR.
+        max_images (int, optional): test images used in the comparison. Defaults to DEFAULT_MAX_IMAGES.
+        batch_size (int, optional): number of images encoded together. Defaults to DEFAULT_BATCH_SIZE.
+        max_psnr_drop (float, optional): largest PSNR loss accepted, in dB. Defaults to DEFAULT_MAX_PSNR_DROP.
+
+    Returns:
+        dict: the report, with 'accepted' False if the PSNR dropped more than max_psnr_drop
+    """
+    device = torch.device('cpu')
+    tags = (['int8'] if quantize else []) + (['bf16'] if bf16 else [])
+    export_dir = export_dir or f"{os.path.splitext(model_path)[0]}-cpu-{'-'.join(tags or ['fp32'])}"
+
+    model_spec = load_model_spec(model_path)
+    # liif's own query_rgb only runs on cuda
+    patch_query_rgb()
+    baseline = models.make(model_spec, load_sd=True).to(device).eval()
+    inputs, targets = load_test_split(test_dir, max_images=max_images)
+    exported = build_export(baseline, quantize, bf16, inputs[0].shape[-1])
+    save_export(exported, model_spec, export_dir, quantize, model_path)
+
+    # The saved artifact is measured, not the in memory copy
+    reloaded = load_model(export_dir, device)
+    results = {'fp32': evaluate(baseline, inputs, targets, batch_size),
+               'exported': evaluate(reloaded, inputs, targets, batch_size)}
+    speedup = results['fp32']['ms_per_image'] / results['exported']['ms_per_image']
+    psnr_change = results['exported']['psnr'] - results['fp32']['psnr']
+    report = {'checkpoint': os.path.abspath(model_path), 'export_dir': os.path.abspath(export_dir),
+              'images': len(inputs), 'threads': torch.get_num_threads(), 'results': results,
+              'speedup': speedup, 'psnr_change': psnr_change, 'max_psnr_drop': max_psnr_drop,
+              'accepted': psnr_change >= -max_psnr_drop}
+    with open(os.path.join(export_dir, REPORT_NAME), 'w') as report_file:
+        json.dump(report, report_file, indent=1)
+
+    print(f"{'model':12}{'ms/image':>10}{'speedup':>9}{'PSNR':>9}{'change':>9}")
+    print(f"{'fp32':12}{results['fp32']['ms_per_image']:10.2f}{1:8.2f}x{results['fp32']['psnr']:9.3f}")
+    print(f"{'+'.join(tags) or 'scripted':12}{results['exported']['ms_per_image']:10.2f}{speedup:8.2f}x"
+          f"{results['exported']['psnr']:9.3f}{psnr_change:+9.3f}")
+    if not report['accepted']:
+        print(f"WARNING: the exported model loses {-psnr_change:.3f} dB of PSNR, more than the "
+              f"{max_psnr_drop} dB accepted. Try exporting it with --no-quantize or without --bf16.")
+    print(f"Model exported to '{export_dir}'")
+    return report
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help="the trained liif model checkpoint path")
+    parser.add_argument('--output', default=None,
+                        help="export directory (default '<checkpoint>-cpu-<precision>')")
+    parser.add_argument('--quantize', dest='quantize', action='store_true', default=True,
+                        help="quantize the imnet Linear layers to int8 (default)")
+    parser.add_argument('--no-quantize', dest='quantize', action='store_false',
+                        help="keep the imnet Linear layers in fp32")
+    parser.add_argument('--bf16', action='store_true', help="run the model under bf16 autocast")
+    parser.add_argument('--test-dir', default=DEFAULT_TEST_DIR, help="prepared test split used in the comparison")
+    parser.add_argument('--max-images', type=int, default=DEFAULT_MAX_IMAGES,
+                        help="test images used in the comparison")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="number of images encoded together")
+    parser.add_argument('--max-psnr-drop', type=float, default=DEFAULT_MAX_PSNR_DROP,
+                        help="largest PSNR loss accepted, in dB")
+    parser.add_argument('--threads', type=int, default=None, help="intra-op threads used on CPU")
+    args = parser.parse_args()
+    configure_device('cpu', threads=args.threads)
+    export_report = export_model(args.model, args.output, args.quantize, args.bf16, args.test_dir, args.max_images,
+                                 args.batch_size, args.max_psnr_drop)
+    if not export_report['accepted']:
+        raise SystemExit(1)
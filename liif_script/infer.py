@@ -8,15 +8,56 @@ https://github.com/yinboc/liif.
 """
 
 import argparse
+import contextlib
+import json
+import math
 import os
+import pickle
+import queue
+import tempfile
+import threading
+import time
 from PIL import Image
 import glob
+import numpy as np
 import torch
 from torchvision import transforms
 
 import models
-from utils import make_coord
-from test import batched_predict
+from infer_cache import DEFAULT_FEATURE_CACHE_MB, DEFAULT_GRID_CACHE_MB, FEATURE_CACHE, GRID_CACHE, coord_cell
+from liif_query import patch_query_rgb
+from tile_io import LazyImage, PngWriter, open_lazy_image
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_QUERY_CHUNK = 30000
+DEFAULT_OUTPUT_SIZE = (256, 256)
+DEFAULT_TILE_OVERLAP = 16
+
+# Rough memory used by a query point in the default LIIF model (edsr-baseline +
+# 4x256 mlp): 4 local ensemble passes of (64 * 9 + 4) inputs, 4 * 256 hidden
+# values and 3 outputs, in float32, twice to account for temporary tensors.
+QUERY_BYTES = 2 * 4 * (64 * 9 + 4 + 4 * 256 + 3) * 4
+# Encoder feature map values per input pixel (64 channels, unfolded 3x3)
+FEATURE_BYTES_PER_PIXEL = 64 * 9 * 4
+
+# Files of a model exported by export_model.py
+EXPORT_META_NAME = 'export.json'
+ENCODER_FILE = 'encoder.pt'
+IMNET_FILE = 'imnet.pt'
+
+# Inputs accepted and sizes of the decode -> compute -> write pipeline
+IMAGE_EXTENSIONS = ('.png', '.tif', '.tiff', '.jpg', '.jpeg', '.bmp')
+DEFAULT_DECODE_WORKERS = 4
+DEFAULT_WRITE_WORKERS = 2
+DEFAULT_PREFETCH = 64
+# Marks the end of the items of a pipeline queue
+_END = object()
 
 ###############################################################################
 #                                                                             #
@@ -24,35 +65,705 @@ from test import batched_predict
 #                                                                             #
 ###############################################################################
 
-def infer_images(input:str, output:str, model:str, gpu:str) -> None:
+def auto_batch_sizes(mem_budget_mb: float, in_h: int, in_w: int, h: int, w: int,
+                     batch_size: int = DEFAULT_BATCH_SIZE) -> tuple:
+    """This function chooses the number of images encoded together and the number
+    of query points evaluated in a single call so both fit in the given budget.
+
+    Args:
+        mem_budget_mb (float): memory available for the inference in MB
+        in_h (int): height of the input images
+        in_w (int): width of the input images
+        h (int): height of the output images
+        w (int): width of the output images
+        batch_size (int, optional): largest batch size wanted. Defaults to DEFAULT_BATCH_SIZE.
+
+    Returns:
+        tuple: (batch size, query chunk) where the query chunk counts the points of the whole batch
+    """
+    budget = mem_budget_mb * 1024 * 1024
+    feature_bytes = in_h * in_w * FEATURE_BYTES_PER_PIXEL
+    batch_size = max(1, min(batch_size, int(budget // (2 * feature_bytes))))
+    query_chunk = int((budget - batch_size * feature_bytes) // QUERY_BYTES)
+    # Less than a full output row per image is not worth a bigger batch
+    while batch_size > 1 and query_chunk < batch_size * w:
+        batch_size //= 2
+        query_chunk = int((budget - batch_size * feature_bytes) // QUERY_BYTES)
+    return batch_size, max(query_chunk, batch_size)
+
+
+def configure_device(device: str = None, gpu: str = None, threads: int = None,
+                     interop_threads: int = None) -> torch.device:
+    """This function selects the device used by the inference. It must be called before
+    anything touches CUDA, as CUDA_VISIBLE_DEVICES is only read when CUDA is initialized.
+
+    Args:
+        device (str, optional): 'cpu', 'cuda' or 'cuda:N'. Defaults to cuda if available, else cpu.
+        gpu (str, optional): value for CUDA_VISIBLE_DEVICES, kept for the old '--gpu' option. Defaults to None.
+        threads (int, optional): intra-op threads used on CPU. Defaults to torch's default.
+        interop_threads (int, optional): inter-op threads used on CPU. Defaults to torch's default.
+
+    Returns:
+        torch.device: the selected device
+    """
+    if gpu is not None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = gpu
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    device = torch.device(device)
+    if device.type == 'cuda' and not torch.cuda.is_available():
+        raise RuntimeError(f"The device '{device}' was requested but CUDA is not available")
+
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        torch.set_num_interop_threads(interop_threads)
+    return device
+
+
+def load_model_spec(model_path: str) -> dict:
+    """This function loads the 'model' spec of a checkpoint on cpu, memory mapped and
+    weights only, so the parts that are not used (the optimizer state) are never read
+    into memory nor copied to the device: only the model built from the spec is moved
+    there. Older torch versions without mmap (< 2.1) or weights only (< 1.13) loading,
+    checkpoints in the legacy format and the ones holding other objects are loaded the
+    usual way, still on cpu.
+
+    Args:
+        model_path (str): the checkpoint path
+
+    Returns:
+        dict: the 'model' spec of the checkpoint (name, args and sd)
+    """
+    for options in ({'weights_only': True, 'mmap': True}, {'weights_only': True}):
+        try:
+            return torch.load(model_path, map_location='cpu', **options)['model']
+        except (TypeError, RuntimeError, pickle.UnpicklingError):
+            continue
+    return torch.load(model_path, map_location='cpu')['model']
+
+
+def load_model(model_path: str, device: torch.device, channels_last: bool = False) -> torch.nn.Module:
+    """This function builds the liif model stored in a checkpoint on the given device.
+    A directory written by export_model.py can be given instead of a checkpoint.
+
+    Args:
+        model_path (str): the trained liif model checkpoint path, or an exported model directory
+        device (torch.device): device where the model will run
+        channels_last (bool, optional): use the channels last memory layout. Defaults to False.
+
+    Returns:
+        torch.nn.Module: the model in eval mode
+    """
+    if os.path.isdir(model_path):
+        return load_exported(model_path, device, channels_last)
+    patch_query_rgb()
+    model_spec = load_model_spec(model_path)
+    use_model = models.make(model_spec, load_sd=True).to(device).eval()
+    if channels_last:
+        use_model = use_model.to(memory_format=torch.channels_last)
+    return use_model
+
+
+def load_exported(export_dir: str, device: torch.device, channels_last: bool = False) -> torch.nn.Module:
+    """This function builds a liif model whose encoder and imnet layers are the
+    TorchScript modules written by export_model.py.
+
+    Args:
+        export_dir (str): exported model directory
+        device (torch.device): device where the model will run
+        channels_last (bool, optional): use the channels last memory layout. Defaults to False.
+
+    Raises:
+        FileNotFoundError: raised if the directory does not contain an exported model
+
+    Returns:
+        torch.nn.Module: the model in eval mode, with its 'precision' ('fp32' or 'bf16')
+    """
+    meta_path = os.path.join(export_dir, EXPORT_META_NAME)
+    if not os.path.isfile(meta_path):
+        raise FileNotFoundError(f"The file '{EXPORT_META_NAME}' could not be found in '{export_dir}'!!")
+    with open(meta_path, 'r') as meta_file:
+        meta = json.load(meta_file)
+    if meta.get('quantized') and device.type != 'cpu':
+        raise RuntimeError(f"'{export_dir}' holds int8 layers, which only run on cpu")
+
+    # Built without weights, the modules holding them are replaced by the exported ones
+    patch_query_rgb()
+    use_model = models.make(meta['model'])
+    use_model.encoder = torch.jit.load(os.path.join(export_dir, ENCODER_FILE), map_location=device)
+    if meta.get('imnet'):
+        use_model.imnet.layers = torch.jit.load(os.path.join(export_dir, IMNET_FILE), map_location=device)
+    use_model = use_model.to(device).eval()
+    if channels_last:
+        use_model = use_model.to(memory_format=torch.channels_last)
+    use_model.precision = meta.get('precision', 'fp32')
+    return use_model
+
+
+def precision_context(model, device_type: str):
+    """This function returns the context the model has to run in: bf16 autocast for
+    the models exported with bf16 precision, nothing otherwise.
+
+    Args:
+        model (torch.nn.Module): liif model
+        device_type (str): type of the device of the inputs
+
+    Returns:
+        context manager: the context to run the model in
+    """
+    if getattr(model, 'precision', 'fp32') == 'bf16':
+        return torch.autocast(device_type=device_type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def encode(model, inp: torch.Tensor, keys: list = None) -> torch.Tensor:
+    """This function runs the encoder on a batch of normalized images and leaves the
+    features ready in the model for query_rgb. When keys identifying the images are
+    given, the features of every image are cached, and the encoder is skipped if all
+    of them were already cached.
+
+    Args:
+        model (torch.nn.Module): liif model
+        inp (torch.Tensor): normalized input images (b, 3, h, w)
+        keys (list, optional): one hashable key per image. Defaults to None (no caching).
+
+    Returns:
+        torch.Tensor: the feature map of the batch
+    """
+    with torch.inference_mode(), precision_context(model, inp.device.type):
+        if keys:
+            cached = [FEATURE_CACHE.get(key) for key in keys]
+            if all(feat is not None for feat in cached):
+                model.feat = torch.stack(cached)
+                return model.feat
+        feat = model.gen_feat(inp)
+        if keys:
+            for key, image_feat in zip(keys, feat):
+                FEATURE_CACHE.put(key, image_feat.clone())
+        return feat
+
+
+def query(model, coord: torch.Tensor, cell: torch.Tensor, query_chunk: int) -> torch.Tensor:
+    """This function queries the features left in the model by encode, evaluating
+    query_chunk points of the whole batch per call.
+
+    Args:
+        model (torch.nn.Module): liif model
+        coord (torch.Tensor): query coordinates (b, q, 2)
+        cell (torch.Tensor): query cells (b, q, 2)
+        query_chunk (int): number of query points of the whole batch evaluated per call
+
+    Returns:
+        torch.Tensor: predicted values (b, q, 3)
+    """
+    with torch.inference_mode(), precision_context(model, coord.device.type):
+        bsize = max(1, query_chunk // coord.shape[0])
+        n = coord.shape[1]
+        ql = 0
+        preds = []
+        while ql < n:
+            qr = min(ql + bsize, n)
+            preds.append(model.query_rgb(coord[:, ql: qr, :], cell[:, ql: qr, :]))
+            ql = qr
+        return torch.cat(preds, dim=1).float()
+
+
+def batched_predict(model, inp: torch.Tensor, coord: torch.Tensor, cell: torch.Tensor,
+                    query_chunk: int) -> torch.Tensor:
+    """This function encodes a batch of images once and queries the given coordinates
+    of every image in chunks of query_chunk points in total, so a chunk spans the whole
+    batch instead of a single image.
+
+    Args:
+        model (torch.nn.Module): liif model
+        inp (torch.Tensor): normalized input images (b, 3, h, w)
+        coord (torch.Tensor): query coordinates (b, q, 2)
+        cell (torch.Tensor): query cells (b, q, 2)
+        query_chunk (int): number of query points of the whole batch evaluated per call
+
+    Returns:
+        torch.Tensor: predicted values (b, q, 3)
+    """
+    encode(model, inp)
+    return query(model, coord, cell, query_chunk)
+
+
+def output_size_for(in_h: int, in_w: int, scale: float = None, output_size: tuple = None) -> tuple:
+    """This function resolves the size of the output image of an input image.
+
+    Args:
+        in_h (int): height of the input image
+        in_w (int): width of the input image
+        scale (float, optional): upsampling factor. Defaults to None.
+        output_size (tuple, optional): (h, w) of the output. Defaults to DEFAULT_OUTPUT_SIZE
+        when no scale is given either.
+
+    Returns:
+        tuple: (h, w) of the output image
+    """
+    if output_size:
+        return tuple(output_size)
+    if scale:
+        return int(round(in_h * scale)), int(round(in_w * scale))
+    return DEFAULT_OUTPUT_SIZE
+
+
+def _tile_starts(length: int, tile: int, overlap: int) -> list:
+    """This function returns where the tiles start along one axis so they cover the
+    whole length overlapping by (at least) the given number of pixels.
+
+    Args:
+        length (int): size of the axis
+        tile (int): size of a tile
+        overlap (int): overlap between consecutive tiles
+
+    Returns:
+        list: start position of every tile
+    """
+    if length <= tile:
+        return [0]
+    step = max(tile - overlap, 1)
+    starts = list(range(0, length - tile + 1, step))
+    if starts[-1] + tile < length:
+        starts.append(length - tile)
+    return starts
+
+
+def _feather(centers: np.ndarray, start: int, end: int, overlap: int, length: int) -> np.ndarray:
+    """This function computes the blending weight of the output pixels of a tile along
+    one axis. The weight grows linearly over the overlap from the tile edges, so the
+    weights of two overlapping tiles add up to one, except at the borders of the image.
+
+    Args:
+        centers (np.ndarray): centers of the output pixels, in input pixel units
+        start (int): first input pixel of the tile
+        end (int): end (exclusive) of the tile in input pixels
+        overlap (int): overlap between consecutive tiles
+        length (int): size of the input image along the axis
+
+    Returns:
+        np.ndarray: weight of every output pixel
+    """
+    weights = np.ones_like(centers, dtype=np.float32)
+    if overlap > 0:
+        if start > 0:
+            weights = np.minimum(weights, (centers - start) / overlap)
+        if end < length:
+            weights = np.minimum(weights, (end - centers) / overlap)
+    return np.clip(weights, 1e-3, 1).astype(np.float32)
+
+
+def infer_tiled(model, img: LazyImage, output_file: str, out_h: int, out_w: int, device: torch.device,
+                tile: int = 256, overlap: int = DEFAULT_TILE_OVERLAP, query_chunk: int = DEFAULT_QUERY_CHUNK,
+                memory_format=torch.contiguous_format, cache_key=None) -> None:
+    """This function infers an image of any size encoding overlapping input tiles one at
+    a time. Every tile answers the output pixels whose centers fall inside it and the
+    seams are blended with linear weights. The tiles are read one at a time from the
+    memory mapped input and blended into a rolling buffer one row of tiles high, overlap
+    included. After every row of tiles the finished rows are appended to the output PNG
+    and dropped from the buffer, so the memory used grows with the width of the output
+    and the tile size but not with its height.
+
+    Args:
+        model (torch.nn.Module): liif model
+        img (LazyImage): input image, see open_lazy_image
+        output_file (str): path of the output PNG image
+        out_h (int): height of the output image
+        out_w (int): width of the output image
+        device (torch.device): device where the model runs
+        tile (int, optional): side of the input tiles in pixels. Defaults to 256.
+        overlap (int, optional): overlap between input tiles in pixels. Defaults to DEFAULT_TILE_OVERLAP.
+        query_chunk (int, optional): query points evaluated per call. Defaults to DEFAULT_QUERY_CHUNK.
+        memory_format (torch.memory_format, optional): layout of the input tiles. Defaults to contiguous.
+        cache_key (hashable, optional): identifies the image, so the features of its tiles are
+        kept in FEATURE_CACHE and reused when the image is inferred at another size. Defaults to None.
+    """
+    in_w, in_h = img.size
+    scale_y = out_h / in_h
+    scale_x = out_w / in_w
+    overlap = min(overlap, tile // 2)
+    row_starts = _tile_starts(in_h, tile, overlap)
+    col_starts = _tile_starts(in_w, tile, overlap)
+
+    # Output rows covered by every row of tiles, the buffer holds the highest one
+    row_spans = [(max(0, math.ceil(y0 * scale_y - 0.5)), min(out_h, math.ceil(min(y0 + tile, in_h) * scale_y - 0.5)))
+                 for y0 in row_starts]
+    buffer_h = max(max(oy1 - oy0 for oy0, oy1 in row_spans), 1)
+    accumulated = np.zeros((buffer_h, out_w, 3), dtype=np.float32)
+    weights = np.zeros((buffer_h, out_w), dtype=np.float32)
+    # Output row stored in the first row of the buffer, everything above is written
+    flushed = 0
+
+    with PngWriter(output_file, out_w, out_h) as writer:
+        for row, y0 in enumerate(row_starts):
+            y1 = min(y0 + tile, in_h)
+            oy0, oy1 = row_spans[row]
+            centers_y = (np.arange(oy0, oy1, dtype=np.float32) + 0.5) / scale_y
+            weight_y = _feather(centers_y, y0, y1, overlap, in_h)
+
+            for x0 in col_starts:
+                x1 = min(x0 + tile, in_w)
+                ox0 = max(0, math.ceil(x0 * scale_x - 0.5))
+                ox1 = min(out_w, math.ceil(x1 * scale_x - 0.5))
+                centers_x = (np.arange(ox0, ox1, dtype=np.float32) + 0.5) / scale_x
+                weight_x = _feather(centers_x, x0, x1, overlap, in_w)
+                if oy1 <= oy0 or ox1 <= ox0:
+                    continue
+
+                pixels = torch.from_numpy(img.read((x0, y0, x1, y1)))
+                inp = pixels.permute(2, 0, 1).unsqueeze(0).to(device).float().div(255)
+                inp = inp.contiguous(memory_format=memory_format)
+                # Output pixel centers in the [-1, 1] coordinates of the tile
+                local_y = torch.from_numpy(2 * (centers_y - y0) / (y1 - y0) - 1)
+                local_x = torch.from_numpy(2 * (centers_x - x0) / (x1 - x0) - 1)
+                coord = torch.stack(torch.meshgrid(local_y, local_x, indexing='ij'), dim=-1)
+                coord = coord.view(1, -1, 2).to(device)
+                cell = torch.ones_like(coord)
+                cell[:, :, 0] *= 2 / (scale_y * (y1 - y0))
+                cell[:, :, 1] *= 2 / (scale_x * (x1 - x0))
+
+                encode(model, (inp - 0.5) / 0.5, [(cache_key, y0, x0, tile)] if cache_key is not None else None)
+                pred = query(model, coord, cell, query_chunk)[0]
+                pred = (pred * 0.5 + 0.5).clamp(0, 1).view(oy1 - oy0, ox1 - ox0, 3).cpu().numpy()
+                tile_weights = weight_y[:, None] * weight_x[None, :]
+                accumulated[oy0 - flushed:oy1 - flushed, ox0:ox1] += pred * tile_weights[:, :, None]
+                weights[oy0 - flushed:oy1 - flushed, ox0:ox1] += tile_weights
+
+            # Rows above the next row of tiles will not receive more contributions
+            ready = max(flushed, row_spans[row + 1][0]) if row + 1 < len(row_starts) else out_h
+            done = ready - flushed
+            if done > 0:
+                blended = accumulated[:done] / np.maximum(weights[:done], 1e-8)[:, :, None]
+                writer.write(np.round(blended * 255).astype(np.uint8))
+                # Move the rows still being blended to the top of the buffer
+                accumulated[:buffer_h - done] = accumulated[done:].copy()
+                weights[:buffer_h - done] = weights[done:].copy()
+                accumulated[buffer_h - done:] = 0
+                weights[buffer_h - done:] = 0
+                flushed = ready
+
+
+def list_images(input_dir: str) -> list:
+    """This function lists the images of a directory that can be inferred.
+
+    Args:
+        input_dir (str): directory containing the images
+
+    Returns:
+        list: sorted paths of the files with one of the IMAGE_EXTENSIONS
+    """
+    return sorted(path for path in glob.glob(os.path.join(input_dir, '*'))
+                  if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS)
+
+
+def decode_image(path: str) -> torch.Tensor:
+    """This function decodes an image into a (3, h, w) float tensor in [0, 1].
+
+    Args:
+        path (str): image path
+
+    Returns:
+        torch.Tensor: the decoded image
+    """
+    with Image.open(path) as img:
+        return transforms.ToTensor()(img.convert('RGB'))
+
+
+class StatsQueue:
+    """Bounded queue between two stages of the inference pipeline that records how
+    full it is when read and how long the stages wait on it. Producers waiting in put
+    are being held back by a slower consumer, consumers waiting in get are starved.
+    """
+
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.items = 0
+        self.depth_sum = 0
+        self.depth_max = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+        self._queue = queue.Queue(max(maxsize, 1))
+        self._lock = threading.Lock()
+
+    def put(self, item) -> None:
+        start = time.perf_counter()
+        self._queue.put(item)
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.put_wait += waited
+
+    def get(self):
+        depth = self._queue.qsize()
+        start = time.perf_counter()
+        item = self._queue.get()
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.get_wait += waited
+            if item is not _END:
+                self.items += 1
+                self.depth_sum += depth
+                self.depth_max = max(self.depth_max, depth)
+        return item
+
+    def summary(self) -> dict:
+        """Returns the counters of the queue."""
+        return {'items': self.items, 'mean_depth': self.depth_sum / max(self.items, 1),
+                'max_depth': self.depth_max, 'capacity': self._queue.maxsize,
+                'put_wait': self.put_wait, 'get_wait': self.get_wait}
+
+
+def _decoded_batches(paths: list, batch_size: int, workers: int, prefetch: int, ordered: bool,
+                     decoded: StatsQueue, failures: list):
+    """This function decodes the images in a pool of threads and groups them into
+    batches of images of the same size, as only those can be stacked into a single
+    tensor. At most 'prefetch' decoded images wait to be batched, so the decoders stop
+    when the compute stage falls behind. In ordered mode the images are batched in the
+    order of the paths, otherwise as soon as they are decoded.
+
+    Args:
+        paths (list): image paths
+        batch_size (int): largest number of images per batch
+        workers (int): number of decoding threads
+        prefetch (int): largest number of decoded images waiting to be batched
+        ordered (bool): batch the images in the order of the paths
+        decoded (StatsQueue): queue between the decoders and the compute stage
+        failures (list): (path, error) of the images that could not be decoded are appended
+
+    Yields:
+        list: list of (path, tensor) of a batch
+    """
+    todo = queue.Queue()
+    for item in enumerate(paths):
+        todo.put(item)
+    in_flight = threading.BoundedSemaphore(max(prefetch, 1))
+
+    def decoder():
+        while True:
+            in_flight.acquire()
+            try:
+                index, path = todo.get_nowait()
+            except queue.Empty:
+                in_flight.release()
+                break
+            try:
+                decoded.put((index, path, decode_image(path), None))
+            except (OSError, ValueError, SyntaxError) as err:
+                decoded.put((index, path, None, str(err)))
+        decoded.put(_END)
+
+    workers = max(1, min(workers, len(paths)))
+    for _ in range(workers):
+        threading.Thread(target=decoder, daemon=True).start()
+
+    pending = {}
+    next_index = 0
+    groups = {}
+    while workers:
+        item = decoded.get()
+        if item is _END:
+            workers -= 1
+            continue
+        if ordered:
+            pending[item[0]] = item
+            ready = []
+            while next_index in pending:
+                ready.append(pending.pop(next_index))
+                next_index += 1
+        else:
+            ready = [item]
+
+        for _, path, img, error in ready:
+            in_flight.release()
+            if error is not None:
+                print(f"The image '{path}' could not be decoded: {error}")
+                failures.append((path, error))
+                continue
+            group = groups.setdefault(tuple(img.shape), [])
+            group.append((path, img))
+            if len(group) == batch_size:
+                yield group
+                groups[tuple(img.shape)] = []
+    for group in groups.values():
+        if group:
+            yield group
+
+
+def _writer(written: StatsQueue, failures: list) -> None:
+    """This function saves the predictions put in the queue until it receives _END.
+
+    Args:
+        written (StatsQueue): queue of (prediction, output file) between the compute stage and the writers
+        failures (list): (path, error) of the outputs that could not be saved are appended
+    """
+    while True:
+        item = written.get()
+        if item is _END:
+            return
+        pred, output_file = item
+        try:
+            transforms.ToPILImage()(pred).save(output_file)
+        except (OSError, ValueError) as err:
+            print(f"The image '{output_file}' could not be saved: {err}")
+            failures.append((output_file, str(err)))
+
+
+def print_pipeline_stats(queues: list, compute_time: float, wall_time: float) -> None:
+    """This function prints the depth and wait times of the pipeline queues, so the
+    slowest stage can be spotted: the stage before a full queue with long put waits is
+    waiting for the next one, and a stage with long get waits is starved.
+
+    Args:
+        queues (list): StatsQueue of every step of the pipeline
+        compute_time (float): seconds spent in the compute stage
+        wall_time (float): seconds spent in the whole pipeline
+    """
+    print(f"Pipeline: {wall_time:.2f}s in total, {compute_time:.2f}s computing")
+    print(f"{'queue':20}{'items':>8}{'mean depth':>12}{'max depth':>11}{'put wait':>10}{'get wait':>10}")
+    for stats_queue in queues:
+        summary = stats_queue.summary()
+        print(f"{stats_queue.name:20}{summary['items']:8d}{summary['mean_depth']:12.1f}"
+              f"{summary['max_depth']:7d}/{summary['capacity']:<3d}{summary['put_wait']:9.2f}s"
+              f"{summary['get_wait']:9.2f}s")
+
+
+def infer_images(input:str, output:str, model:str, device: torch.device = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, query_chunk: int = DEFAULT_QUERY_CHUNK,
+                 mem_budget: float = None, channels_last: bool = None, scale: float = None,
+                 output_size: tuple = None, tile: int = None, tile_overlap: int = DEFAULT_TILE_OVERLAP,
+                 scales: list = None, decode_workers: int = DEFAULT_DECODE_WORKERS,
+                 write_workers: int = DEFAULT_WRITE_WORKERS, prefetch: int = DEFAULT_PREFETCH,
+                 ordered: bool = True) -> dict:
     """This function will take an input directory, an output directory,
-    a trained liif model and a gpu id and will infer the input images
-    into the output directory using the given model and CUDA gpu.
+    a trained liif model and a device and will infer the input images
+    into the output directory using the given model and device.
+
+    The images that are not inferred by tiles go through a pipeline: a pool of threads
+    decodes them ahead of the model, and another one saves the predictions, so the
+    device does not wait for the disk. Both pools are bounded by queues, so a slow stage
+    holds back the previous one instead of filling the memory.
 
     Args:
         input (str): the input directory containing the base images
         output (str): the output directory to store the infered images
         model (str): the trained liif model checkpoint path
-        gpu (str): the gpu to use
-    """
-    h = 256
-    w = 256
-    coord = make_coord((h, w)).cuda()
-    use_model = models.make(torch.load(model)['model'], load_sd=True).cuda()
-    cell = torch.ones_like(coord)
-    cell[:, 0] *= 2 / h
-    cell[:, 1] *= 2 / w
-    os.environ['CUDA_VISIBLE_DEVICES'] = gpu
+        device (torch.device, optional): the device to use, see configure_device. Defaults to None.
+        batch_size (int, optional): number of images encoded together. Defaults to DEFAULT_BATCH_SIZE.
+        query_chunk (int, optional): query points of the whole batch per call. Defaults to DEFAULT_QUERY_CHUNK.
+        mem_budget (float, optional): memory budget in MB used to choose batch_size and
+        query_chunk automatically. Defaults to None.
+        channels_last (bool, optional): use the channels last memory layout. Defaults to True on CPU.
+        scale (float, optional): upsampling factor of the outputs. Defaults to None.
+        output_size (tuple, optional): (h, w) of the outputs. Defaults to 256x256 when no scale is given.
+        tile (int, optional): images larger than this side are inferred by tiles. Defaults to None (never).
+        tile_overlap (int, optional): overlap between tiles in input pixels. Defaults to DEFAULT_TILE_OVERLAP.
+        scales (list, optional): several upsampling factors answered from a single encoding of
+        every image, stored as '<name>_x<scale>_infered.png'. Defaults to None.
+        decode_workers (int, optional): threads decoding the inputs. Defaults to DEFAULT_DECODE_WORKERS.
+        write_workers (int, optional): threads saving the outputs. Defaults to DEFAULT_WRITE_WORKERS.
+        prefetch (int, optional): largest number of decoded images waiting for the model,
+        also used as the size of the queue of outputs waiting to be saved. Defaults to DEFAULT_PREFETCH.
+        ordered (bool, optional): batch the images in name order instead of as soon as
+        they are decoded. Defaults to True.
+
+    Returns:
+        dict: number of 'images' inferred, 'failed' (path, error) list and pipeline 'stats'
+    """
+    device = device if isinstance(device, torch.device) else configure_device(device)
+    if channels_last is None:
+        channels_last = device.type == 'cpu'
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    if scales:
+        targets = [(f"_x{target:g}", target, None) for target in scales]
+    else:
+        targets = [('', scale, output_size)]
+
+    use_model = load_model(model, device, channels_last)
     output_path = os.path.join(os.getcwd(), output)
     os.makedirs(output_path, exist_ok=True)
-    if os.path.isdir(input):
-        for input_img in glob.glob(os.path.join(input, '*.png')):
-            file_name = os.path.splitext(os.path.basename(input_img))[0]
-            img = transforms.ToTensor()(Image.open(input_img).convert('RGB'))
-            pred = batched_predict(use_model, ((img - 0.5) / 0.5).cuda().unsqueeze(0),
-                coord.unsqueeze(0), cell.unsqueeze(0), bsize=30000)[0]
-            pred = (pred * 0.5 + 0.5).clamp(0, 1).view(h, w, 3).permute(2, 0, 1).cpu()
-            transforms.ToPILImage()(pred).save(os.path.join(output_path, f"{file_name}_infered.png"))
+    summary = {'images': 0, 'failed': [], 'stats': {}}
+    if not os.path.isdir(input):
+        return summary
+
+    if tile:
+        # Scenes inferred by tiles may be far bigger than PIL's decompression bomb limit
+        Image.MAX_IMAGE_PIXELS = None
+    paths = list_images(input)
+    sizes = {}
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                sizes[path] = img.size
+        except (OSError, SyntaxError) as err:
+            print(f"The image '{path}' could not be opened: {err}")
+            summary['failed'].append((path, str(err)))
+    paths = [path for path in paths if path in sizes]
+    tiled = [path for path in paths if tile and max(sizes[path]) > tile]
+    batched = [path for path in paths if not (tile and max(sizes[path]) > tile)]
+
+    for input_img in tiled:
+        in_w, in_h = sizes[input_img]
+        file_name = os.path.splitext(os.path.basename(input_img))[0]
+        # The scene is read tile by tile, a compressed one through a copy next to the outputs
+        with tempfile.TemporaryDirectory(dir=output_path) as tmp_dir:
+            img = open_lazy_image(input_img, tmp_dir)
+            for suffix, target_scale, target_size in targets:
+                h, w = output_size_for(in_h, in_w, target_scale, target_size)
+                infer_tiled(use_model, img, os.path.join(output_path, f"{file_name}{suffix}_infered.png"),
+                            h, w, device, tile, tile_overlap, query_chunk, memory_format,
+                            cache_key=(model, input_img) if len(targets) > 1 else None)
+            del img
+        summary['images'] += 1
+    if not batched:
+        return summary
+
+    if mem_budget:
+        in_w, in_h = sizes[batched[0]]
+        h, w = max(output_size_for(in_h, in_w, target_scale, target_size)
+                   for _, target_scale, target_size in targets)
+        batch_size, query_chunk = auto_batch_sizes(mem_budget, in_h, in_w, h, w, batch_size)
+        print(f"Using batch_size={batch_size} and query_chunk={query_chunk}")
+
+    start = time.perf_counter()
+    compute_time = 0.0
+    decoded = StatsQueue('decode -> compute', prefetch)
+    written = StatsQueue('compute -> write', prefetch)
+    writers = [threading.Thread(target=_writer, args=(written, summary['failed']), daemon=True)
+               for _ in range(max(write_workers, 1))]
+    for writer in writers:
+        writer.start()
+    try:
+        for batch in _decoded_batches(batched, batch_size, decode_workers, prefetch, ordered,
+                                      decoded, summary['failed']):
+            compute_start = time.perf_counter()
+            inp = torch.stack([img for _, img in batch]).to(device).contiguous(memory_format=memory_format)
+            n, _, in_h, in_w = inp.shape
+            # Encoded once, every target size is queried from the same feature map
+            encode(use_model, (inp - 0.5) / 0.5)
+            outputs = []
+            for suffix, target_scale, target_size in targets:
+                h, w = output_size_for(in_h, in_w, target_scale, target_size)
+                coord, cell = coord_cell(h, w, device)
+                preds = query(use_model, coord.unsqueeze(0).expand(n, -1, -1), cell.unsqueeze(0).expand(n, -1, -1),
+                              query_chunk)
+                preds = (preds * 0.5 + 0.5).clamp(0, 1).view(n, h, w, 3).permute(0, 3, 1, 2).cpu()
+                for (input_img, _), pred in zip(batch, preds):
+                    file_name = os.path.splitext(os.path.basename(input_img))[0]
+                    outputs.append((pred, os.path.join(output_path, f"{file_name}{suffix}_infered.png")))
+            compute_time += time.perf_counter() - compute_start
+            for output in outputs:
+                written.put(output)
+            summary['images'] += n
+    finally:
+        for _ in writers:
+            written.put(_END)
+        for writer in writers:
+            writer.join()
+
+    summary['stats'] = {'wall_time': time.perf_counter() - start, 'compute_time': compute_time,
+                        'queues': {decoded.name: decoded.summary(), written.name: written.summary()}}
+    print_pipeline_stats([decoded, written], compute_time, summary['stats']['wall_time'])
+    return summary
 
 
 ###############################################################################
@@ -66,9 +777,51 @@ if __name__ == '__main__':
     parser.add_argument('--input', default='load\\test_64_256\\lr_64')
     parser.add_argument('--model')
     parser.add_argument('--output', default='output')
-    parser.add_argument('--gpu', default='0')
+    parser.add_argument('--gpu', default=None,
+                        help="value for CUDA_VISIBLE_DEVICES, set before CUDA is initialized")
+    parser.add_argument('--device', default=None,
+                        help="cpu, cuda or cuda:N. Defaults to cuda if available, else cpu")
+    parser.add_argument('--threads', type=int, default=None, help="intra-op threads used on CPU")
+    parser.add_argument('--interop-threads', type=int, default=None, help="inter-op threads used on CPU")
+    parser.add_argument('--channels-last', dest='channels_last', action='store_true', default=None,
+                        help="use the channels last memory layout (default on CPU)")
+    parser.add_argument('--no-channels-last', dest='channels_last', action='store_false',
+                        help="use the contiguous memory layout (default on GPU)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="number of images encoded together")
+    parser.add_argument('--query-chunk', type=int, default=DEFAULT_QUERY_CHUNK,
+                        help="query points of the whole batch evaluated per call")
+    parser.add_argument('--mem-budget', type=float, default=None,
+                        help="memory budget in MB, chooses --batch-size and --query-chunk automatically")
+    parser.add_argument('--scale', type=float, default=None, help="upsampling factor of the outputs")
+    parser.add_argument('--output-size', type=int, nargs=2, default=None, metavar=('H', 'W'),
+                        help="size of the outputs (default 256 256 when no --scale is given)")
+    parser.add_argument('--tile', type=int, default=None,
+                        help="infer images larger than this side by overlapping tiles of this size")
+    parser.add_argument('--tile-overlap', type=int, default=DEFAULT_TILE_OVERLAP,
+                        help="overlap between tiles in input pixels")
+    parser.add_argument('--scales', type=float, nargs='+', default=None,
+                        help="several upsampling factors answered from a single encoding, e.g. 2 3 4 6")
+    parser.add_argument('--grid-cache-mb', type=float, default=DEFAULT_GRID_CACHE_MB,
+                        help="memory limit of the coordinate grid cache")
+    parser.add_argument('--feature-cache-mb', type=float, default=DEFAULT_FEATURE_CACHE_MB,
+                        help="memory limit of the encoder feature cache")
+    parser.add_argument('--decode-workers', type=int, default=DEFAULT_DECODE_WORKERS,
+                        help="threads decoding the inputs ahead of the model")
+    parser.add_argument('--write-workers', type=int, default=DEFAULT_WRITE_WORKERS,
+                        help="threads saving the outputs in the background")
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH,
+                        help="largest number of decoded inputs and of pending outputs")
+    parser.add_argument('--ordered', dest='ordered', action='store_true', default=True,
+                        help="batch the inputs in name order (default)")
+    parser.add_argument('--no-ordered', dest='ordered', action='store_false',
+                        help="batch the inputs as soon as they are decoded")
     args = parser.parse_args()
-    print("Infering new images...")
-    infer_images(args.input, args.output, args.model, args.gpu)
+    GRID_CACHE.max_bytes = int(args.grid_cache_mb * 1024 * 1024)
+    FEATURE_CACHE.max_bytes = int(args.feature_cache_mb * 1024 * 1024)
+    selected_device = configure_device(args.device, args.gpu, args.threads, args.interop_threads)
+    print(f"Infering new images on {selected_device}...")
+    infer_images(args.input, args.output, args.model, selected_device, args.batch_size, args.query_chunk,
+                 args.mem_budget, args.channels_last, args.scale, args.output_size, args.tile, args.tile_overlap,
+                 args.scales, args.decode_workers, args.write_workers, args.prefetch, args.ordered)
     print("All images have been infered...")
-   
\ No newline at end of file
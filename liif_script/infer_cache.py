@@ -0,0 +1,104 @@
+"""
+This module contains the caches of the LIIF inference: the query coordinate grids
+of every output size and the encoder features of every image, kept under a memory
+limit. Is meant to be copied next to infer.py.
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+from collections import OrderedDict
+
+import torch
+
+from utils import make_coord
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+# Memory limits of the coordinate grid and encoder feature caches
+DEFAULT_GRID_CACHE_MB = 256
+DEFAULT_FEATURE_CACHE_MB = 1024
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+class TensorCache:
+    """Least recently used cache of tensors (or tuples of tensors) whose total size
+    is kept under a memory limit, evicting the oldest entries first.
+    """
+
+    def __init__(self, max_mb: float):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    @staticmethod
+    def _size(value) -> int:
+        tensors = value if isinstance(value, (tuple, list)) else (value,)
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+    def __contains__(self, key) -> bool:
+        return key in self._items
+
+    def get(self, key):
+        """Returns the cached value or None, marking it as the most recently used."""
+        if key not in self._items:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(key)
+        return self._items[key][0]
+
+    def put(self, key, value) -> None:
+        """Stores a value, evicting the least recently used ones until it fits.
+        Values bigger than the whole cache are not stored."""
+        size = self._size(value)
+        if key in self._items:
+            self.bytes -= self._items.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        while self._items and self.bytes + size > self.max_bytes:
+            self.bytes -= self._items.popitem(last=False)[1][1]
+        self._items[key] = (value, size)
+        self.bytes += size
+
+    def clear(self) -> None:
+        self._items.clear()
+        self.bytes = 0
+
+
+GRID_CACHE = TensorCache(DEFAULT_GRID_CACHE_MB)
+FEATURE_CACHE = TensorCache(DEFAULT_FEATURE_CACHE_MB)
+
+
+def coord_cell(h: int, w: int, device: torch.device) -> tuple:
+    """This function returns the query coordinates and cells of an output of the
+    given size, reusing the ones built before for the same size and device.
+
+    Args:
+        h (int): height of the output
+        w (int): width of the output
+        device (torch.device): device of the tensors
+
+    Returns:
+        tuple: coord (h * w, 2) and cell (h * w, 2) tensors
+    """
+    key = (h, w, str(device))
+    grid = GRID_CACHE.get(key)
+    if grid is None:
+        coord = make_coord((h, w)).to(device)
+        cell = torch.ones_like(coord)
+        cell[:, 0] *= 2 / h
+        cell[:, 1] *= 2 / w
+        grid = (coord, cell)
+        GRID_CACHE.put(key, grid)
+    return grid
@@ -0,0 +1,376 @@
+"""
+This module contains a local inference server that keeps trained Liif models
+loaded, so inferring a few images does not pay for importing torch and loading
+the checkpoint every time. Is meant to be uses as an extra script for the git
+project https://github.com/yinboc/liif, next to infer.py.
+
+The server listens on localhost and answers:
+
+    GET  /health                                    device, loaded models and batching stats
+    GET  /models                                    checkpoints found in the save directory
+    POST /infer?model=<checkpoint>&scale=<s>        image bytes in the body, PNG in the response
+    POST /infer?model=<checkpoint>&size=<h>x<w>
+
+The checkpoints are given relative to the save directory. Concurrent requests are
+grouped into micro batches of images of the same size and model, encoded together.
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import io
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from infer import DEFAULT_QUERY_CHUNK, EXPORT_META_NAME, configure_device, encode, load_model, output_size_for, query
+from infer_cache import coord_cell
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_SAVE_DIR = 'save'
+DEFAULT_MAX_MODELS = 2
+DEFAULT_MAX_BATCH = 16
+DEFAULT_MAX_WAIT_MS = 5.0
+# Largest request body accepted, in bytes
+MAX_UPLOAD_BYTES = 64 * 1024 * 1024
+# Largest output image a request may ask for, in pixels
+MAX_OUTPUT_PIXELS = 4096 * 4096
+# Side of the image inferred with every startup model before serving
+WARMUP_SIZE = 8
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+class ModelRegistry:
+    """Checkpoints of the save directory loaded on demand and kept in memory, evicting
+    the least recently used one when more than max_models are requested.
+    """
+
+    def __init__(self, save_dir: str, device: torch.device, channels_last: bool = False,
+                 max_models: int = DEFAULT_MAX_MODELS):
+        self.save_dir = os.path.abspath(save_dir)
+        self.device = device
+        self.channels_last = channels_last
+        self.max_models = max(max_models, 1)
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, name: str) -> str:
+        """Returns the full path of a checkpoint, or of a model exported by export_model.py,
+        given relative to the save directory.
+
+        Raises:
+            FileNotFoundError: raised if there is no such checkpoint inside the save directory
+        """
+        path = os.path.abspath(os.path.join(self.save_dir, name))
+        is_checkpoint = path.endswith('.pth') and os.path.isfile(path)
+        is_export = os.path.isfile(os.path.join(path, EXPORT_META_NAME))
+        if os.path.commonpath([path, self.save_dir]) != self.save_dir or not (is_checkpoint or is_export):
+            raise FileNotFoundError(f"The checkpoint '{name}' could not be found in '{self.save_dir}'!!")
+        return path
+
+    def get(self, name: str) -> torch.nn.Module:
+        """Returns the model of a checkpoint, loading it if it is not in memory yet."""
+        path = self.resolve(name)
+        with self._lock:
+            if path in self._models:
+                self._models.move_to_end(path)
+                return self._models[path]
+            start = time.perf_counter()
+            model = load_model(path, self.device, self.channels_last)
+            while len(self._models) >= self.max_models:
+                self._models.popitem(last=False)
+            self._models[path] = model
+            print(f"Loaded '{name}' in {time.perf_counter() - start:.2f}s")
+            return model
+
+    def loaded(self) -> list:
+        """Returns the checkpoints in memory, relative to the save directory."""
+        with self._lock:
+            return [os.path.relpath(path, self.save_dir) for path in self._models]
+
+    def available(self) -> list:
+        """Returns every checkpoint and exported model of the save directory, relative to it."""
+        checkpoints = []
+        for root, _, files in os.walk(self.save_dir):
+            if EXPORT_META_NAME in files:
+                checkpoints.append(os.path.relpath(root, self.save_dir))
+            for found in files:
+                if found.endswith('.pth'):
+                    checkpoints.append(os.path.relpath(os.path.join(root, found), self.save_dir))
+        return sorted(checkpoints)
+
+
+class MicroBatcher:
+    """Single thread running the models. Requests arriving within max_wait_ms of the
+    first one of a batch, up to max_batch, are grouped by model, input size and output
+    size, and every group is encoded and queried at once.
+    """
+
+    def __init__(self, registry: ModelRegistry, max_batch: int = DEFAULT_MAX_BATCH,
+                 max_wait_ms: float = DEFAULT_MAX_WAIT_MS, query_chunk: int = DEFAULT_QUERY_CHUNK):
+        self.registry = registry
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait_ms / 1000
+        self.query_chunk = query_chunk
+        self.memory_format = torch.channels_last if registry.channels_last else torch.contiguous_format
+        self.requests = 0
+        self.batches = 0
+        self.compute_time = 0.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, name: str, img: torch.Tensor, out_size: tuple) -> Future:
+        """Queues an image (3, h, w) in [0, 1] to be inferred with the given checkpoint
+        at the given (h, w), returning a future with the (h, w, 3) uint8 prediction."""
+        future = Future()
+        self._queue.put((name, img, tuple(out_size), future))
+        return future
+
+    def warm_up(self, names: list) -> None:
+        """Runs a small request through every given model and waits for it, so a model
+        that can not run on the device fails here instead of in every request. The
+        warm up requests are not counted in the stats."""
+        futures = [self.submit(name, torch.zeros(3, WARMUP_SIZE, WARMUP_SIZE), (2 * WARMUP_SIZE, 2 * WARMUP_SIZE))
+                   for name in names]
+        for future in futures:
+            future.result()
+        self.requests = 0
+        self.batches = 0
+        self.compute_time = 0.0
+
+    def stats(self) -> dict:
+        return {'requests': self.requests, 'batches': self.batches,
+                'mean_batch': self.requests / max(self.batches, 1), 'compute_time': self.compute_time}
+
+    def _collect(self) -> list:
+        """Waits for a request and gathers the ones arriving during the batching window."""
+        pending = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(pending) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                pending.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return pending
+
+    def _run(self) -> None:
+        while True:
+            groups = OrderedDict()
+            for request in self._collect():
+                name, img, out_size, _ = request
+                groups.setdefault((name, tuple(img.shape), out_size), []).append(request)
+
+            for (name, _, (h, w)), requests in groups.items():
+                start = time.perf_counter()
+                try:
+                    model = self.registry.get(name)
+                    inp = torch.stack([img for _, img, _, _ in requests]).to(self.registry.device)
+                    inp = inp.contiguous(memory_format=self.memory_format)
+                    n = inp.shape[0]
+                    encode(model, (inp - 0.5) / 0.5)
+                    coord, cell = coord_cell(h, w, self.registry.device)
+                    preds = query(model, coord.unsqueeze(0).expand(n, -1, -1), cell.unsqueeze(0).expand(n, -1, -1),
+                                  self.query_chunk)
+                    preds = (preds * 0.5 + 0.5).clamp(0, 1).mul(255).round().byte().view(n, h, w, 3).cpu().numpy()
+                except Exception as err:
+                    for _, _, _, future in requests:
+                        future.set_exception(err)
+                    continue
+                finally:
+                    self.compute_time += time.perf_counter() - start
+                self.requests += len(requests)
+                self.batches += 1
+                for (_, _, _, future), pred in zip(requests, preds):
+                    future.set_result(pred)
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    """HTTP requests of the inference server. The batcher and the default checkpoint
+    are taken from the server instance."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json') -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, content: dict) -> None:
+        self._send(status, json.dumps(content).encode())
+
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path
+        batcher = self.server.batcher
+        if path == '/health':
+            self._send_json(200, {'device': str(batcher.registry.device), 'loaded': batcher.registry.loaded(),
+                                  'default_model': self.server.default_model, 'stats': batcher.stats()})
+        elif path == '/models':
+            self._send_json(200, {'available': batcher.registry.available(),
+                                  'loaded': batcher.registry.loaded()})
+        else:
+            self._send_json(404, {'error': f"Unknown path '{path}'"})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        # The body is not read when the request is rejected here, so the connection is
+        # closed instead of reading the body as the next request
+        if url.path != '/infer':
+            self.close_connection = True
+            self._send_json(404, {'error': f"Unknown path '{url.path}'"})
+            return
+        if not 0 < length <= MAX_UPLOAD_BYTES:
+            self.close_connection = True
+            self._send_json(413 if length > MAX_UPLOAD_BYTES else 400,
+                            {'error': f"The body must hold an image of up to {MAX_UPLOAD_BYTES} bytes"})
+            return
+        body = self.rfile.read(length)
+
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        name = params.get('model', self.server.default_model)
+        try:
+            if not name:
+                raise ValueError("No 'model' was given and the server has no default one")
+            scale = float(params['scale']) if 'scale' in params else None
+            size = tuple(int(value) for value in params['size'].lower().split('x')) if 'size' in params else None
+            if size is not None and len(size) != 2:
+                raise ValueError("'size' must be given as <h>x<w>")
+            with Image.open(io.BytesIO(body)) as img:
+                inp = transforms.ToTensor()(img.convert('RGB'))
+            out_size = output_size_for(inp.shape[1], inp.shape[2], scale, size)
+            if min(out_size) < 1 or out_size[0] * out_size[1] > MAX_OUTPUT_PIXELS:
+                raise ValueError(f"The output must have between 1 and {MAX_OUTPUT_PIXELS} pixels")
+            self.server.batcher.registry.resolve(name)
+        except FileNotFoundError as err:
+            self._send_json(404, {'error': str(err)})
+            return
+        except (ValueError, OSError, SyntaxError) as err:
+            self._send_json(400, {'error': str(err)})
+            return
+
+        try:
+            pred = self.server.batcher.submit(name, inp, out_size).result()
+        except Exception as err:
+            self._send_json(500, {'error': str(err)})
+            return
+        output = io.BytesIO()
+        Image.fromarray(pred).save(output, format='PNG')
+        self._send(200, output.getvalue(), 'image/png')
+
+
+def serve(models: list, save_dir: str = DEFAULT_SAVE_DIR, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+          device: torch.device = None, channels_last: bool = None, max_models: int = DEFAULT_MAX_MODELS,
+          max_batch: int = DEFAULT_MAX_BATCH, max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+          query_chunk: int = DEFAULT_QUERY_CHUNK, verbose: bool = False) -> None:
+    """This function loads the given checkpoints, runs a warm up request through each
+    of them and serves inference requests until it is interrupted.
+
+    Args:
+        models (list): checkpoints loaded at startup, relative to save_dir. The first one is
+        used when a request does not name a model.
+        save_dir (str, optional): directory containing the checkpoints. Defaults to DEFAULT_SAVE_DIR.
+        host (str, optional): address to listen on. Defaults to DEFAULT_HOST.
+        port (int, optional): port to listen on. Defaults to DEFAULT_PORT.
+        device (torch.device, optional): the device to use, see configure_device. Defaults to None.
+        channels_last (bool, optional): use the channels last memory layout. Defaults to True on CPU.
+        max_models (int, optional): checkpoints kept in memory. Defaults to DEFAULT_MAX_MODELS.
+        max_batch (int, optional): largest number of requests batched together. Defaults to DEFAULT_MAX_BATCH.
+        max_wait_ms (float, optional): time waited for more requests to batch. Defaults to DEFAULT_MAX_WAIT_MS.
+        query_chunk (int, optional): query points of the whole batch per call. Defaults to DEFAULT_QUERY_CHUNK.
+        verbose (bool, optional): log every request. Defaults to False.
+    """
+    device = device if isinstance(device, torch.device) else configure_device(device)
+    if channels_last is None:
+        channels_last = device.type == 'cpu'
+    registry = ModelRegistry(save_dir, device, channels_last, max(max_models, len(models)))
+    for name in models:
+        registry.get(name)
+    batcher = MicroBatcher(registry, max_batch, max_wait_ms, query_chunk)
+    batcher.warm_up(models)
+
+    server = ThreadingHTTPServer((host, port), InferenceHandler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    server.default_model = models[0] if models else None
+    server.verbose = verbose
+    print(f"Serving {registry.loaded()} on http://{host}:{server.server_address[1]} ({device})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Server stopped: {server.batcher.stats()}")
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', nargs='*', default=[],
+                        help="checkpoints loaded at startup, relative to --save-dir. The first one is the default")
+    parser.add_argument('--save-dir', default=DEFAULT_SAVE_DIR)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--gpu', default=None,
+                        help="value for CUDA_VISIBLE_DEVICES, set before CUDA is initialized")
+    parser.add_argument('--device', default=None,
+                        help="cpu, cuda or cuda:N. Defaults to cuda if available, else cpu")
+    parser.add_argument('--threads', type=int, default=None, help="intra-op threads used on CPU")
+    parser.add_argument('--channels-last', dest='channels_last', action='store_true', default=None,
+                        help="use the channels last memory layout (default on CPU)")
+    parser.add_argument('--no-channels-last', dest='channels_last', action='store_false',
+                        help="use the contiguous memory layout (default on GPU)")
+    parser.add_argument('--max-models', type=int, default=DEFAULT_MAX_MODELS,
+                        help="checkpoints kept in memory")
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH,
+                        help="largest number of requests batched together")
+    parser.add_argument('--max-wait-ms', type=float, default=DEFAULT_MAX_WAIT_MS,
+                        help="time waited for more requests to batch")
+    parser.add_argument('--query-chunk', type=int, default=DEFAULT_QUERY_CHUNK,
+                        help="query points of the whole batch evaluated per call")
+    parser.add_argument('--verbose', action='store_true', help="log every request")
+    args = parser.parse_args()
+    selected_device = configure_device(args.device, args.gpu, args.threads)
+    serve(args.model, args.save_dir, args.host, args.port, selected_device, args.channels_last, args.max_models,
+          args.max_batch, args.max_wait_ms, args.query_chunk, args.verbose)
@@ -0,0 +1,104 @@
+"""
+This module contains a copy of the query_rgb method of the LIIF model of the git
+project https://github.com/yinboc/liif that builds the coordinates of the feature
+map on the device of the features, so the models can run on cpu. Is meant to be
+copied next to infer.py.
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import torch
+import torch.nn.functional as F
+
+import models
+from utils import make_coord
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+def query_rgb(self, coord: torch.Tensor, cell: torch.Tensor = None) -> torch.Tensor:
+    """This function is liif's LIIF.query_rgb building the coordinates of the feature
+    map on the device of the features. The original one moves them with .cuda(), so
+    it can not run on cpu. Installed by patch_query_rgb.
+
+    Args:
+        self (LIIF): liif model holding the features of gen_feat
+        coord (torch.Tensor): query coordinates (b, q, 2)
+        cell (torch.Tensor, optional): query cells (b, q, 2). Defaults to None.
+
+    Returns:
+        torch.Tensor: predicted values (b, q, 3)
+    """
+    feat = self.feat
+
+    if self.imnet is None:
+        return F.grid_sample(feat, coord.flip(-1).unsqueeze(1), mode='nearest',
+                             align_corners=False)[:, :, 0, :].permute(0, 2, 1)
+
+    if self.feat_unfold:
+        feat = F.unfold(feat, 3, padding=1).view(feat.shape[0], feat.shape[1] * 9, feat.shape[2], feat.shape[3])
+
+    if self.local_ensemble:
+        vx_lst = [-1, 1]
+        vy_lst = [-1, 1]
+        eps_shift = 1e-6
+    else:
+        vx_lst, vy_lst, eps_shift = [0], [0], 0
+
+    # field radius (global: [-1, 1])
+    rx = 2 / feat.shape[-2] / 2
+    ry = 2 / feat.shape[-1] / 2
+
+    feat_coord = make_coord(feat.shape[-2:], flatten=False).to(feat.device) \
+        .permute(2, 0, 1).unsqueeze(0).expand(feat.shape[0], 2, *feat.shape[-2:])
+
+    preds = []
+    areas = []
+    for vx in vx_lst:
+        for vy in vy_lst:
+            coord_ = coord.clone()
+            coord_[:, :, 0] += vx * rx + eps_shift
+            coord_[:, :, 1] += vy * ry + eps_shift
+            coord_.clamp_(-1 + 1e-6, 1 - 1e-6)
+            q_feat = F.grid_sample(feat, coord_.flip(-1).unsqueeze(1), mode='nearest',
+                                   align_corners=False)[:, :, 0, :].permute(0, 2, 1)
+            q_coord = F.grid_sample(feat_coord, coord_.flip(-1).unsqueeze(1), mode='nearest',
+                                    align_corners=False)[:, :, 0, :].permute(0, 2, 1)
+            rel_coord = coord - q_coord
+            rel_coord[:, :, 0] *= feat.shape[-2]
+            rel_coord[:, :, 1] *= feat.shape[-1]
+            inp = torch.cat([q_feat, rel_coord], dim=-1)
+
+            if self.cell_decode:
+                rel_cell = cell.clone()
+                rel_cell[:, :, 0] *= feat.shape[-2]
+                rel_cell[:, :, 1] *= feat.shape[-1]
+                inp = torch.cat([inp, rel_cell], dim=-1)
+
+            bs, q = coord.shape[:2]
+            pred = self.imnet(inp.view(bs * q, -1)).view(bs, q, -1)
+            preds.append(pred)
+
+            area = torch.abs(rel_coord[:, :, 0] * rel_coord[:, :, 1])
+            areas.append(area + 1e-9)
+
+    tot_area = torch.stack(areas).sum(dim=0)
+    if self.local_ensemble:
+        areas[0], areas[3] = areas[3], areas[0]
+        areas[1], areas[2] = areas[2], areas[1]
+    ret = 0
+    for pred, area in zip(preds, areas):
+        ret = ret + pred * (area / tot_area).unsqueeze(-1)
+    return ret
+
+
+def patch_query_rgb() -> None:
+    """This function replaces liif's LIIF.query_rgb by query_rgb, so the models run on
+    any device. It is called before a model is built and can be called many times."""
+    liif_class = models.liif.LIIF
+    if liif_class.query_rgb is not query_rgb:
+        liif_class.query_rgb = query_rgb
@@ -0,0 +1,148 @@
+"""
+This module contains the input and output of the images inferred by tiles: the
+input is read tile by tile from a memory map and the output is written as a PNG
+by strips of rows, so neither of them has to be held in memory. Is meant to be
+copied next to infer.py.
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+# Uncompressed layouts read straight from the file: bytes per pixel and RGB channels
+RAW_CHANNELS = {'RGB': (3, [0, 1, 2]), 'BGR': (3, [2, 1, 0]), 'RGBX': (4, [0, 1, 2]),
+                'RGBA': (4, [0, 1, 2]), 'L': (1, [0, 0, 0])}
+# Rows decoded at once when a compressed image is unpacked into a memory map
+DECODE_STRIP_ROWS = 256
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_COMPRESSION_LEVEL = 6
+# 'Up' filter: every row is stored as its difference with the row above
+PNG_FILTER_UP = 2
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+class LazyImage:
+    """RGB pixels of an image kept in a memory map, either of the image file itself or
+    of a temporary copy, so only the tiles being read are brought into memory.
+    """
+
+    def __init__(self, pixels: np.ndarray, channels: list):
+        self.pixels = pixels
+        self.channels = channels
+
+    @property
+    def size(self) -> tuple:
+        """(width, height) of the image, as PIL's Image.size."""
+        return self.pixels.shape[1], self.pixels.shape[0]
+
+    def read(self, box: tuple) -> np.ndarray:
+        """Returns the (h, w, 3) uint8 pixels of the (left, upper, right, lower) box."""
+        x0, y0, x1, y1 = box
+        return np.ascontiguousarray(self.pixels[y0:y1, x0:x1][:, :, self.channels])
+
+
+def open_lazy_image(path: str, tmp_dir: str) -> LazyImage:
+    """This function opens an image to be read by tiles. Uncompressed images (tif, bmp)
+    are memory mapped from the file. The others are decoded once and copied into a
+    memory map in tmp_dir by strips of rows, and the decoded image is released before
+    any tile is inferred, as PIL can not decode a part of a compressed image.
+
+    Args:
+        path (str): image path
+        tmp_dir (str): directory for the memory map of the compressed images
+
+    Returns:
+        LazyImage: the pixels of the image
+    """
+    with Image.open(path) as img:
+        width, height = img.size
+        if len(img.tile) == 1:
+            codec, extents, offset, args = img.tile[0]
+            rawmode = args[0] if isinstance(args, tuple) else args
+            if codec == 'raw' and tuple(extents) == (0, 0, width, height) and rawmode in RAW_CHANNELS:
+                bands, channels = RAW_CHANNELS[rawmode]
+                stride = args[1] if len(args) > 1 and args[1] else width * bands
+                orientation = args[2] if len(args) > 2 else 1
+                rows = np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(height, stride))
+                pixels = rows[:, :width * bands].reshape(height, width, bands)
+                return LazyImage(pixels[::-1] if orientation < 0 else pixels, channels)
+
+        pixels = np.memmap(os.path.join(tmp_dir, 'input.bin'), dtype=np.uint8, mode='w+',
+                           shape=(height, width, 3))
+        for y0 in range(0, height, DECODE_STRIP_ROWS):
+            y1 = min(y0 + DECODE_STRIP_ROWS, height)
+            pixels[y0:y1] = np.asarray(img.crop((0, y0, width, y1)).convert('RGB'))
+        pixels.flush()
+    return LazyImage(pixels, [0, 1, 2])
+
+
+class PngWriter:
+    """8 bit RGB PNG file written by strips of rows as they are ready, so the whole
+    image is never held in memory. Used as a context manager, a file left incomplete
+    by an error is removed.
+    """
+
+    def __init__(self, path: str, width: int, height: int):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self._previous = np.zeros((1, width, 3), dtype=np.uint8)
+        self._compressor = zlib.compressobj(PNG_COMPRESSION_LEVEL)
+        self._file = open(path, 'wb')
+        self._file.write(PNG_SIGNATURE)
+        # 8 bits per channel, color type 2 (RGB), default compression, filtering and no interlace
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        self._file.write(struct.pack('>I', len(data)) + kind + data
+                         + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    def write(self, rows: np.ndarray) -> None:
+        """Appends (n, width, 3) uint8 rows below the ones already written."""
+        if self.rows + len(rows) > self.height:
+            raise ValueError(f"'{self.path}' only has {self.height} rows")
+        filtered = rows - np.concatenate([self._previous, rows[:-1]])
+        lines = np.concatenate([np.full((len(rows), 1), PNG_FILTER_UP, dtype=np.uint8),
+                                filtered.reshape(len(rows), -1)], axis=1)
+        data = self._compressor.compress(lines.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+        self._previous = rows[-1:].copy()
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        """Writes the end of the image and closes the file."""
+        if self.rows != self.height:
+            raise ValueError(f"Only {self.rows} of the {self.height} rows of '{self.path}' were written")
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self.close()
+        finally:
+            if not self._file.closed:
+                self._file.close()
+                os.remove(self.path)
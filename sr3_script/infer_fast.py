@@ -0,0 +1,260 @@
+"""
+This module contains the functionality to infer images with a trained SR3 model
+in a fraction of the denoising steps of its schedule. Is meant to be used as an
+extra script for the git project
+https://github.com/Janspiry/Image-Super-Resolution-via-Iterative-Refinement,
+run from its folder like its infer.py:
+
+    python infer_fast.py -c config/sr_sr3_64_256_test.json --steps 50 100 250
+    python infer_fast.py -c config/sr_sr3_64_256_test_100steps.json --sampler ancestral
+
+SR3's network is conditioned on the noise level instead of the step number, so
+it can be sampled with fewer steps in two ways:
+
+    - ddim: DDIM-style strided sampling, a subsequence of the steps of the 'val'
+      schedule with deterministic updates (or partly random ones with --eta)
+    - ancestral: SR3's own sampler on a shorter schedule, as written by
+      models_storage.write_fast_sampling_configs
+
+Every run writes '<id>_sr.png' and '<id>_hr.png' like infer.py and appends a row
+with its steps, PSNR, SSIM and seconds per image to a csv report, printed at the
+end, so the fastest number of steps with an acceptable quality can be chosen.
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import csv
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+
+import core.logger as Logger
+import core.metrics as Metrics
+import data as Data
+import model as Model
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+SAMPLERS = ('ddim', 'ancestral')
+DEFAULT_STEPS = [50, 100, 250]
+DEFAULT_SEED = 0
+REPORT_PATH = os.path.join('experiments', 'fast_sampling_report.csv')
+REPORT_FIELDS = ['config', 'sampler', 'steps', 'eta', 'images', 'psnr', 'ssim', 'seconds_per_image', 'results']
+# PSNR loss accepted by the suggested operating point against the best run
+DEFAULT_PSNR_TOLERANCE = 0.1
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def strided_timesteps(num_timesteps: int, steps: int) -> list:
+    """This function chooses evenly spaced steps of a schedule, from the noisiest.
+
+    Args:
+        num_timesteps (int): steps of the schedule
+        steps (int): steps to run
+
+    Returns:
+        list: the steps, in the order they are run
+    """
+    timesteps = np.unique(np.linspace(0, num_timesteps - 1, min(steps, num_timesteps)).round().astype(int))
+    return timesteps[::-1].tolist()
+
+
+@torch.no_grad()
+def ddim_sample(net, condition: torch.Tensor, steps: int, eta: float = 0.0) -> torch.Tensor:
+    """This function samples SR3's GaussianDiffusion with DDIM-style strided steps.
+
+    Args:
+        net: the GaussianDiffusion of the model, with the schedule already set
+        condition (torch.Tensor): the upsampled low resolution images, in [-1, 1]
+        steps (int): steps run out of the schedule
+        eta (float, optional): 0 for deterministic updates, 1 for DDPM-like noise. Defaults to 0.0.
+
+    Returns:
+        torch.Tensor: the super resolved images, in [-1, 1]
+    """
+    # sqrt_alphas_cumprod_prev[t + 1] is the noise level SR3 feeds the network at step t
+    alphas_cumprod = np.asarray(net.sqrt_alphas_cumprod_prev, dtype=np.float64)[1:] ** 2
+    timesteps = strided_timesteps(net.num_timesteps, steps)
+    x = torch.randn_like(condition)
+    for position, t in enumerate(timesteps):
+        alpha = float(alphas_cumprod[t])
+        alpha_prev = float(alphas_cumprod[timesteps[position + 1]]) if position + 1 < len(timesteps) else 1.0
+        noise_level = torch.full((x.shape[0], 1), alpha ** 0.5, device=x.device)
+        noise = net.denoise_fn(torch.cat([condition, x], dim=1), noise_level)
+        x_start = ((x - (1 - alpha) ** 0.5 * noise) / alpha ** 0.5).clamp_(-1., 1.)
+        # The noise matching the clipped prediction keeps the update consistent
+        noise = (x - alpha ** 0.5 * x_start) / (1 - alpha) ** 0.5
+        sigma = eta * ((1 - alpha_prev) / (1 - alpha) * (1 - alpha / alpha_prev)) ** 0.5
+        x = alpha_prev ** 0.5 * x_start + max(1 - alpha_prev - sigma ** 2, 0.) ** 0.5 * noise
+        if sigma > 0 and position + 1 < len(timesteps):
+            x = x + sigma * torch.randn_like(x)
+    return x
+
+
+def _synchronize(device: torch.device) -> None:
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def run(diffusion, val_loader, result_path: str, sampler: str, steps: int = None, eta: float = 0.0,
+        seed: int = DEFAULT_SEED, limit: int = None) -> dict:
+    """This function infers the validation set with one sampler and number of steps.
+
+    Args:
+        diffusion: the DDPM model created by model.create_model
+        val_loader: the loader of the validation set
+        result_path (str): folder for the '<id>_sr.png' and '<id>_hr.png' images
+        sampler (str): 'ddim' or 'ancestral'
+        steps (int, optional): steps of the ddim sampler, ignored by ancestral. Defaults to None.
+        eta (float, optional): noise of the ddim sampler. Defaults to 0.0.
+        seed (int, optional): seed of the initial noise, the same for every run. Defaults to DEFAULT_SEED.
+        limit (int, optional): infer only the first images. Defaults to all.
+
+    Returns:
+        dict: a row of the report
+    """
+    os.makedirs(result_path, exist_ok=True)
+    net = getattr(diffusion.netG, 'module', diffusion.netG)
+    net.eval()
+    torch.manual_seed(seed)
+    psnrs, ssims = [], []
+    elapsed = 0.0
+    for idx, val_data in enumerate(val_loader, start=1):
+        if limit and idx > limit:
+            break
+        diffusion.feed_data(val_data)
+        _synchronize(diffusion.device)
+        start = time.perf_counter()
+        if sampler == 'ddim':
+            sr = ddim_sample(net, diffusion.data['SR'], steps, eta)
+        else:
+            diffusion.test(continous=False)
+            # Without the intermediate steps SR3 returns the last image without its batch dimension
+            sr = diffusion.SR.unsqueeze(0) if diffusion.SR.dim() == 3 else diffusion.SR
+        _synchronize(diffusion.device)
+        elapsed += time.perf_counter() - start
+
+        sr_img = Metrics.tensor2img(sr[0].detach().float().cpu())
+        hr_img = Metrics.tensor2img(diffusion.data['HR'][0].detach().float().cpu())
+        Metrics.save_img(sr_img, os.path.join(result_path, f"{idx}_sr.png"))
+        Metrics.save_img(hr_img, os.path.join(result_path, f"{idx}_hr.png"))
+        psnrs.append(Metrics.calculate_psnr(sr_img, hr_img))
+        ssims.append(Metrics.calculate_ssim(sr_img, hr_img))
+
+    images = len(psnrs)
+    return {'sampler': sampler, 'steps': steps if sampler == 'ddim' else net.num_timesteps, 'eta': eta,
+            'images': images, 'psnr': float(np.mean(psnrs)) if images else None,
+            'ssim': float(np.mean(ssims)) if images else None,
+            'seconds_per_image': elapsed / images if images else None, 'results': result_path}
+
+
+def append_report(rows: list, report_path: str = REPORT_PATH) -> None:
+    """This function appends the rows of the runs to the csv report."""
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    new_file = not os.path.isfile(report_path)
+    with open(report_path, 'a', newline='') as report_file:
+        writer = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_report(report_path: str = REPORT_PATH) -> list:
+    """This function reads the rows of the csv report with their numbers parsed."""
+    if not os.path.isfile(report_path):
+        return []
+    with open(report_path, 'r', newline='') as report_file:
+        rows = list(csv.DictReader(report_file))
+    for row in rows:
+        for field in ('steps', 'images'):
+            row[field] = int(row[field])
+        for field in ('eta', 'psnr', 'ssim', 'seconds_per_image'):
+            row[field] = float(row[field]) if row[field] not in ('', 'None') else None
+    return rows
+
+
+def operating_point(rows: list, psnr_tolerance: float = DEFAULT_PSNR_TOLERANCE) -> dict:
+    """This function chooses the fastest run whose PSNR is within psnr_tolerance dB of the best one."""
+    scored = [row for row in rows if row['psnr'] is not None]
+    if not scored:
+        return None
+    best = max(row['psnr'] for row in scored)
+    return min((row for row in scored if row['psnr'] >= best - psnr_tolerance),
+               key=lambda row: row['seconds_per_image'])
+
+
+def print_report(rows: list, psnr_tolerance: float = DEFAULT_PSNR_TOLERANCE) -> None:
+    """This function prints the steps against the quality and the time of the runs,
+    and the suggested operating point."""
+    print(f"{'config':40}{'sampler':>10}{'steps':>7}{'eta':>6}{'images':>8}{'psnr':>9}{'ssim':>8}{'s/img':>9}")
+    for row in sorted(rows, key=lambda row: (row['config'], row['sampler'], row['steps'])):
+        psnr = '' if row['psnr'] is None else f"{row['psnr']:.3f}"
+        ssim = '' if row['ssim'] is None else f"{row['ssim']:.4f}"
+        seconds = '' if row['seconds_per_image'] is None else f"{row['seconds_per_image']:.2f}"
+        print(f"{os.path.basename(row['config'])[:39]:40}{row['sampler']:>10}{row['steps']:>7}{row['eta']:>6.2f}"
+              f"{row['images']:>8}{psnr:>9}{ssim:>8}{seconds:>9}")
+    chosen = operating_point(rows, psnr_tolerance)
+    if chosen:
+        print(f"Fastest run within {psnr_tolerance} dB of the best PSNR: {chosen['sampler']} with {chosen['steps']} "
+              f"steps ({chosen['psnr']:.3f} dB, {chosen['seconds_per_image']:.2f} s/image)")
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Infer with SR3 in fewer denoising steps.")
+    parser.add_argument('-c', '--config', type=str, default='config/sr_sr3_64_256_test.json')
+    parser.add_argument('-p', '--phase', type=str, choices=['val'], default='val')
+    parser.add_argument('-gpu', '--gpu_ids', type=str, default=None)
+    parser.add_argument('-debug', '-d', action='store_true')
+    parser.add_argument('-enable_wandb', action='store_true')
+    parser.add_argument('-log_infer', action='store_true')
+    parser.add_argument('--sampler', choices=SAMPLERS, default='ddim')
+    parser.add_argument('--steps', type=int, nargs='+', default=DEFAULT_STEPS, help="steps of the ddim sampler")
+    parser.add_argument('--eta', type=float, default=0.0, help="noise of the ddim sampler, 0 is deterministic")
+    parser.add_argument('--limit', type=int, default=None, help="infer only the first images")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--report', default=REPORT_PATH, help="csv report the runs are appended to")
+    args = parser.parse_args()
+
+    opt = Logger.dict_to_nonedict(Logger.parse(args))
+    torch.backends.cudnn.enabled = True
+    torch.backends.cudnn.benchmark = True
+    Logger.setup_logger(None, opt['path']['log'], 'train', level=logging.INFO, screen=True)
+    logger = logging.getLogger('base')
+
+    for phase, dataset_opt in opt['datasets'].items():
+        if phase == 'val':
+            val_set = Data.create_dataset(dataset_opt, phase)
+            val_loader = Data.create_dataloader(val_set, dataset_opt, phase)
+    diffusion = Model.create_model(opt)
+    diffusion.set_new_noise_schedule(opt['model']['beta_schedule']['val'], schedule_phase='val')
+
+    runs = [(args.sampler, steps) for steps in args.steps] if args.sampler == 'ddim' else [(args.sampler, None)]
+    rows = []
+    for sampler, steps in runs:
+        result_path = os.path.join(opt['path']['results'], f"{sampler}_{steps}" if steps else sampler)
+        logger.info(f"Infering with the {sampler} sampler{f' in {steps} steps' if steps else ''}")
+        row = run(diffusion, val_loader, result_path, sampler, steps, args.eta, args.seed, args.limit)
+        rows.append(dict(row, config=args.config))
+        logger.info(f"{row['images']} images, psnr {row['psnr']}, {row['seconds_per_image']} s/image")
+    append_report(rows, args.report)
+    print_report(read_report(args.report))
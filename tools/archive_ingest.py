@@ -0,0 +1,235 @@
+"""
+This module contains the functionality to prepare the dataset straight from its
+downloaded archive (zip or tar), without extracting it into 'data' first.
+
+The members of the archive are read one after the other as a stream and sent to
+a pool of processes, which for every image:
+
+    - checks its dimensions from the header, before decoding the pixels, and
+      leaves out the images of a wrong size and the broken ones
+    - assigns it to a split from the hash of its content (assign_split), so a
+      seed gives the same split update_pretrain_load gives to the extracted files
+    - writes its copy in READY_DIR and its SR3 triplet, the same files
+      pretrain_load writes
+
+So the raw corpus is read once and never written, and the LIIF 'load' folders
+are exposed at the end as usual.
+
+    python tools/archive_ingest.py data/UCMerced_LandUse.zip --seed 1234
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import random
+import tarfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from PIL import Image
+
+from dataset_manifest import delete_manifest
+from dataset_storage import DATA_DIR, DATASET1_NAME, READY_DIR, assign_split
+from image_resampler import write_triplet
+from pretrain_loader import (SIZES, SPLITS, SR3_DATA_DIR, clean_prepared_data, expose_to_liif,
+                             split_dir_name)
+from tracing import span, traced
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+IMAGE_EXTENSION = '.tif'
+# Images read from the archive and waiting for a worker, per worker
+QUEUED_PER_WORKER = 4
+PROGRESS_STEP = 500
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def find_archive(data_dir: str = DATA_DIR, name: str = DATASET1_NAME) -> str:
+    """This function looks for the downloaded archive of the dataset in data_dir.
+
+    Args:
+        data_dir (str, optional): directory of the downloads. Defaults to DATA_DIR.
+        name (str, optional): name of the archive without extension. Defaults to DATASET1_NAME.
+
+    Returns:
+        str: path to the archive, None if there is none
+    """
+    for extension in ARCHIVE_EXTENSIONS:
+        path = os.path.join(data_dir, name + extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def iter_archive(archive_path: str, extension: str = IMAGE_EXTENSION):
+    """This function reads the files of a zip or tar archive with the given
+    extension one after the other, without extracting them.
+
+    Args:
+        archive_path (str): path to the archive
+        extension (str, optional): extension of the files read. Defaults to IMAGE_EXTENSION.
+
+    Raises:
+        FileNotFoundError: raised if the archive does not exist
+        ValueError: raised if the file is not a zip or tar archive
+
+    Yields:
+        tuple: (member name, content bytes)
+    """
+    if not os.path.isfile(archive_path):
+        raise FileNotFoundError(f"The archive '{archive_path}' could not be found!!")
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(extension):
+                    yield info.filename, archive.read(info)
+    elif tarfile.is_tarfile(archive_path):
+        # 'r|*' reads the (compressed) tar as a stream, without seeking back
+        with tarfile.open(archive_path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(extension):
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        raise ValueError(f"'{archive_path}' is not a zip or tar archive!!")
+
+
+def ingest_image(name: str, data: bytes, params: dict) -> tuple:
+    """This function validates an image read from the archive and writes its outputs.
+
+    Args:
+        name (str): name of the image in the archive
+        data (bytes): content of the image
+        params (dict): {'train_percent', 'val_percent', 'seed', 'std_width', 'std_height'}
+
+    Returns:
+        tuple: (name, status, split), status is 'ok', 'wrong_size' or 'broken'
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # The size comes from the header, the pixels are only decoded for the right sizes
+            if img.size != (params['std_width'], params['std_height']):
+                return name, 'wrong_size', None
+            rgb = img.convert('RGB')
+    except (IOError, OSError, SyntaxError, ValueError):
+        return name, 'broken', None
+
+    split = assign_split(hashlib.sha1(data).hexdigest(), params['train_percent'], params['val_percent'],
+                         params['seed'])
+    ready_path = os.path.join(READY_DIR, split, os.path.basename(name))
+    with open(ready_path, 'wb') as ready_file:
+        ready_file.write(data)
+    write_triplet(rgb, name, os.path.join(SR3_DATA_DIR, split_dir_name(split)), SIZES)
+    return name, 'ok', split
+
+
+@traced()
+def ingest_archive(archive_path: str = None, train_percent=.6, val_percent=.2, seed: int = -1,
+                   std_width: int = 256, std_height: int = 256, workers: int = None,
+                   liif_mode: str = 'symlink') -> dict:
+    """This function rebuilds the whole prepared dataset, as pretrain_load does, reading
+    the images straight from the downloaded archive.
+
+    Args:
+        archive_path (str, optional): zip or tar archive of the dataset. Defaults to the one find_archive finds.
+        train_percent (float, optional): percentage of the images set to train group. Defaults to .6.
+        val_percent (float, optional): percentage of the images set to val group. Defaults to .2.
+        seed (int, optional): seed used to assign the splits, -1 draws a new one. Defaults to -1.
+        std_width (int, optional): width of the valid images. Defaults to 256.
+        std_height (int, optional): height of the valid images. Defaults to 256.
+        workers (int, optional): number of processes. Defaults to every core.
+        liif_mode (str, optional): how the splits are exposed to LIIF ('symlink', 'hardlink' or 'copy'). Defaults to 'symlink'.
+
+    Raises:
+        FileNotFoundError: raised if no archive is given nor found in DATA_DIR
+
+    Returns:
+        dict: number of 'total', 'wrong_size', 'broken' and 'failed' images and of images per split
+    """
+    archive_path = archive_path or find_archive()
+    if archive_path is None:
+        raise FileNotFoundError(f"No archive of '{DATASET1_NAME}' could be found in '{DATA_DIR}'!!")
+    if seed == -1:
+        seed = random.randrange(2 ** 31)
+    print(f"The data splitting process will be using the seed={seed}")
+    params = {'train_percent': train_percent, 'val_percent': val_percent, 'seed': seed,
+              'std_width': std_width, 'std_height': std_height}
+
+    # A full rebuild does not keep track of the source files, as pretrain_load
+    delete_manifest()
+    clean_prepared_data()
+    for split in SPLITS:
+        os.makedirs(os.path.join(READY_DIR, split), exist_ok=True)
+
+    workers = workers or os.cpu_count() or 1
+    summary = {'total': 0, 'wrong_size': 0, 'broken': 0, 'failed': 0, **{split: 0 for split in SPLITS}}
+    failures = []
+
+    def collect(done_futures) -> None:
+        for future in done_futures:
+            try:
+                name, status, split = future.result()
+            except Exception as error:  # pylint: disable=broad-except
+                failures.append((pending.pop(future), f"{type(error).__name__}: {error}"))
+                summary['failed'] += 1
+                continue
+            pending.pop(future)
+            summary[split if status == 'ok' else status] += 1
+            done = summary['total'] - len(pending)
+            if done % PROGRESS_STEP == 0:
+                print(f"Ingesting images: {done}/{summary['total']} done, {summary['failed']} failed")
+
+    pending = {}
+    with span('ingest_archive', category='pool', workers=workers) as current, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        for name, data in iter_archive(archive_path):
+            # Only a few images per worker are kept in memory while the archive is read
+            if len(pending) >= workers * QUEUED_PER_WORKER:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[executor.submit(ingest_image, name, data, params)] = name
+            summary['total'] += 1
+        collect(wait(pending).done)
+        current.add(files=summary['total'], failed=summary['failed'])
+
+    for name, error in failures:
+        print(f"Failed '{name}': {error}")
+    expose_to_liif(liif_mode)
+
+    print(f"{summary['total']} images read from '{os.path.basename(archive_path)}': "
+          + ', '.join(f"{summary[split]} {split}" for split in SPLITS)
+          + f", {summary['wrong_size']} with wrong dimensions and {summary['broken']} with errors left out, "
+            f"{summary['failed']} failed")
+    return summary
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prepare the dataset straight from its zip or tar archive.")
+    parser.add_argument('archive', nargs='?', default=None, help="archive of the dataset, defaults to the one in data")
+    parser.add_argument('--train-percent', type=float, default=.6)
+    parser.add_argument('--val-percent', type=float, default=.2)
+    parser.add_argument('--seed', type=int, default=-1)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--liif-mode', choices=['symlink', 'hardlink', 'copy'], default='symlink')
+    args = parser.parse_args()
+    ingest_archive(args.archive, args.train_percent, args.val_percent, args.seed, workers=args.workers,
+                   liif_mode=args.liif_mode)
@@ -0,0 +1,470 @@
+"""
+This module contains an autotuner of the batch size, data loader workers and
+threads of the SR3 and LIIF training configs for the machine it runs on. It runs
+short timed probes of:
+
+    - data loading: the decoding and augmentation of the training samples of the
+      prepared dataset, with every number of worker processes of the grid
+    - training steps: forward, backward and optimizer steps of the configured
+      model on random inputs, with every number of threads and batch size of the
+      grid, in a fresh process so the peak memory of every probe can be measured
+
+Every combination that fits in the memory limit and in the CPUs of the machine is
+scored with the samples per second of the slower of both, and the tuned values are
+written to copies of the shipped configs, next to the originals:
+
+    model_config/sr_sr3_64_256_tuned.json
+    model_config/train-UCMerced_LandUse/train_UCMerced_LandUse-64-256_tuned.yaml
+
+Only the tuned numbers are changed, the comments and the rest of the files are
+kept. copy_config_files_sr3 and copy_config_folder_liif install them with the
+originals. LIIF's train script fixes its number of loader workers, so only the
+batch size is written to its config and the other values are left as a comment.
+
+    python tools/autotune.py sr3 --memory-gb 24 --seconds 5
+    python tools/autotune.py liif
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import Pool, get_context
+
+import numpy as np
+from PIL import Image
+
+from models_storage import (CONFIG_DIR, LIIF_DIR, LIIF_TRAIN_CONFIG, SR3_CONFIG_TRAIN_FILENAME, SR3_DIR,
+                            SR3_TUNED_CONFIG_FILENAME)
+from pretrain_loader import SR3_DATA_DIR, split_dir_name
+from tracing import span, traced
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+LIIF_TRAIN_CONFIG_FILENAME = 'train_UCMerced_LandUse-64-256.yaml'
+LIIF_TUNED_CONFIG_FILENAME = 'train_UCMerced_LandUse-64-256_tuned.yaml'
+MODELS = ('sr3', 'liif')
+
+BATCH_SIZES = {'sr3': [1, 2, 4, 8, 16, 32], 'liif': [4, 8, 16, 32, 64, 128]}
+DEFAULT_PROBE_SECONDS = 3.0
+# Part of the physical memory used when no limit is given
+DEFAULT_MEMORY_FRACTION = 0.8
+# Combinations within this fraction of the best throughput are considered equal,
+# the one using less CPUs and the smaller batch wins
+THROUGHPUT_TOLERANCE = 0.05
+TUNED_COMMENT = "tuned by tools/autotune.py:"
+
+# Numbers edited in the configs, the first match after the section header
+SR3_TRAIN_SECTION = re.compile(r'"train"\s*:\s*\{')
+SR3_BATCH_SIZE = re.compile(r'("batch_size"\s*:\s*)\d+')
+SR3_NUM_WORKERS = re.compile(r'("num_workers"\s*:\s*)\d+')
+LIIF_TRAIN_SECTION = re.compile(r'^train_dataset:', re.MULTILINE)
+LIIF_BATCH_SIZE = re.compile(r'^(\s+batch_size:\s*)\d+', re.MULTILINE)
+LIIF_WRAPPER_ARG = r'^\s+{}:\s*(\d+)'
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def powers_of_two(limit: int, start: int = 1) -> list:
+    """This function returns the powers of two from start up to limit, and limit itself."""
+    values = []
+    value = start
+    while value < limit:
+        values.append(value)
+        value *= 2
+    return values + [limit] if limit >= start else values
+
+
+def physical_memory() -> int:
+    """This function returns the physical memory of the machine in bytes."""
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def _peak_rss() -> int:
+    """This function returns the peak resident memory of this process in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def strip_json_comments(text: str) -> str:
+    """This function removes the '//' comments of the SR3 configs, the way SR3's
+    config parser does."""
+    return ''.join(line.split('//')[0] + '\n' for line in text.splitlines())
+
+
+def read_liif_wrapper(text: str) -> dict:
+    """This function reads the training sample parameters of a LIIF config without
+    a yaml parser."""
+    section = text[LIIF_TRAIN_SECTION.search(text).end():]
+    values = {}
+    for name, default in (('inp_size', 48), ('scale_max', 4), ('sample_q', 2304)):
+        match = re.search(LIIF_WRAPPER_ARG.format(name), section, re.MULTILINE)
+        values[name] = int(match.group(1)) if match else default
+    return values
+
+
+def config_paths(model: str) -> tuple:
+    """This function returns the shipped and tuned config paths of a model."""
+    if model == 'sr3':
+        return os.path.join(CONFIG_DIR, SR3_CONFIG_TRAIN_FILENAME), os.path.join(CONFIG_DIR, SR3_TUNED_CONFIG_FILENAME)
+    liif_dir = os.path.join(CONFIG_DIR, LIIF_TRAIN_CONFIG)
+    return os.path.join(liif_dir, LIIF_TRAIN_CONFIG_FILENAME), os.path.join(liif_dir, LIIF_TUNED_CONFIG_FILENAME)
+
+
+def _load_sample(task: tuple) -> int:
+    """This function loads a training sample the way the model's dataset does and
+    returns the peak memory of the worker, so it can be run in the probe's pool.
+
+    Args:
+        task (tuple): (model, hr_path, sr_path, liif_wrapper)
+
+    Returns:
+        int: peak resident memory of the process in bytes
+    """
+    model, hr_path, sr_path, wrapper = task
+    with Image.open(hr_path) as img:
+        hr = img.convert('RGB')
+    if model == 'sr3':
+        with Image.open(sr_path) as img:
+            pixels = [np.asarray(hr, dtype=np.float32), np.asarray(img.convert('RGB'), dtype=np.float32)]
+        if random.random() < 0.5:
+            pixels = [side[:, ::-1] for side in pixels]
+        pixels = [side / 127.5 - 1 for side in pixels]
+    else:
+        # sr-implicit-downsampled: random crop of inp_size * scale, downsampled to inp_size
+        scale = random.uniform(1, wrapper['scale_max'])
+        crop = min(round(wrapper['inp_size'] * scale), *hr.size)
+        left, top = random.randint(0, hr.size[0] - crop), random.randint(0, hr.size[1] - crop)
+        crop_img = hr.crop((left, top, left + crop, top + crop))
+        inp = np.asarray(crop_img.resize((wrapper['inp_size'],) * 2, resample=Image.BICUBIC), dtype=np.float32)
+        gt = np.asarray(crop_img, dtype=np.float32).reshape(-1, 3)
+        gt = gt[np.random.choice(len(gt), min(wrapper['sample_q'], len(gt)), replace=False)]
+    return _peak_rss()
+
+
+def probe_loading(model: str, tasks: list, workers: int, seconds: float) -> dict:
+    """This function measures how many training samples per second are loaded with
+    the given number of worker processes.
+
+    Args:
+        model (str): 'sr3' or 'liif'
+        tasks (list): tasks of _load_sample, cycled during the probe
+        workers (int): worker processes, 0 loads in this process like a DataLoader without workers
+        seconds (float): duration of the probe
+
+    Returns:
+        dict: {'workers', 'samples_per_second', 'worker_memory'}
+    """
+    def endless():
+        while True:
+            yield from tasks
+
+    loaded, worker_memory = 0, 0
+    start = time.perf_counter()
+    if workers == 0:
+        for task in endless():
+            _load_sample(task)
+            loaded += 1
+            if time.perf_counter() - start >= seconds:
+                break
+    else:
+        with Pool(processes=workers) as pool:
+            start = time.perf_counter()
+            for peak in pool.imap_unordered(_load_sample, endless(), chunksize=4):
+                loaded += 1
+                worker_memory = max(worker_memory, peak)
+                if time.perf_counter() - start >= seconds:
+                    break
+            pool.terminate()
+    return {'workers': workers, 'samples_per_second': loaded / (time.perf_counter() - start),
+            'worker_memory': worker_memory}
+
+
+def _build_training_step(torch, model: str, config: dict, batch_size: int, device) -> callable:
+    """This function builds the model of a config and returns a function running one
+    training step on random inputs of the configured size."""
+    if model == 'sr3':
+        if SR3_DIR not in sys.path:
+            sys.path.insert(0, SR3_DIR)
+        import model.networks as networks
+        net = networks.define_G({'model': config['model'], 'phase': 'train', 'gpu_ids': None,
+                                 'distributed': False}).to(device)
+        net.set_loss(device)
+        net.set_new_noise_schedule(config['model']['beta_schedule']['train'], device)
+        size = config['model']['diffusion']['image_size']
+        data = {'HR': torch.rand(batch_size, 3, size, size, device=device) * 2 - 1,
+                'SR': torch.rand(batch_size, 3, size, size, device=device) * 2 - 1}
+        optimizer = torch.optim.Adam(net.parameters(), lr=config['train']['optimizer']['lr'])
+
+        def step():
+            optimizer.zero_grad()
+            loss = net(data).sum() / data['HR'].numel()
+            loss.backward()
+            optimizer.step()
+    else:
+        if LIIF_DIR not in sys.path:
+            sys.path.insert(0, LIIF_DIR)
+        import models
+        net = models.make(config['model']).to(device)
+        wrapper = config['wrapper']
+        inp = torch.rand(batch_size, 3, wrapper['inp_size'], wrapper['inp_size'], device=device) * 2 - 1
+        coord = torch.rand(batch_size, wrapper['sample_q'], 2, device=device) * 2 - 1
+        cell = torch.full((batch_size, wrapper['sample_q'], 2), 2 / (wrapper['inp_size'] * wrapper['scale_max']),
+                          device=device)
+        gt = torch.rand(batch_size, wrapper['sample_q'], 3, device=device) * 2 - 1
+        optimizer = torch.optim.Adam(net.parameters(), lr=1e-4)
+
+        def step():
+            optimizer.zero_grad()
+            loss = (net(inp, coord, cell) - gt).abs().mean()
+            loss.backward()
+            optimizer.step()
+    return step
+
+
+def _probe_training_process(model: str, config: dict, threads: int, batch_sizes: list, seconds: float,
+                            memory_limit: int) -> list:
+    """This function runs in a fresh process the training probes of every batch size,
+    from the smallest, and stops at the first one that does not fit in memory.
+
+    Returns:
+        list: a dict per batch size {'threads', 'batch_size', 'samples_per_second', 'memory', 'fits'}
+    """
+    import torch
+    torch.set_num_threads(threads)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    results = []
+    for batch_size in batch_sizes:
+        result = {'threads': threads, 'batch_size': batch_size, 'samples_per_second': 0.0, 'memory': None,
+                  'fits': False}
+        results.append(result)
+        try:
+            if device.type == 'cuda':
+                torch.cuda.empty_cache()
+                torch.cuda.reset_peak_memory_stats()
+            step = _build_training_step(torch, model, config, batch_size, device)
+            # The first step allocates the buffers of the optimizer and warms the kernels up
+            step()
+            steps = 0
+            start = time.perf_counter()
+            while steps < 2 or time.perf_counter() - start < seconds:
+                step()
+                steps += 1
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            elapsed = time.perf_counter() - start
+        except (MemoryError, RuntimeError) as error:
+            if isinstance(error, RuntimeError) and 'out of memory' not in str(error):
+                raise
+            break
+        result['samples_per_second'] = steps * batch_size / elapsed
+        # The peak memory only grows, the batch sizes go from the smallest
+        result['memory'] = _peak_rss()
+        result['fits'] = result['memory'] <= memory_limit
+        if not result['fits']:
+            break
+    return results
+
+
+def probe_training(model: str, config: dict, threads: int, batch_sizes: list, seconds: float,
+                   memory_limit: int) -> list:
+    """This function runs _probe_training_process in a spawned process, so the peak
+    memory and the threads of every thread count are measured on their own and an
+    out of memory kill does not stop the autotuner."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        try:
+            return executor.submit(_probe_training_process, model, config, threads, batch_sizes, seconds,
+                                   memory_limit).result()
+        except BrokenProcessPool:
+            print(f"The training probe with {threads} threads was killed, probably out of memory")
+            return []
+
+
+def choose(loading: list, training: list, cpus: int, memory_limit: int) -> dict:
+    """This function chooses the best combination of the probes. A DataLoader without
+    workers loads and trains in turns, with workers the slower of both sets the pace.
+
+    Args:
+        loading (list): results of probe_loading
+        training (list): results of probe_training, empty if the training could not be probed
+        cpus (int): CPUs shared by the threads and the workers
+        memory_limit (int): bytes available for the training process and its workers
+
+    Returns:
+        dict: {'batch_size', 'num_workers', 'threads', 'samples_per_second', 'memory'}, None if nothing fits
+    """
+    candidates = []
+    for train in training or [{'threads': 1, 'batch_size': None, 'samples_per_second': float('inf'),
+                               'memory': 0, 'fits': True}]:
+        if not train['fits'] or not train['samples_per_second']:
+            continue
+        for load in loading:
+            if load['workers'] and training and load['workers'] + train['threads'] > cpus:
+                continue
+            memory = train['memory'] + load['workers'] * load['worker_memory']
+            if memory > memory_limit:
+                continue
+            if load['workers']:
+                rate = min(load['samples_per_second'], train['samples_per_second'])
+            else:
+                rate = 1 / (1 / load['samples_per_second'] + 1 / train['samples_per_second'])
+            candidates.append({'batch_size': train['batch_size'], 'num_workers': load['workers'],
+                               'threads': train['threads'], 'samples_per_second': rate, 'memory': memory})
+    if not candidates:
+        return None
+    best = max(candidate['samples_per_second'] for candidate in candidates)
+    close = [candidate for candidate in candidates
+             if candidate['samples_per_second'] >= best * (1 - THROUGHPUT_TOLERANCE)]
+    return min(close, key=lambda candidate: (candidate['num_workers'] + candidate['threads'],
+                                             candidate['batch_size'] or 0))
+
+
+def write_sr3_config(text: str, tuned: dict, destination: str) -> None:
+    """This function writes the SR3 config with the tuned batch size and workers of
+    its training dataset, keeping its comments."""
+    train_start = SR3_TRAIN_SECTION.search(text).end()
+    head, train = text[:train_start], text[train_start:]
+    if tuned['batch_size'] is not None:
+        train = SR3_BATCH_SIZE.sub(rf"\g<1>{tuned['batch_size']}", train, count=1)
+    train = SR3_NUM_WORKERS.sub(rf"\g<1>{tuned['num_workers']}", train, count=1)
+    first_line, rest = (head + train).split('\n', 1)
+    comment = (f"    // {TUNED_COMMENT} batch_size={tuned['batch_size'] or 'not tuned'}, num_workers={tuned['num_workers']}, "
+               f"threads={tuned['threads']}")
+    with open(destination, 'w') as config_file:
+        config_file.write(f"{first_line}\n{comment}\n{rest}")
+
+
+def write_liif_config(text: str, tuned: dict, destination: str) -> None:
+    """This function writes the LIIF config with the tuned batch size of its training
+    dataset, keeping its comments."""
+    train_start = LIIF_TRAIN_SECTION.search(text).end()
+    head, train = text[:train_start], text[train_start:]
+    if tuned['batch_size'] is not None:
+        train = LIIF_BATCH_SIZE.sub(rf"\g<1>{tuned['batch_size']}", train, count=1)
+    comment = (f"# {TUNED_COMMENT} batch_size={tuned['batch_size'] or 'not tuned'}, num_workers={tuned['num_workers']}, "
+               f"threads={tuned['threads']}")
+    with open(destination, 'w') as config_file:
+        config_file.write(f"{comment}\n{head}{train}")
+
+
+def _liif_model_spec(text: str) -> dict:
+    """This function reads the model spec of a LIIF config, the only part of it that
+    needs a yaml parser, which the LIIF repository brings with it."""
+    import yaml
+    return yaml.safe_load(text)['model']
+
+
+@traced()
+def autotune(model: str = 'sr3', memory_gb: float = None, seconds: float = DEFAULT_PROBE_SECONDS,
+             cpus: int = None, batch_sizes: list = None, write: bool = True) -> dict:
+    """This function probes the data loading and the training of a model on this
+    machine and writes the tuned copy of its training config.
+
+    Args:
+        model (str, optional): 'sr3' or 'liif'. Defaults to 'sr3'.
+        memory_gb (float, optional): memory limit of the training and its workers.
+        Defaults to DEFAULT_MEMORY_FRACTION of the physical memory.
+        seconds (float, optional): duration of every probe. Defaults to DEFAULT_PROBE_SECONDS.
+        cpus (int, optional): CPUs to use. Defaults to the CPUs this process can run on.
+        batch_sizes (list, optional): batch sizes probed. Defaults to BATCH_SIZES of the model.
+        write (bool, optional): write the tuned config. Defaults to True.
+
+    Raises:
+        ValueError: raised if the model is unknown
+        FileNotFoundError: raised if the config or the prepared training images cannot be found
+
+    Returns:
+        dict: {'tuned', 'loading', 'training', 'config'}
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown model '{model}', choose between {MODELS}")
+    source, destination = config_paths(model)
+    if not os.path.isfile(source):
+        raise FileNotFoundError(f"The config file '{source}' could not be found!!")
+    with open(source, 'r') as config_file:
+        text = config_file.read()
+
+    train_dir = os.path.join(SR3_DATA_DIR, split_dir_name('train'))
+    hr_dir = os.path.join(train_dir, 'hr_256')
+    if not os.path.isdir(hr_dir):
+        raise FileNotFoundError(f"The training images could not be found at '{hr_dir}', prepare the data first!!")
+    names = sorted(os.listdir(hr_dir))
+    wrapper = read_liif_wrapper(text) if model == 'liif' else None
+    tasks = [(model, os.path.join(hr_dir, name), os.path.join(train_dir, 'sr_64_256', name), wrapper)
+             for name in names]
+    random.Random(0).shuffle(tasks)
+
+    cpus = cpus or len(os.sched_getaffinity(0))
+    memory_limit = int(memory_gb * 2 ** 30) if memory_gb else int(physical_memory() * DEFAULT_MEMORY_FRACTION)
+    print(f"Autotuning {model} with {cpus} CPUs and {memory_limit / 2 ** 30:.1f} GB of memory")
+
+    loading = []
+    with span(f"autotune loading {model}"):
+        for workers in [0] + powers_of_two(max(cpus - 1, 1)):
+            loading.append(probe_loading(model, tasks, workers, seconds))
+            print(f"  loading, {workers:3} workers: {loading[-1]['samples_per_second']:9.1f} samples/s")
+
+    training = []
+    try:
+        import torch  # noqa: F401
+    except ImportError:
+        torch = None
+        print("torch is not installed, only the data loader workers are tuned")
+    if torch is not None:
+        if model == 'sr3':
+            config = json.loads(strip_json_comments(text))
+        else:
+            config = {'model': _liif_model_spec(text), 'wrapper': wrapper}
+        with span(f"autotune training {model}"):
+            for threads in powers_of_two(cpus):
+                results = probe_training(model, config, threads, batch_sizes or BATCH_SIZES[model], seconds,
+                                         memory_limit)
+                training.extend(results)
+                for result in results:
+                    memory = '' if result['memory'] is None else f"{result['memory'] / 2 ** 30:6.2f} GB"
+                    print(f"  training, {threads:3} threads, batch {result['batch_size']:4}: "
+                          f"{result['samples_per_second']:9.2f} samples/s {memory}")
+
+    tuned = choose(loading, training, cpus, memory_limit)
+    if tuned is None:
+        raise MemoryError(f"No probed configuration of {model} fits in {memory_limit / 2 ** 30:.1f} GB")
+    print(f"Tuned {model}: batch_size={tuned['batch_size'] or 'not tuned'}, num_workers={tuned['num_workers']}, "
+          f"threads={tuned['threads']} ({tuned['samples_per_second']:.2f} samples/s)")
+    if write:
+        (write_sr3_config if model == 'sr3' else write_liif_config)(text, tuned, destination)
+        print(f"The tuned config has been written to '{destination}'.")
+    return {'tuned': tuned, 'loading': loading, 'training': training, 'config': destination}
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tune the batch size and loader workers of the training configs.")
+    parser.add_argument('model', choices=MODELS)
+    parser.add_argument('--memory-gb', type=float, default=None, help="memory limit, defaults to 80%% of the RAM")
+    parser.add_argument('--seconds', type=float, default=DEFAULT_PROBE_SECONDS, help="duration of every probe")
+    parser.add_argument('--cpus', type=int, default=None, help="CPUs to use, defaults to all of them")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=None, help="batch sizes to probe")
+    parser.add_argument('--dry-run', action='store_true', help="only print the tuned values")
+    args = parser.parse_args()
+    autotune(args.model, args.memory_gb, args.seconds, args.cpus, args.batch_sizes, write=not args.dry_run)
@@ -0,0 +1,462 @@
+"""
+This module contains a benchmark suite of the data preparation and inference
+steps, run on a synthetic dataset with the layout and image size of UC Merced
+Land Use, so it only needs a CPU and no downloads:
+
+    python tools/benchmarks.py run --output results.json
+    python tools/benchmarks.py run --output new.json --baseline results.json
+    python tools/benchmarks.py compare results.json new.json --threshold 0.1
+
+Every benchmark is repeated and its median time is kept. The comparison flags
+the benchmarks whose median time grew more than the threshold, the failed ones
+and the ones of the baseline that did not run, and exits with an error, so it
+can be used to stop a nightly job.
+
+The LIIF inference benchmark uses a tiny randomly initialized model and is
+skipped if torch or the liif repository are not available. The skipped
+benchmarks are recorded in the results, a benchmark skipped in both runs is not
+flagged.
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from dataset_storage import train_val_test_split
+from image_info import drop_wrong_images
+from image_resampler import process_images_in_folder, resample_image
+from models_storage import INFER_SCRIPT_FOLDER, LIIF_DIR
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+RESULTS_VERSION = 1
+BENCHMARKS = ('resample_image', 'process_images_in_folder', 'train_val_test_split',
+              'drop_wrong_images', 'infer_images')
+
+# Synthetic dataset: UC Merced has 21 classes of 100 images of 256x256
+DEFAULT_CLASSES = 5
+DEFAULT_IMAGES_PER_CLASS = 20
+IMAGE_SIZE = 256
+# Images per class with a wrong size and broken files, removed by drop_wrong_images
+WRONG_PER_CLASS = 1
+BROKEN_PER_CLASS = 1
+DEFAULT_SEED = 1234
+
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_INFER_IMAGES = 32
+
+# Tiny LIIF model: same architecture as the trained one, far fewer channels
+TINY_LIIF_SPEC = {
+    'name': 'liif',
+    'args': {
+        'encoder_spec': {'name': 'edsr-baseline', 'args': {'n_resblocks': 2, 'n_feats': 16, 'no_upsampling': True}},
+        'imnet_spec': {'name': 'mlp', 'args': {'out_dim': 3, 'hidden_list': [32, 32]}},
+    },
+}
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def make_synthetic_dataset(root_dir: str, classes: int = DEFAULT_CLASSES,
+                           images_per_class: int = DEFAULT_IMAGES_PER_CLASS, seed: int = DEFAULT_SEED) -> str:
+    """This function writes a dataset with the layout of UC Merced Land Use
+    ('Images/<class>/<class>NN.tif'). The images are smooth random textures, so they
+    compress like real photos, and every class also gets images of the wrong size
+    and broken files. The same seed always writes the same files.
+
+    Args:
+        root_dir (str): directory where the 'Images' folder is created
+        classes (int, optional): number of classes. Defaults to DEFAULT_CLASSES.
+        images_per_class (int, optional): valid images per class. Defaults to DEFAULT_IMAGES_PER_CLASS.
+        seed (int, optional): seed of the random images. Defaults to DEFAULT_SEED.
+
+    Returns:
+        str: the 'Images' directory
+    """
+    rng = np.random.RandomState(seed)
+    images_dir = os.path.join(root_dir, 'Images')
+    for class_id in range(classes):
+        class_name = f"class{class_id:02d}"
+        class_dir = os.path.join(images_dir, class_name)
+        os.makedirs(class_dir, exist_ok=True)
+        for position in range(images_per_class + WRONG_PER_CLASS + BROKEN_PER_CLASS):
+            path = os.path.join(class_dir, f"{class_name}{position:02d}.tif")
+            if position >= images_per_class + WRONG_PER_CLASS:
+                with open(path, 'wb') as broken:
+                    broken.write(rng.bytes(1024))
+                continue
+            size = IMAGE_SIZE if position < images_per_class else IMAGE_SIZE - 9
+            coarse = Image.fromarray(rng.randint(0, 256, (size // 8, size // 8, 3), dtype=np.uint8))
+            pixels = np.asarray(coarse.resize((size, size), resample=Image.BICUBIC), dtype=np.int16)
+            pixels = pixels + rng.randint(-8, 9, pixels.shape)
+            Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path)
+    return images_dir
+
+
+def _valid_images(images_dir: str) -> list:
+    """This function returns the synthetic images of the right size, sorted."""
+    paths = []
+    for class_name in sorted(os.listdir(images_dir)):
+        class_dir = os.path.join(images_dir, class_name)
+        for name in sorted(os.listdir(class_dir)):
+            with contextlib.suppress(OSError, SyntaxError), Image.open(os.path.join(class_dir, name)) as img:
+                if img.size == (IMAGE_SIZE, IMAGE_SIZE):
+                    paths.append(os.path.join(class_dir, name))
+    return paths
+
+
+def _measure(function, repeat: int, items: int, setup=None, verbose: bool = False) -> dict:
+    """This function times a function several times and summarizes the runs.
+
+    Args:
+        function (callable): function to time, called without arguments
+        repeat (int): number of timed runs
+        items (int): number of items processed by a run, to compute the throughput
+        setup (callable, optional): function called before every run, not timed. Defaults to None.
+        verbose (bool, optional): let the function print its messages. Defaults to False.
+
+    Returns:
+        dict: 'seconds' of every run, their 'median' and 'min', 'items' and 'items_per_second'
+    """
+    seconds = []
+    for _ in range(max(repeat, 1)):
+        if setup is not None:
+            setup()
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            start = time.perf_counter()
+            function()
+            seconds.append(time.perf_counter() - start)
+    median = statistics.median(seconds)
+    return {'seconds': seconds, 'median': median, 'min': min(seconds), 'items': items,
+            'items_per_second': items / median if median else 0.0}
+
+
+def bench_resample_image(images_dir: str, work_dir: str, repeat: int, verbose: bool = False) -> dict:
+    """This function times resample_image on the first images of the dataset."""
+    paths = _valid_images(images_dir)[:50]
+    output_dir = os.path.join(work_dir, 'resample_image')
+    os.makedirs(output_dir, exist_ok=True)
+
+    def run():
+        for path in paths:
+            resample_image(path, output_dir, 4)
+    return _measure(run, repeat, len(paths), verbose=verbose)
+
+
+def bench_process_images_in_folder(images_dir: str, work_dir: str, repeat: int, workers: int = None,
+                                   verbose: bool = False) -> dict:
+    """This function times process_images_in_folder on the first class, in a single
+    process and with the given number of workers."""
+    # The output folder name is computed from the '<name>_<resolution>' of the input one
+    class_dir = os.path.join(work_dir, 'process_images_in_folder', f"hr_{IMAGE_SIZE}")
+    source = os.path.join(images_dir, sorted(os.listdir(images_dir))[0])
+    if not os.path.isdir(class_dir):
+        shutil.copytree(source, class_dir)
+    items = len([name for name in os.listdir(class_dir) if name.endswith('.tif')])
+    workers = workers or os.cpu_count() or 1
+
+    results = {'workers_1': _measure(lambda: process_images_in_folder(class_dir, 4, workers=1), repeat, items,
+                                     verbose=verbose)}
+    if workers > 1:
+        results[f"workers_{workers}"] = _measure(lambda: process_images_in_folder(class_dir, 4, workers=workers),
+                                                 repeat, items, verbose=verbose)
+    return results
+
+
+def bench_train_val_test_split(images_dir: str, work_dir: str, repeat: int, verbose: bool = False) -> dict:
+    """This function times train_val_test_split of the whole dataset with a fixed seed."""
+    output_dir = os.path.join(work_dir, 'train_val_test_split')
+    items = sum(len(files) for _, _, files in os.walk(images_dir))
+    return _measure(lambda: train_val_test_split(images_dir, output_dir, seed=DEFAULT_SEED), repeat, items,
+                    verbose=verbose)
+
+
+def bench_drop_wrong_images(images_dir: str, work_dir: str, repeat: int, verbose: bool = False) -> dict:
+    """This function times drop_wrong_images on a fresh copy of the dataset with an
+    empty index ('cold') and again once the images are indexed ('warm')."""
+    copy_dir = os.path.join(work_dir, 'drop_wrong_images', 'Images')
+    index_path = os.path.join(work_dir, 'drop_wrong_images', 'index.sqlite')
+    items = sum(len(files) for _, _, files in os.walk(images_dir))
+
+    def fresh_copy():
+        if os.path.isdir(copy_dir):
+            shutil.rmtree(copy_dir)
+        if os.path.isfile(index_path):
+            os.remove(index_path)
+        shutil.copytree(images_dir, copy_dir)
+
+    run = lambda: drop_wrong_images(copy_dir, index_path=index_path)
+    return {'cold': _measure(run, repeat, items, setup=fresh_copy, verbose=verbose),
+            'warm': _measure(run, repeat, items, verbose=verbose)}
+
+
+def _import_liif() -> tuple:
+    """This function imports torch, the liif 'models' package and infer.py.
+
+    Raises:
+        ImportError: raised if torch or the liif repository are not available
+
+    Returns:
+        tuple: (torch, models, infer) modules
+    """
+    if not os.path.isdir(LIIF_DIR):
+        raise ImportError(f"The liif repository could not be found at '{LIIF_DIR}'")
+    for path in (INFER_SCRIPT_FOLDER, LIIF_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    import torch
+    import models
+    import infer
+    return torch, models, infer
+
+
+def bench_infer_images(images_dir: str, work_dir: str, repeat: int, images: int = DEFAULT_INFER_IMAGES,
+                       verbose: bool = False) -> dict:
+    """This function times infer_images on cpu with a tiny randomly initialized LIIF
+    model, inferring 64x64 versions of the dataset images at 256x256."""
+    torch, models, infer = _import_liif()
+    torch.manual_seed(DEFAULT_SEED)
+    model = models.make(TINY_LIIF_SPEC)
+    model_path = os.path.join(work_dir, 'infer_images', 'tiny_liif.pth')
+    input_dir = os.path.join(work_dir, 'infer_images', 'lr_64')
+    output_dir = os.path.join(work_dir, 'infer_images', 'output')
+    os.makedirs(input_dir, exist_ok=True)
+    torch.save({'model': dict(TINY_LIIF_SPEC, sd=model.state_dict())}, model_path)
+
+    paths = _valid_images(images_dir)[:images]
+    for path in paths:
+        with Image.open(path) as img:
+            name = os.path.splitext(os.path.basename(path))[0]
+            img.convert('RGB').resize((64, 64), resample=Image.BICUBIC).save(os.path.join(input_dir, f"{name}.png"))
+
+    run = lambda: infer.infer_images(input_dir, output_dir, model_path, torch.device('cpu'))
+    return _measure(run, repeat, len(paths), verbose=verbose)
+
+
+def _environment() -> dict:
+    """This function describes the machine and library versions the benchmarks ran on."""
+    environment = {'python': platform.python_version(), 'platform': platform.platform(),
+                   'machine': platform.machine(), 'cpu_count': os.cpu_count(),
+                   'numpy': np.__version__, 'pillow': Image.__version__ if hasattr(Image, '__version__') else None}
+    with contextlib.suppress(ImportError):
+        import torch
+        environment['torch'] = torch.__version__
+        environment['torch_threads'] = torch.get_num_threads()
+    return environment
+
+
+def run_benchmarks(only: list = None, classes: int = DEFAULT_CLASSES,
+                   images_per_class: int = DEFAULT_IMAGES_PER_CLASS, repeat: int = DEFAULT_REPEAT,
+                   workers: int = None, work_dir: str = None, verbose: bool = False) -> dict:
+    """This function creates the synthetic dataset and runs the benchmarks on it.
+
+    Args:
+        only (list, optional): names of the benchmarks to run. Defaults to every one in BENCHMARKS.
+        classes (int, optional): number of classes of the dataset. Defaults to DEFAULT_CLASSES.
+        images_per_class (int, optional): valid images per class. Defaults to DEFAULT_IMAGES_PER_CLASS.
+        repeat (int, optional): timed runs of every benchmark. Defaults to DEFAULT_REPEAT.
+        workers (int, optional): processes of the parallel benchmarks. Defaults to every core.
+        work_dir (str, optional): directory for the dataset and outputs, kept after the run.
+        Defaults to a temporary directory that is removed.
+        verbose (bool, optional): show the messages of the benchmarked functions. Defaults to False.
+
+    Returns:
+        dict: the results, with the environment and configuration they were obtained with, the
+        error of every benchmark that 'failed' and the reason of every one 'skipped'
+    """
+    selected = only or list(BENCHMARKS)
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {unknown}, choose between {list(BENCHMARKS)}")
+
+    results = {}
+    failed = {}
+    skipped = {}
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='sr_benchmarks_'))
+        os.makedirs(work_dir, exist_ok=True)
+        images_dir = os.path.join(work_dir, 'dataset', 'Images')
+        if not os.path.isdir(images_dir):
+            make_synthetic_dataset(os.path.join(work_dir, 'dataset'), classes, images_per_class)
+
+        for name in selected:
+            print(f"Running '{name}'...")
+            try:
+                if name == 'resample_image':
+                    results[name] = bench_resample_image(images_dir, work_dir, repeat, verbose)
+                elif name == 'process_images_in_folder':
+                    results.update({f"{name}/{key}": value for key, value in bench_process_images_in_folder(
+                        images_dir, work_dir, repeat, workers, verbose).items()})
+                elif name == 'train_val_test_split':
+                    results[name] = bench_train_val_test_split(images_dir, work_dir, repeat, verbose)
+                elif name == 'drop_wrong_images':
+                    results.update({f"{name}/{key}": value for key, value in bench_drop_wrong_images(
+                        images_dir, work_dir, repeat, verbose).items()})
+                elif name == 'infer_images':
+                    results[name] = bench_infer_images(images_dir, work_dir, repeat, verbose=verbose)
+            except ImportError as err:
+                skipped[name] = str(err)
+                print(f"Skipping '{name}': {err}")
+            except Exception as err:  # pylint: disable=broad-except
+                # A broken benchmark is recorded and does not stop the others
+                failed[name] = f"{type(err).__name__}: {err}"
+                print(f"The benchmark '{name}' failed: {failed[name]}")
+
+    print_results(results)
+    for name, error in failed.items():
+        print(f"{name:40}FAILED {error}")
+    for name, reason in skipped.items():
+        print(f"{name:40}SKIPPED {reason}")
+    return {'version': RESULTS_VERSION, 'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'environment': _environment(),
+            'config': {'classes': classes, 'images_per_class': images_per_class, 'repeat': repeat,
+                       'workers': workers or os.cpu_count(), 'seed': DEFAULT_SEED},
+            'results': results, 'failed': failed, 'skipped': skipped}
+
+
+def print_results(results: dict) -> None:
+    """This function prints the median time and throughput of every benchmark."""
+    print(f"{'benchmark':40}{'median s':>10}{'min s':>10}{'items/s':>10}")
+    for name, result in results.items():
+        print(f"{name:40}{result['median']:10.3f}{result['min']:10.3f}{result['items_per_second']:10.1f}")
+
+
+def save_results(results: dict, path: str) -> None:
+    """This function stores the results of run_benchmarks as json."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=1)
+    print(f"Results stored in '{path}'")
+
+
+def load_results(path: str) -> dict:
+    """This function loads results stored by save_results.
+
+    Raises:
+        FileNotFoundError: raised if the file does not exist
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"The results file '{path}' could not be found!!")
+    with open(path, 'r') as results_file:
+        return json.load(results_file)
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """This function compares the median times of two runs and prints them. A
+    benchmark regressed if its time grew more than the threshold, if it failed or if
+    it has results in the baseline but not in the new run, skipped or not.
+
+    Args:
+        baseline (dict): results of the reference run
+        current (dict): results of the new run
+        threshold (float, optional): relative slowdown accepted, 0.1 = 10%. Defaults to DEFAULT_THRESHOLD.
+
+    Returns:
+        list: names of the benchmarks that regressed, failed or are missing
+    """
+    if baseline.get('config') != current.get('config'):
+        print(f"WARNING: the runs used different configurations: {baseline.get('config')} != {current.get('config')}")
+
+    regressions = []
+    print(f"{'benchmark':40}{'baseline s':>12}{'current s':>12}{'change':>9}")
+    for name, result in current['results'].items():
+        reference = baseline['results'].get(name)
+        if reference is None:
+            print(f"{name:40}{'-':>12}{result['median']:12.3f}{'new':>9}")
+            continue
+        change = result['median'] / reference['median'] - 1 if reference['median'] else 0.0
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:40}{reference['median']:12.3f}{result['median']:12.3f}{change:+8.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    failed = current.get('failed', {})
+    skipped = current.get('skipped', {})
+    # Results of a benchmark with several cases are named '<benchmark>/<case>'
+    benchmark_of = lambda name: name.split('/')[0]
+    for name in baseline['results']:
+        if name not in current['results'] and benchmark_of(name) not in failed:
+            status = 'skipped' if benchmark_of(name) in skipped else 'missing'
+            print(f"{name:40}{baseline['results'][name]['median']:12.3f}{'-':>12}{status:>9}")
+            regressions.append(name)
+    for name in skipped:
+        if name in baseline.get('skipped', {}):
+            print(f"{name:40}{'-':>12}{'-':>12}{'skipped':>9}")
+    # A benchmark that failed in the new run counts as a regression
+    for name in failed:
+        reference = baseline['results'].get(name)
+        reference_time = f"{reference['median']:12.3f}" if reference else f"{'-':>12}"
+        print(f"{name:40}{reference_time}{'-':>12}{'FAILED':>9}")
+        regressions.append(name)
+
+    if regressions:
+        print(f"{len(regressions)} benchmarks are more than {threshold:.0%} slower, failed or are missing: "
+              f"{', '.join(regressions)}")
+    else:
+        print(f"No benchmark is more than {threshold:.0%} slower")
+    return regressions
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the data preparation and inference steps.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="run the benchmarks")
+    run_parser.add_argument('--output', default='benchmark_results.json', help="json file for the results")
+    run_parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=None)
+    run_parser.add_argument('--classes', type=int, default=DEFAULT_CLASSES)
+    run_parser.add_argument('--images-per-class', type=int, default=DEFAULT_IMAGES_PER_CLASS)
+    run_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument('--workers', type=int, default=None, help="processes of the parallel benchmarks")
+    run_parser.add_argument('--work-dir', default=None, help="keep the dataset and outputs in this directory")
+    run_parser.add_argument('--baseline', default=None, help="results to compare the new ones with")
+    run_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    run_parser.add_argument('--verbose', action='store_true')
+
+    compare_parser = subparsers.add_parser('compare', help="compare two results files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        new_results = run_benchmarks(args.only, args.classes, args.images_per_class, args.repeat, args.workers,
+                                     args.work_dir, args.verbose)
+        save_results(new_results, args.output)
+        regressed = compare_results(load_results(args.baseline), new_results, args.threshold) if args.baseline else []
+    else:
+        regressed = compare_results(load_results(args.baseline), load_results(args.current), args.threshold)
+    if regressed:
+        sys.exit(1)
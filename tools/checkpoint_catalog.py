@@ -0,0 +1,267 @@
+"""
+This module contains a catalog of the liif checkpoints stored under the 'save'
+directory of the liif repository. For every '.pth' it keeps its run, epoch, size,
+modification time and the validation PSNR logged by the training in the
+'log.txt' of the run, so the checkpoints can be listed and chosen by criteria
+("best", "latest", "epoch:N") without asking the user and without opening them.
+
+The catalog is cached in 'save/catalog.json' and refreshed incrementally: only
+the runs whose folder or log changed are scanned again, and only the files
+whose size or modification time changed are updated.
+
+    python tools/checkpoint_catalog.py list
+    python tools/checkpoint_catalog.py select best --run _train_UCMerced_LandUse-64-256
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import json
+import os
+import re
+
+from models_storage import LIIF_DIR, LIIF_SAVE_DIR
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+CATALOG_NAME = 'catalog.json'
+CATALOG_VERSION = 1
+RUN_LOG_NAME = 'log.txt'
+CHECKPOINT_EXTENSION = '.pth'
+
+# Lines written by liif's train_liif.py: "epoch 10/1000, train: loss=0.0312, val: psnr=28.1234, ..."
+EPOCH_LOG_PATTERN = re.compile(r'^epoch (\d+)/\d+')
+VAL_PSNR_PATTERN = re.compile(r'val: psnr=([-\d.]+)')
+EPOCH_FILE_PATTERN = re.compile(r'^epoch-(\d+)$')
+
+CRITERIA = ('best', 'latest', 'epoch:N')
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def parse_run_log(log_path: str) -> dict:
+    """This function reads the epochs and validation PSNRs logged by a liif training.
+
+    Args:
+        log_path (str): path to the log.txt of a run
+
+    Returns:
+        dict: {'last_epoch', 'best_epoch', 'val_psnr': {epoch: psnr}}, empty if the log does not exist
+    """
+    if not os.path.isfile(log_path):
+        return {}
+    last_epoch = None
+    val_psnr = {}
+    with open(log_path, 'r', errors='replace') as log_file:
+        for line in log_file:
+            epoch_match = EPOCH_LOG_PATTERN.match(line)
+            if not epoch_match:
+                continue
+            last_epoch = int(epoch_match.group(1))
+            psnr_match = VAL_PSNR_PATTERN.search(line)
+            if psnr_match:
+                val_psnr[last_epoch] = float(psnr_match.group(1))
+    # epoch-best.pth is saved every time the validation PSNR improves, so it is the first maximum
+    best_epoch = max(val_psnr, key=lambda epoch: (val_psnr[epoch], -epoch)) if val_psnr else None
+    return {'last_epoch': last_epoch, 'best_epoch': best_epoch, 'val_psnr': val_psnr}
+
+
+def checkpoint_info(path: str, run_log: dict) -> dict:
+    """This function builds the catalog entry of a checkpoint without opening it.
+
+    Args:
+        path (str): absolute path to the checkpoint
+        run_log (dict): log of its run, returned by parse_run_log
+
+    Returns:
+        dict: {'run', 'name', 'epoch', 'val_psnr', 'size', 'mtime_ns'}
+    """
+    stat = os.stat(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    epoch_match = EPOCH_FILE_PATTERN.match(name)
+    if epoch_match:
+        epoch = int(epoch_match.group(1))
+    elif name == 'epoch-best':
+        epoch = run_log.get('best_epoch')
+    elif name == 'epoch-last':
+        epoch = run_log.get('last_epoch')
+    else:
+        epoch = None
+    val_psnr = run_log.get('val_psnr', {}).get(epoch) if epoch is not None else None
+    return {'run': os.path.relpath(os.path.dirname(path), LIIF_SAVE_DIR), 'name': name, 'epoch': epoch,
+            'val_psnr': val_psnr, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _load_catalog(catalog_path: str) -> dict:
+    if not os.path.isfile(catalog_path):
+        return {'version': CATALOG_VERSION, 'runs': {}, 'checkpoints': {}}
+    try:
+        with open(catalog_path, 'r') as catalog_file:
+            catalog = json.load(catalog_file)
+    except (OSError, ValueError):
+        catalog = {}
+    if catalog.get('version') != CATALOG_VERSION:
+        return {'version': CATALOG_VERSION, 'runs': {}, 'checkpoints': {}}
+    return catalog
+
+
+def refresh_catalog(save_dir: str = LIIF_SAVE_DIR) -> dict:
+    """This function updates the cached catalog of the checkpoints of the runs under
+    save_dir. The run folders whose modification time and log did not change are not
+    listed again, and the checkpoints whose size and modification time did not change
+    are kept.
+
+    Args:
+        save_dir (str, optional): the liif 'save' directory. Defaults to LIIF_SAVE_DIR.
+
+    Returns:
+        dict: {checkpoint path relative to the liif repository: entry returned by checkpoint_info}
+    """
+    if not os.path.isdir(save_dir):
+        return {}
+    catalog_path = os.path.join(save_dir, CATALOG_NAME)
+    catalog = _load_catalog(catalog_path)
+    runs, checkpoints = {}, {}
+    changed = False
+
+    # liif saves every run in a folder of its own directly under save_dir
+    run_dirs = [save_dir] + sorted(entry.path for entry in os.scandir(save_dir) if entry.is_dir())
+    for current_path in run_dirs:
+        run_key = os.path.relpath(current_path, save_dir)
+        log_path = os.path.join(current_path, RUN_LOG_NAME)
+        log_stat = os.stat(log_path) if os.path.isfile(log_path) else None
+        signature = [os.stat(current_path).st_mtime_ns, log_stat.st_mtime_ns if log_stat else None]
+        cached_run = catalog['runs'].get(run_key)
+
+        if cached_run and cached_run['signature'] == signature:
+            files = cached_run['files']
+            run_log = cached_run['log']
+        else:
+            files = sorted(found for found in os.listdir(current_path) if found.endswith(CHECKPOINT_EXTENSION))
+            run_log = parse_run_log(log_path)
+            # json keys are strings, the epochs are kept as such
+            run_log['val_psnr'] = {str(epoch): psnr for epoch, psnr in run_log.get('val_psnr', {}).items()}
+            # Writing the catalog changes the mtime of save_dir, listing it again must not count as a change
+            changed = changed or not cached_run or [cached_run['files'], cached_run['log']] != [files, run_log]
+        runs[run_key] = {'signature': signature, 'files': files, 'log': run_log}
+        lookup_log = dict(run_log, val_psnr={int(epoch): psnr for epoch, psnr in run_log.get('val_psnr', {}).items()})
+
+        for found in files:
+            path = os.path.join(current_path, found)
+            key = os.path.relpath(path, LIIF_DIR)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                changed = True
+                continue
+            cached = catalog['checkpoints'].get(key)
+            if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns \
+                    and cached_run and cached_run['log'] == run_log:
+                checkpoints[key] = cached
+            else:
+                checkpoints[key] = checkpoint_info(path, lookup_log)
+                changed = True
+
+    if changed or set(checkpoints) != set(catalog['checkpoints']) or set(runs) != set(catalog['runs']):
+        tmp_path = catalog_path + '.tmp'
+        with open(tmp_path, 'w') as catalog_file:
+            json.dump({'version': CATALOG_VERSION, 'runs': runs, 'checkpoints': checkpoints}, catalog_file, indent=1)
+        os.replace(tmp_path, catalog_path)
+    return checkpoints
+
+
+def select_checkpoint(criterion: str = 'best', run: str = None, save_dir: str = LIIF_SAVE_DIR) -> str:
+    """This function chooses a checkpoint of the catalog without asking the user.
+
+    Args:
+        criterion (str, optional): 'best' (highest validation PSNR), 'latest' (last
+        modified) or 'epoch:N'. Defaults to 'best'.
+        run (str, optional): only consider the checkpoints of this run. Defaults to all runs.
+        save_dir (str, optional): the liif 'save' directory. Defaults to LIIF_SAVE_DIR.
+
+    Raises:
+        ValueError: raised if the criterion is unknown
+
+    Returns:
+        str: path to the checkpoint relative to the liif repository, None if none matches
+    """
+    checkpoints = {key: entry for key, entry in refresh_catalog(save_dir).items()
+                   if run is None or entry['run'] == run}
+    if criterion == 'best':
+        scored = {key: entry for key, entry in checkpoints.items() if entry['val_psnr'] is not None}
+        if not scored:
+            return None
+        # epoch-best.pth wins the ties with the epoch-N.pth of the same epoch
+        return max(scored, key=lambda key: (scored[key]['val_psnr'], scored[key]['name'] == 'epoch-best',
+                                            scored[key]['mtime_ns']))
+    if criterion == 'latest':
+        return max(checkpoints, key=lambda key: checkpoints[key]['mtime_ns']) if checkpoints else None
+    if criterion.startswith('epoch:'):
+        epoch = int(criterion.split(':', 1)[1])
+        matches = [key for key, entry in checkpoints.items() if entry['epoch'] == epoch]
+        return max(matches, key=lambda key: checkpoints[key]['mtime_ns']) if matches else None
+    raise ValueError(f"Unknown criterion '{criterion}', choose between {CRITERIA}")
+
+
+def resolve_checkpoint(model_path: str, run: str = None) -> str:
+    """This function returns the checkpoint selected by model_path if it is a criterion
+    of select_checkpoint, or model_path itself otherwise.
+
+    Args:
+        model_path (str): a checkpoint path relative to the liif repository or a criterion
+        run (str, optional): only consider the checkpoints of this run. Defaults to all runs.
+
+    Raises:
+        FileNotFoundError: raised if no checkpoint matches the criterion
+
+    Returns:
+        str: path to the checkpoint relative to the liif repository
+    """
+    if model_path not in ('best', 'latest') and not model_path.startswith('epoch:'):
+        return model_path
+    selected = select_checkpoint(model_path, run)
+    if selected is None:
+        raise FileNotFoundError(f"No liif checkpoint matches '{model_path}'!!")
+    return selected
+
+
+def print_catalog(checkpoints: dict) -> None:
+    """This function prints a row per checkpoint returned by refresh_catalog."""
+    print(f"{'checkpoint':60}{'epoch':>7}{'val psnr':>10}{'MB':>8}")
+    for key, entry in sorted(checkpoints.items()):
+        epoch = '' if entry['epoch'] is None else entry['epoch']
+        psnr = '' if entry['val_psnr'] is None else f"{entry['val_psnr']:.4f}"
+        print(f"{key[:59]:60}{epoch:>7}{psnr:>10}{entry['size'] / 2 ** 20:8.1f}")
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="List and select the liif checkpoints.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="print the checkpoints with their epoch and validation PSNR")
+    select_parser = subparsers.add_parser('select', help="print the checkpoint matching a criterion")
+    select_parser.add_argument('criterion', help=f"one of {CRITERIA}")
+    select_parser.add_argument('--run', default=None, help="only consider the checkpoints of this run")
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        print_catalog(refresh_catalog())
+    else:
+        selected = select_checkpoint(args.criterion, args.run)
+        if selected is None:
+            raise SystemExit(f"No checkpoint matches '{args.criterion}'")
+        print(selected)
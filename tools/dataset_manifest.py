@@ -0,0 +1,181 @@
+"""
+This module contains the functions to keep a manifest of the prepared dataset,
+so the data preparation can be repeated only for the images that changed since
+the last time it was executed.
+
+Every image of the source dataset gets an entry with the hash of its content,
+the split it was assigned to and the output files that were generated from it:
+
+    {
+        "version": 2,
+        "params": {"seed": 1234, "train_percent": 0.6, "val_percent": 0.2, "sizes": [64, 256]},
+        "images": {
+            "agricultural/agricultural00.tif": {
+                "sha1": "...", "size": 196662, "mtime_ns": 1684000000000000000,
+                "split": "train", "outputs": ["...", "..."]
+            }
+        }
+    }
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import hashlib
+import json
+import os
+
+from dataset_storage import DATA_DIR, DATASET1_NAME
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+MANIFEST_VERSION = 2
+MANIFEST_PATH = os.path.join(DATA_DIR, DATASET1_NAME + '_manifest.json')
+HASH_BLOCK_SIZE = 1 << 20
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def file_sha1(path: str) -> str:
+    """This function computes the sha1 hash of the content of a file.
+
+    Args:
+        path (str): path to the file
+
+    Returns:
+        str: hexadecimal hash of the file
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path: str = MANIFEST_PATH) -> dict:
+    """This function loads the manifest stored in the given path. An empty manifest
+    is returned if the file does not exist or was written by another version.
+
+    Args:
+        manifest_path (str, optional): path to the manifest file. Defaults to MANIFEST_PATH.
+
+    Returns:
+        dict: the manifest
+    """
+    empty = {'version': MANIFEST_VERSION, 'params': {}, 'images': {}}
+    if not os.path.isfile(manifest_path):
+        return empty
+
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        print(f"The manifest '{manifest_path}' could not be read and will be rebuilt")
+        return empty
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        return empty
+    return manifest
+
+
+def save_manifest(manifest: dict, manifest_path: str = MANIFEST_PATH) -> None:
+    """This function stores the manifest in the given path. The file is replaced
+    atomically so an interrupted run never leaves a half written manifest.
+
+    Args:
+        manifest (dict): the manifest to store
+        manifest_path (str, optional): path to the manifest file. Defaults to MANIFEST_PATH.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def delete_manifest(manifest_path: str = MANIFEST_PATH) -> None:
+    """This function removes the manifest, so the next incremental run
+    processes the whole dataset again.
+
+    Args:
+        manifest_path (str, optional): path to the manifest file. Defaults to MANIFEST_PATH.
+    """
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+
+
+def scan_sources(data_dir: str, previous_images: dict, extension: str = '.tif') -> dict:
+    """This function walks the given directory and returns the hash, size and
+    modification time of every image. The hash stored in the previous manifest is
+    reused for the files whose size and modification time did not change, so only
+    new or modified files are read.
+
+    Args:
+        data_dir (str): directory containing the source images
+        previous_images (dict): 'images' section of the previous manifest
+        extension (str, optional): extension of the images. Defaults to '.tif'.
+
+    Returns:
+        dict: {relative path: {'sha1', 'size', 'mtime_ns'}}
+    """
+    sources = {}
+    for current_path, _, files in os.walk(data_dir):
+        for found in sorted(files):
+            if not found.endswith(extension):
+                continue
+            full_path = os.path.join(current_path, found)
+            rel_path = os.path.relpath(full_path, data_dir)
+            stat = os.stat(full_path)
+            previous = previous_images.get(rel_path, {})
+            if previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+                sha1 = previous['sha1']
+            else:
+                sha1 = file_sha1(full_path)
+            sources[rel_path] = {'sha1': sha1, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return sources
+
+
+def is_up_to_date(previous: dict, current: dict) -> bool:
+    """This function tells whether an image whose previous manifest entry is given
+    needs to be processed again to obtain the current entry.
+
+    Args:
+        previous (dict): entry of the image in the previous manifest (may be None)
+        current (dict): entry expected for the image in this run
+
+    Returns:
+        bool: True if the previous outputs are still valid and present
+    """
+    if not previous:
+        return False
+    if previous.get('sha1') != current['sha1'] or previous.get('split') != current['split']:
+        return False
+    if sorted(previous.get('outputs', [])) != sorted(current['outputs']):
+        return False
+    return all(os.path.exists(path) for path in current['outputs'])
+
+
+def remove_outputs(paths: list) -> int:
+    """This function removes the given output files, ignoring the ones
+    that do not exist anymore.
+
+    Args:
+        paths (list): files to remove
+
+    Returns:
+        int: number of files actually removed
+    """
+    removed = 0
+    for path in paths:
+        if os.path.lexists(path):
+            os.remove(path)
+            removed += 1
+    return removed
@@ -7,11 +7,13 @@ be used within our code but do not fit in any other module.
 """
 
 import glob
+import hashlib
 import os
 import random
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
-import cv2
+from tracing import span, traced
 
 
 def get_root_dir() -> str:
@@ -42,6 +44,13 @@ DATA_DIR = os.path.join(ROOT_DIR, 'data')
 DATASET1_NAME = "UCMerced_LandUse"
 READY_DIR = os.path.join(DATA_DIR, DATASET1_NAME+'_ready')
 
+# Copy modes
+COPY_MODES = ('hardlink', 'reflink', 'copy')
+DEFAULT_COPY_WORKERS = 16
+
+# Linux ioctl used to clone a file sharing its blocks (cp --reflink)
+FICLONE = 0x40049409
+
 ###############################################################################
 #                                                                             #
 #                                 FUNCTIONS                                   #
@@ -68,23 +77,152 @@ def create_resample_dir(source_dir: str, resample_scale: float) -> str:
     return target_directory
 
 
-def copy_imgs_in_place(images: list, destination: str) -> None:
+def _reflink_file(source: str, destination: str) -> None:
+    """This function will clone the source file into the destination sharing
+    its data blocks, which only works on filesystems supporting it (btrfs, xfs...).
+
+    Args:
+        source (str): file to be cloned
+        destination (str): path of the clone
+
+    Raises:
+        OSError: raised if the filesystem does not support reflinks
+    """
+    import fcntl  # pylint: disable=import-outside-toplevel
+
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+
+
+def copy_file(source: str, destination: str, mode: str = 'hardlink') -> str:
+    """This function will place a byte identical copy of the source file in the
+    destination path, without decoding it. If the selected mode is not possible
+    (different filesystems, no reflink support...) a plain copy is made.
+
+    Args:
+        source (str): file to be copied
+        destination (str): path of the copy
+        mode (str, optional): one of 'hardlink', 'reflink' or 'copy'. Defaults to 'hardlink'.
+
+    Raises:
+        ValueError: raised if the given mode is not one of COPY_MODES
+
+    Returns:
+        str: the mode that was finally used
+    """
+    if mode not in COPY_MODES:
+        raise ValueError(f"The copy mode '{mode}' is not valid. Use one of {COPY_MODES}")
+
+    if os.path.lexists(destination):
+        os.remove(destination)
+
+    try:
+        if mode == 'hardlink':
+            os.link(source, destination)
+            return mode
+        if mode == 'reflink':
+            _reflink_file(source, destination)
+            return mode
+    except OSError:
+        pass
+
+    shutil.copyfile(source, destination)
+    return 'copy'
+
+
+def copy_imgs_in_place(images: list, destination: str, mode: str = 'hardlink',
+                       workers: int = DEFAULT_COPY_WORKERS) -> None:
     """This function will take a list of image paths and
     copy them into the given destination.
 
     Args:
         images (list): list of images
         destination (str): destination directory
+        mode (str, optional): one of 'hardlink', 'reflink' or 'copy'. Defaults to 'hardlink'.
+        workers (int, optional): number of threads copying files. Defaults to DEFAULT_COPY_WORKERS.
+    """
+    copy_many([(path, os.path.join(destination, os.path.basename(path))) for path in images],
+              mode=mode, workers=workers)
+
+
+def copy_many(pairs: list, mode: str = 'hardlink', workers: int = DEFAULT_COPY_WORKERS) -> None:
+    """This function will copy every (source, destination) pair using a pool
+    of threads, as the work is bound by the filesystem and not by python.
+
+    Args:
+        pairs (list): list of tuples (source, destination)
+        mode (str, optional): one of 'hardlink', 'reflink' or 'copy'. Defaults to 'hardlink'.
+        workers (int, optional): number of threads copying files. Defaults to DEFAULT_COPY_WORKERS.
     """
-    for train_path in images:
-        image = cv2.imread(train_path)
-        new_path = os.path.join(destination, os.path.basename(train_path))
-        cv2.imwrite(new_path, image)
+    if mode not in COPY_MODES:
+        raise ValueError(f"The copy mode '{mode}' is not valid. Use one of {COPY_MODES}")
+
+    with span('copy_many', files=len(pairs), mode=mode) as current:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            # list() so the first error raised by a copy is propagated
+            used_modes = list(executor.map(lambda pair: copy_file(pair[0], pair[1], mode), pairs))
+        # Only plain copies write data, links and reflinks share the blocks of the source
+        current.add_paths((pair[1] for pair, used in zip(pairs, used_modes) if used == 'copy'),
+                          written=True, count_files=False)
+
 
+def split_class_images(images_paths: list, train_percent: float = .6, val_percent: float = .2) -> tuple:
+    """This function will randomly group the given images into train, val and
+    test using the current state of the random module. The draws are the same
+    ones done by previous versions of train_val_test_split, so a given seed
+    keeps producing the same split.
+
+    Args:
+        images_paths (list): sorted list of the images of a class
+        train_percent (float, optional): percentage of the images set to train group. Defaults to .6.
+        val_percent (float, optional): percentage of the images set to val group. Defaults to .2.
+
+    Returns:
+        tuple: the train, val and test lists of images
+    """
+    image_num = len(images_paths)
+    train = random.sample(images_paths, int(image_num * train_percent))
+    train_set = set(train)
+    remaining = [x for x in images_paths if x not in train_set]
+    val = random.sample(remaining, int(image_num * val_percent))
+    val_set = set(val)
+    test = [x for x in remaining if x not in val_set]
+    return train, val, test
 
+
+def assign_split(key: str, train_percent: float = .6, val_percent: float = .2, seed: int = 0) -> str:
+    """This function assigns an image to train, val or test from a hash of the given
+    key (e.g. the hash of the image content) and the seed. Unlike the random split,
+    the assignment of an image does not depend on the rest of the images, so adding
+    new images to the dataset never moves the ones that were already assigned.
+
+    Args:
+        key (str): stable identifier of the image
+        train_percent (float, optional): percentage of the images set to train group. Defaults to .6.
+        val_percent (float, optional): percentage of the images set to val group. Defaults to .2.
+        seed (int, optional): seed used to obtain a different subdivision. Defaults to 0.
+
+    Returns:
+        str: 'train', 'val' or 'test'
+    """
+    digest = hashlib.sha1(f"{seed}:{key}".encode()).hexdigest()
+    position = int(digest[:15], 16) / float(16 ** 15)
+    if position < train_percent:
+        return 'train'
+    if position < train_percent + val_percent:
+        return 'val'
+    return 'test'
+
+
+@traced()
 def train_val_test_split(data_dir: str = os.path.join(DATA_DIR, DATASET1_NAME, 'Images'),
                          output_dir: str = READY_DIR, train_percent=.6, val_percent=.2,
-                         seed: int = -1) -> None:
+                         seed: int = -1, mode: str = 'hardlink', workers: int = DEFAULT_COPY_WORKERS) -> None:
     """This function will take a given directory and loop over every subfolder randomly grouping
     the images into three groups (train, val, test) keeping the propotions as told in the
     'train_percent' and 'val_percent' parameters.
@@ -95,6 +233,8 @@ def train_val_test_split(data_dir: str = os.path.join(DATA_DIR, DATASET1_NAME, '
         train_percent (float, optional): percentage of the total images set to train group. Defaults to .6.
         val_percent (float, optional): percentage of the total images set to val group. Defaults to .2.
         seed (int, optional): seed used to replicate the same subdivision. Defaults to -1.
+        mode (str, optional): how images are copied: 'hardlink', 'reflink' or 'copy'. Defaults to 'hardlink'.
+        workers (int, optional): number of threads copying files. Defaults to DEFAULT_COPY_WORKERS.
     """
 
     if seed != -1:
@@ -103,29 +243,17 @@ def train_val_test_split(data_dir: str = os.path.join(DATA_DIR, DATASET1_NAME, '
     if os.path.exists(output_dir) and os.path.isdir(output_dir):
         print(f"Removing previous content of {output_dir}")
         shutil.rmtree(output_dir)
-    
-    # train
-    train_dir = os.path.join(output_dir, 'train')
-    os.makedirs(train_dir, exist_ok=True)
 
-    # val
-    val_dir = os.path.join(output_dir, 'val')
-    os.makedirs(val_dir, exist_ok=True)
-
-    # test
-    test_dir = os.path.join(output_dir, 'test')
-    os.makedirs(test_dir, exist_ok=True)
+    split_dirs = {}
+    for split in ('train', 'val', 'test'):
+        split_dirs[split] = os.path.join(output_dir, split)
+        os.makedirs(split_dirs[split], exist_ok=True)
 
+    pairs = []
     for image_type in os.listdir(data_dir):
         images_paths = sorted(glob.glob(os.path.join(data_dir, image_type, "*.tif"), recursive=False))
-        image_num = len(images_paths)
-        train = random.sample(images_paths, int(image_num * train_percent))
-        images_paths = [x for x in images_paths if x not in train]
-        val = random.sample(images_paths, int(image_num * val_percent))
-        test = [x for x in images_paths if x not in val]
-        copy_imgs_in_place(train, train_dir)
-        copy_imgs_in_place(val, val_dir)
-        copy_imgs_in_place(test, test_dir)
-        train = []
-        val = []
-        test = []
+        groups = split_class_images(images_paths, train_percent, val_percent)
+        for split, images in zip(('train', 'val', 'test'), groups):
+            pairs.extend((path, os.path.join(split_dirs[split], os.path.basename(path))) for path in images)
+
+    copy_many(pairs, mode=mode, workers=workers)
@@ -0,0 +1,545 @@
+"""
+This module contains a degradation engine that builds low resolution images
+from high resolution ones on whole batches with numpy, instead of writing a low
+resolution copy of the dataset for every recipe. A batch of (n, h, w, 3) images
+goes through, in this order and with random parameters drawn for every sample:
+
+    gaussian blur -> bicubic downsampling -> gaussian noise -> JPEG compression
+
+The bicubic resize (a = -0.5, antialiased like PIL) is two matrix products, into
+which the blur of every sample is folded (both are linear), and the JPEG step a
+blockwise 8x8 DCT quantized with the standard tables scaled by the quality of
+every sample (without chroma subsampling, so it is JPEG-like rather than a
+bit exact codec).
+
+It can be used offline, writing the degraded images and their parameters:
+
+    python tools/degradation.py <dataset>/train_64_256/hr_256 --scale 4 --blur 0.2 3 --noise 0 15 --jpeg 40 95
+
+or inside the DataLoader workers of the models. Like shard_storage, it does not
+import anything else from this project, so it is copied into the LIIF 'datasets'
+package and the SR3 'data' package (see models_storage.copy_dataset_adapters):
+
+    LIIF:   dataset: {name: degraded-paired, args: {root_path: ./load/train_64_256.shards, scale: 4, noise: [0, 15]}}
+            wrapper: {name: sr-implicit-paired, ...}
+    SR3:    "dataroot": "dataset/train_64_256", "datatype": "degraded"
+            (SR3 does not pass other options to its datasets, the recipe is read from
+            'dataset/train_64_256/degradation_recipe.json' if it exists)
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+try:
+    from .shard_storage import INDEX_NAME, ShardArray, shard_dir_for
+except ImportError:
+    from shard_storage import INDEX_NAME, ShardArray, shard_dir_for
+
+try:
+    import torch
+    from torch.utils.data import Dataset, get_worker_info
+except ImportError:
+    torch = None
+    Dataset = object
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+DEFAULT_SCALE = 4
+DEFAULT_BATCH_SIZE = 64
+PARAMS_NAME = 'degradation.json'
+# Recipe of the SR3 dataset, next to the split it degrades
+RECIPE_NAME = 'degradation_recipe.json'
+
+# Default recipe: ranges the parameters of every sample are drawn from, and the
+# probability of applying every step
+DEFAULT_RECIPE = {'blur': (0.2, 2.0), 'blur_prob': 0.5,
+                  'noise': (1.0, 15.0), 'noise_prob': 0.5,
+                  'jpeg': (40, 95), 'jpeg_prob': 0.5}
+
+# Bicubic convolution kernel parameter, the one PIL and Matlab use
+CUBIC_A = -0.5
+
+# Standard JPEG quantization tables (ITU-T T.81, Annex K)
+JPEG_LUMA_TABLE = np.array([
+    [16, 11, 10, 16, 24, 40, 51, 61], [12, 12, 14, 19, 26, 58, 60, 55],
+    [14, 13, 16, 24, 40, 57, 69, 56], [14, 17, 22, 29, 51, 87, 80, 62],
+    [18, 22, 37, 56, 68, 109, 103, 77], [24, 35, 55, 64, 81, 104, 113, 92],
+    [49, 64, 78, 87, 103, 121, 120, 101], [72, 92, 95, 98, 112, 100, 103, 99]], dtype=np.float32)
+JPEG_CHROMA_TABLE = np.full((8, 8), 99, dtype=np.float32)
+JPEG_CHROMA_TABLE[:4, :4] = [[17, 18, 24, 47], [18, 21, 26, 66], [24, 26, 56, 99], [47, 66, 99, 99]]
+JPEG_BLOCK = 8
+
+# JFIF RGB <-> YCbCr
+RGB_TO_YCBCR = np.array([[0.299, 0.587, 0.114],
+                         [-0.168736, -0.331264, 0.5],
+                         [0.5, -0.418688, -0.081312]], dtype=np.float32)
+YCBCR_TO_RGB = np.linalg.inv(RGB_TO_YCBCR).astype(np.float32)
+YCBCR_OFFSET = np.array([0, 128, 128], dtype=np.float32)
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def gaussian_kernels(sigmas: np.ndarray, size: int) -> np.ndarray:
+    """This function builds a normalized 1D gaussian kernel per sample, a delta for
+    the samples whose sigma is 0.
+
+    Args:
+        sigmas (np.ndarray): (n,) standard deviations in pixels
+        size (int): odd length of the kernels
+
+    Returns:
+        np.ndarray: (n, size) kernels
+    """
+    offsets = np.arange(size, dtype=np.float32) - size // 2
+    sigmas = np.maximum(np.asarray(sigmas, dtype=np.float32), 1e-6)[:, None]
+    kernels = np.exp(-offsets ** 2 / (2 * sigmas ** 2))
+    return kernels / kernels.sum(axis=1, keepdims=True)
+
+
+def blur_matrices(sigmas: np.ndarray, size: int) -> np.ndarray:
+    """This function builds, for every sample, the matrix of a 1D gaussian blur along
+    an axis of the given length, reflecting the borders. Multiplying it with the
+    resize matrix blurs and resizes in a single product.
+
+    Args:
+        sigmas (np.ndarray): (n,) standard deviations in pixels, 0 gives the identity
+        size (int): length of the axis
+
+    Returns:
+        np.ndarray: (n, size, size) float32 matrices
+    """
+    sigmas = np.asarray(sigmas, dtype=np.float32)
+    radius = min(max(int(math.ceil(3 * sigmas.max())), 1), size - 1)
+    kernels = gaussian_kernels(sigmas, 2 * radius + 1)
+    sources = np.abs(np.arange(size)[:, None] + np.arange(-radius, radius + 1))
+    sources = np.where(sources >= size, 2 * (size - 1) - sources, sources)
+    matrices = np.zeros((len(sigmas), size, size), dtype=np.float32)
+    rows = np.arange(size)
+    for tap in range(kernels.shape[1]):
+        # Every row gets one source per tap, the reflected sources may repeat in a row
+        np.add.at(matrices, (slice(None), rows, sources[:, tap]), kernels[:, tap][:, None])
+    return matrices
+
+
+def blur_batch(images: np.ndarray, sigmas: np.ndarray) -> np.ndarray:
+    """This function blurs every image of a batch with its own gaussian kernel,
+    reflecting the borders.
+
+    Args:
+        images (np.ndarray): (n, h, w, c) float32 images
+        sigmas (np.ndarray): (n,) standard deviations in pixels, 0 leaves the image untouched
+
+    Returns:
+        np.ndarray: (n, h, w, c) blurred images
+    """
+    sigmas = np.asarray(sigmas, dtype=np.float32)
+    if not sigmas.any():
+        return images
+    rows = blur_matrices(sigmas, images.shape[1])
+    cols = blur_matrices(sigmas, images.shape[2])
+    return np.einsum('nkh,nhwc,nvw->nkvc', rows, images, cols, optimize=True)
+
+
+def _cubic(distance: np.ndarray) -> np.ndarray:
+    distance = np.abs(distance)
+    near = ((CUBIC_A + 2) * distance - (CUBIC_A + 3)) * distance ** 2 + 1
+    far = CUBIC_A * (((distance - 5) * distance + 8) * distance - 4)
+    return np.where(distance <= 1, near, np.where(distance < 2, far, 0))
+
+
+def resize_weights(in_size: int, out_size: int) -> np.ndarray:
+    """This function builds the matrix of a 1D bicubic resize. When downsampling the
+    kernel is stretched by the scale (antialiasing) and the taps falling outside the
+    image are dropped, as PIL does.
+
+    Args:
+        in_size (int): input length
+        out_size (int): output length
+
+    Returns:
+        np.ndarray: (out_size, in_size) float32 matrix
+    """
+    scale = in_size / out_size
+    stretch = max(scale, 1.0)
+    support = 2 * stretch
+    centers = (np.arange(out_size) + 0.5) * scale
+    taps = np.floor(centers - support)[:, None].astype(int) + np.arange(int(math.ceil(2 * support)) + 2)
+    weights = _cubic((taps + 0.5 - centers[:, None]) / stretch)
+    weights[(taps < 0) | (taps >= in_size)] = 0
+    weights /= weights.sum(axis=1, keepdims=True)
+    matrix = np.zeros((out_size, in_size), dtype=np.float64)
+    np.add.at(matrix, (np.repeat(np.arange(out_size), taps.shape[1]), np.clip(taps, 0, in_size - 1).ravel()),
+              weights.ravel())
+    return matrix.astype(np.float32)
+
+
+def resize_batch(images: np.ndarray, height: int, width: int) -> np.ndarray:
+    """This function resizes a batch of images with bicubic interpolation.
+
+    Args:
+        images (np.ndarray): (n, h, w, c) float32 images
+        height (int): output height
+        width (int): output width
+
+    Returns:
+        np.ndarray: (n, height, width, c) images
+    """
+    rows = resize_weights(images.shape[1], height)
+    cols = resize_weights(images.shape[2], width)
+    return np.einsum('oh,nhwc,pw->nopc', rows, images, cols, optimize=True)
+
+
+def noise_batch(images: np.ndarray, sigmas: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """This function adds gaussian noise with its own standard deviation to every image.
+
+    Args:
+        images (np.ndarray): (n, h, w, c) float32 images in [0, 255]
+        sigmas (np.ndarray): (n,) standard deviations, 0 leaves the image untouched
+        rng (np.random.Generator): random generator
+
+    Returns:
+        np.ndarray: (n, h, w, c) noisy images
+    """
+    sigmas = np.asarray(sigmas, dtype=np.float32)
+    if not sigmas.any():
+        return images
+    return images + rng.standard_normal(images.shape, dtype=np.float32) * sigmas[:, None, None, None]
+
+
+def _dct_matrix(size: int = JPEG_BLOCK) -> np.ndarray:
+    positions = np.arange(size)
+    matrix = np.cos((2 * positions[None, :] + 1) * positions[:, None] * np.pi / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+DCT_MATRIX = _dct_matrix()
+
+
+def jpeg_tables(qualities: np.ndarray) -> np.ndarray:
+    """This function scales the standard quantization tables to the quality of every
+    sample, as the IJG encoder does.
+
+    Args:
+        qualities (np.ndarray): (n,) qualities in [1, 100]
+
+    Returns:
+        np.ndarray: (n, 3, 8, 8) tables for the Y, Cb and Cr channels
+    """
+    qualities = np.clip(np.asarray(qualities, dtype=np.float32), 1, 100)
+    factors = np.where(qualities < 50, 5000 / qualities, 200 - 2 * qualities)[:, None, None, None]
+    tables = np.stack([JPEG_LUMA_TABLE, JPEG_CHROMA_TABLE, JPEG_CHROMA_TABLE])[None]
+    return np.clip(np.floor((tables * factors + 50) / 100), 1, 255)
+
+
+def jpeg_batch(images: np.ndarray, qualities: np.ndarray) -> np.ndarray:
+    """This function applies a JPEG-like compression to every image with its own
+    quality: 8x8 DCT of the YCbCr channels, quantization and reconstruction.
+
+    Args:
+        images (np.ndarray): (n, h, w, 3) float32 images in [0, 255]
+        qualities (np.ndarray): (n,) qualities in [1, 100]
+
+    Returns:
+        np.ndarray: (n, h, w, 3) compressed images
+    """
+    count, height, width, _ = images.shape
+    pad_h, pad_w = -height % JPEG_BLOCK, -width % JPEG_BLOCK
+    ycbcr = np.clip(images, 0, 255) @ RGB_TO_YCBCR.T + YCBCR_OFFSET - 128
+    ycbcr = np.pad(ycbcr, ((0, 0), (0, pad_h), (0, pad_w), (0, 0)), mode='edge')
+    blocks_h, blocks_w = ycbcr.shape[1] // JPEG_BLOCK, ycbcr.shape[2] // JPEG_BLOCK
+    # (n, blocks_h, blocks_w, channel, 8, 8)
+    blocks = ycbcr.reshape(count, blocks_h, JPEG_BLOCK, blocks_w, JPEG_BLOCK, 3).transpose(0, 1, 3, 5, 2, 4)
+    coefficients = DCT_MATRIX @ blocks @ DCT_MATRIX.T
+    tables = jpeg_tables(qualities)[:, None, None]
+    blocks = DCT_MATRIX.T @ (np.round(coefficients / tables) * tables) @ DCT_MATRIX
+    ycbcr = blocks.transpose(0, 1, 4, 2, 5, 3).reshape(count, blocks_h * JPEG_BLOCK, blocks_w * JPEG_BLOCK, 3)
+    return (ycbcr[:, :height, :width] + 128 - YCBCR_OFFSET) @ YCBCR_TO_RGB.T
+
+
+class Degradation:
+    """A degradation recipe: the ranges the parameters of every sample are drawn from
+    and the probability of every step. A range (low, high) draws uniformly, a single
+    value is used as it is, and None disables the step.
+    """
+
+    def __init__(self, scale: float = DEFAULT_SCALE, blur=DEFAULT_RECIPE['blur'],
+                 blur_prob: float = DEFAULT_RECIPE['blur_prob'], noise=DEFAULT_RECIPE['noise'],
+                 noise_prob: float = DEFAULT_RECIPE['noise_prob'], jpeg=DEFAULT_RECIPE['jpeg'],
+                 jpeg_prob: float = DEFAULT_RECIPE['jpeg_prob']):
+        self.scale = scale
+        self.blur, self.blur_prob = blur, blur_prob
+        self.noise, self.noise_prob = noise, noise_prob
+        self.jpeg, self.jpeg_prob = jpeg, jpeg_prob
+
+    def recipe(self) -> dict:
+        return dict(self.__dict__)
+
+    @staticmethod
+    def _draw(value_range, probability: float, count: int, rng: np.random.Generator, off: float) -> np.ndarray:
+        if value_range is None:
+            return np.full(count, off, dtype=np.float32)
+        low, high = (value_range, value_range) if np.isscalar(value_range) else value_range
+        values = rng.uniform(low, high, count).astype(np.float32)
+        return np.where(rng.random(count) < probability, values, off).astype(np.float32)
+
+    def sample(self, count: int, rng: np.random.Generator) -> dict:
+        """Draws the parameters of count samples: {'blur', 'noise', 'jpeg'} arrays
+        where 0 (100 for jpeg) means the step is skipped."""
+        return {'blur': self._draw(self.blur, self.blur_prob, count, rng, 0),
+                'noise': self._draw(self.noise, self.noise_prob, count, rng, 0),
+                'jpeg': np.round(self._draw(self.jpeg, self.jpeg_prob, count, rng, 100))}
+
+    def apply(self, images: np.ndarray, params: dict, rng: np.random.Generator) -> np.ndarray:
+        """Degrades a batch of (n, h, w, c) images in [0, 255] with the given parameters
+        and returns the (n, h / scale, w / scale, c) uint8 low resolution images."""
+        images = np.asarray(images, dtype=np.float32)
+        height, width = images.shape[1:3]
+        # Blur and downsampling are linear, both are applied with one matrix per axis and sample
+        rows = resize_weights(height, int(height // self.scale)) @ blur_matrices(params['blur'], height)
+        cols = resize_weights(width, int(width // self.scale)) @ blur_matrices(params['blur'], width)
+        images = np.einsum('noh,nhwc,npw->nopc', rows, images, cols, optimize=True)
+        images = noise_batch(images, params['noise'], rng)
+        compressed = params['jpeg'] < 100
+        if compressed.any():
+            images[compressed] = jpeg_batch(images[compressed], params['jpeg'][compressed])
+        return np.clip(np.round(images), 0, 255).astype(np.uint8)
+
+    def __call__(self, images: np.ndarray, rng: np.random.Generator = None) -> tuple:
+        """Degrades a batch with new random parameters and returns the low resolution
+        images and the parameters used."""
+        rng = rng or np.random.default_rng()
+        params = self.sample(len(images), rng)
+        return self.apply(images, params, rng), params
+
+
+def upsample(images: np.ndarray, height: int, width: int) -> np.ndarray:
+    """This function upsamples a batch of uint8 images with bicubic interpolation,
+    as the 'sr' images SR3 is conditioned on."""
+    resized = resize_batch(np.asarray(images, dtype=np.float32), height, width)
+    return np.clip(np.round(resized), 0, 255).astype(np.uint8)
+
+
+def _load_rgb(path: str) -> np.ndarray:
+    with Image.open(path) as img:
+        return np.asarray(img.convert('RGB'))
+
+
+def _degrade_task(task: tuple) -> list:
+    """This function degrades a batch of image files inside a pool worker and writes
+    the results, returning the parameters of every image."""
+    paths, output_dir, recipe, seed, batch_index = task
+    degradation = Degradation(**recipe)
+    rng = np.random.default_rng([seed, batch_index])
+    groups = {}
+    for path in paths:
+        image = _load_rgb(path)
+        groups.setdefault(image.shape, []).append((path, image))
+    records = []
+    for group in groups.values():
+        low, params = degradation(np.stack([image for _, image in group]), rng)
+        for index, (path, _) in enumerate(group):
+            name = os.path.splitext(os.path.basename(path))[0] + '.png'
+            Image.fromarray(low[index]).save(os.path.join(output_dir, name))
+            records.append({'name': name, **{key: float(values[index]) for key, values in params.items()}})
+    return records
+
+
+def degrade_folder(hr_dir: str, output_dir: str = None, recipe: dict = None, seed: int = 0,
+                   batch_size: int = DEFAULT_BATCH_SIZE, workers: int = None) -> str:
+    """This function writes a degraded copy of every image of a folder, batch by batch
+    in a pool of processes, and the parameters used for every image in PARAMS_NAME.
+    The result only depends on the seed, not on the number of workers.
+
+    Args:
+        hr_dir (str): folder of the high resolution images
+        output_dir (str, optional): folder of the results. Defaults to '<hr_dir>_degraded_x<scale>'.
+        recipe (dict, optional): arguments of Degradation. Defaults to DEFAULT_RECIPE and DEFAULT_SCALE.
+        seed (int, optional): seed of the random parameters. Defaults to 0.
+        batch_size (int, optional): images degraded together. Defaults to DEFAULT_BATCH_SIZE.
+        workers (int, optional): number of processes. None uses every core. Defaults to None.
+
+    Raises:
+        FileNotFoundError: raised if hr_dir does not exist
+
+    Returns:
+        str: the output folder
+    """
+    if not os.path.isdir(hr_dir):
+        raise FileNotFoundError(f"The directory '{hr_dir}' could not be found!!")
+    recipe = Degradation(**(recipe or {})).recipe()
+    output_dir = output_dir or f"{hr_dir.rstrip(os.sep)}_degraded_x{recipe['scale']:g}"
+    os.makedirs(output_dir, exist_ok=True)
+    paths = sorted(path for extension in ('*.png', '*.tif', '*.jpg')
+                   for path in glob.glob(os.path.join(hr_dir, extension)))
+    tasks = [(paths[start:start + batch_size], output_dir, recipe, seed, index)
+             for index, start in enumerate(range(0, len(paths), batch_size))]
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+
+    records = []
+    if workers == 1:
+        for task in tasks:
+            records.extend(_degrade_task(task))
+    else:
+        with Pool(processes=workers) as pool:
+            for batch_records in pool.imap(_degrade_task, tasks):
+                records.extend(batch_records)
+
+    with open(os.path.join(output_dir, PARAMS_NAME), 'w') as params_file:
+        json.dump({'hr_dir': os.path.abspath(hr_dir), 'seed': seed, 'recipe': recipe, 'images': records},
+                  params_file, indent=1)
+    print(f"{len(records)} images of '{hr_dir}' degraded into '{output_dir}'")
+    return output_dir
+
+
+class HRSource:
+    """Random access to the high resolution images of a split, from its packed shards
+    if they exist (see shard_storage) or else from the png files of a folder."""
+
+    def __init__(self, root_path: str, key: str = 'hr_256'):
+        if os.path.isfile(os.path.join(shard_dir_for(root_path), INDEX_NAME)):
+            self.images = ShardArray(root_path, key)
+            self.paths = None
+        else:
+            folder = os.path.join(root_path, key) if os.path.isdir(os.path.join(root_path, key)) else root_path
+            self.paths = sorted(glob.glob(os.path.join(folder, '*.png')))
+            if not self.paths:
+                raise FileNotFoundError(f"No shards or png images could be found at '{root_path}'!!")
+
+    def __len__(self) -> int:
+        return len(self.paths) if self.paths is not None else len(self.images)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return _load_rgb(self.paths[index]) if self.paths is not None else self.images[index]
+
+
+def _to_tensor(pixels: np.ndarray) -> 'torch.Tensor':
+    """This function converts an (h, w, c) uint8 array into a (c, h, w) float tensor in [0, 1]."""
+    return torch.from_numpy(np.ascontiguousarray(pixels.transpose(2, 0, 1))).float().div_(255)
+
+
+class _DegradedDataset(Dataset):
+    """Base of the datasets degrading the high resolution images when they are read.
+    Every DataLoader worker (and every epoch) gets its own random generator."""
+
+    def __init__(self, root_path: str, key: str, scale: float, recipe: dict):
+        self.source = HRSource(root_path, key)
+        self.degradation = Degradation(scale=scale, **(recipe or {}))
+        self._rng = None
+        self._rng_seed = None
+
+    def rng(self) -> np.random.Generator:
+        info = get_worker_info() if torch is not None else None
+        seed = info.seed if info is not None else None
+        if self._rng is None or seed != self._rng_seed:
+            self._rng = np.random.default_rng(seed)
+            self._rng_seed = seed
+        return self._rng
+
+    def degraded(self, index: int) -> tuple:
+        """Returns the (h, w, c) uint8 high resolution image and its degraded version."""
+        high = self.source[index]
+        low, _ = self.degradation(high[None], self.rng())
+        return high, low[0]
+
+
+class DegradedPairedFolders(_DegradedDataset):
+    """LIIF dataset of (lr, hr) pairs degraded on the fly, to be wrapped with the
+    'sr-implicit-paired' wrapper."""
+
+    def __init__(self, root_path: str, key: str = 'hr_256', scale: float = DEFAULT_SCALE, repeat: int = 1,
+                 blur=DEFAULT_RECIPE['blur'], blur_prob: float = DEFAULT_RECIPE['blur_prob'],
+                 noise=DEFAULT_RECIPE['noise'], noise_prob: float = DEFAULT_RECIPE['noise_prob'],
+                 jpeg=DEFAULT_RECIPE['jpeg'], jpeg_prob: float = DEFAULT_RECIPE['jpeg_prob'], **kwargs):
+        super().__init__(root_path, key, scale, {'blur': blur, 'blur_prob': blur_prob, 'noise': noise,
+                                                 'noise_prob': noise_prob, 'jpeg': jpeg, 'jpeg_prob': jpeg_prob})
+        self.repeat = repeat
+
+    def __len__(self) -> int:
+        return len(self.source) * self.repeat
+
+    def __getitem__(self, idx: int):
+        high, low = self.degraded(idx % len(self.source))
+        return _to_tensor(low), _to_tensor(high)
+
+
+class DegradedLRHRDataset(_DegradedDataset):
+    """SR3 'LRHRDataset' replacement for datatype 'degraded': the 'sr' image is the
+    degraded low resolution image upsampled back with bicubic interpolation. The
+    recipe is read from RECIPE_NAME in dataroot, the default one is used without it."""
+
+    def __init__(self, dataroot: str, datatype: str = 'degraded', l_resolution: int = 64, r_resolution: int = 256,
+                 split: str = 'train', data_len: int = -1, need_LR: bool = False):
+        recipe_path = os.path.join(dataroot, RECIPE_NAME)
+        recipe = None
+        if os.path.isfile(recipe_path):
+            with open(recipe_path, 'r') as recipe_file:
+                recipe = {key: value for key, value in json.load(recipe_file).items() if key != 'scale'}
+        super().__init__(dataroot, f"hr_{r_resolution}", r_resolution / l_resolution, recipe)
+        self.split = split
+        self.need_LR = need_LR
+        self.data_len = len(self.source) if data_len <= 0 else min(data_len, len(self.source))
+
+    def __len__(self) -> int:
+        return self.data_len
+
+    def __getitem__(self, index: int) -> dict:
+        high, low = self.degraded(index)
+        sr = upsample(low[None], high.shape[0], high.shape[1])[0]
+        images = [_to_tensor(pixels) for pixels in ([low] if self.need_LR else []) + [sr, high]]
+        # Same augmentation and [-1, 1] range as SR3's Util.transform_augment
+        if self.split == 'train' and torch.rand(1).item() < 0.5:
+            images = [torch.flip(img, dims=[2]) for img in images]
+        images = [img * 2 - 1 for img in images]
+        result = {'SR': images[-2], 'HR': images[-1], 'Index': index}
+        if self.need_LR:
+            result['LR'] = images[0]
+        return result
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write degraded low resolution copies of a folder of images.")
+    parser.add_argument('hr_dir', help="folder of the high resolution images")
+    parser.add_argument('--output-dir', default=None)
+    parser.add_argument('--scale', type=float, default=DEFAULT_SCALE)
+    parser.add_argument('--blur', type=float, nargs=2, default=DEFAULT_RECIPE['blur'], metavar=('MIN', 'MAX'),
+                        help="range of the blur sigma")
+    parser.add_argument('--blur-prob', type=float, default=DEFAULT_RECIPE['blur_prob'])
+    parser.add_argument('--noise', type=float, nargs=2, default=DEFAULT_RECIPE['noise'], metavar=('MIN', 'MAX'),
+                        help="range of the noise sigma, in [0, 255] levels")
+    parser.add_argument('--noise-prob', type=float, default=DEFAULT_RECIPE['noise_prob'])
+    parser.add_argument('--jpeg', type=float, nargs=2, default=DEFAULT_RECIPE['jpeg'], metavar=('MIN', 'MAX'),
+                        help="range of the JPEG quality")
+    parser.add_argument('--jpeg-prob', type=float, default=DEFAULT_RECIPE['jpeg_prob'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help="number of processes, defaults to every core")
+    args = parser.parse_args()
+    degrade_folder(args.hr_dir, args.output_dir,
+                   {'scale': args.scale, 'blur': args.blur, 'blur_prob': args.blur_prob, 'noise': args.noise,
+                    'noise_prob': args.noise_prob, 'jpeg': args.jpeg, 'jpeg_prob': args.jpeg_prob},
+                   args.seed, args.batch_size, args.workers)
@@ -0,0 +1,368 @@
+"""
+This module contains the evaluation of the infered images against their ground
+truth. The outputs of the liif infer script ('<name>_infered.png' or
+'<name>_x<scale>_infered.png') are paired with the 'hr_256' image of the same
+name, and the SR3 results ('<id>_sr.png') with the '<id>_hr.png' written next
+to them.
+
+The metrics (PSNR on RGB and on the Y channel, SSIM on the Y channel and MAE)
+are computed for whole batches of images at once with numpy, in float32 (the
+metrics differ from float64 ones by less than 1e-5), and the batches are spread
+over a pool of processes. The report has a row per image, the means per
+UCMerced class (the name of the image without its number) and the aggregate, and
+is written as 'evaluation.csv' and 'evaluation.json'.
+
+    python tools/evaluation.py models/liif/output --hr-dir <dataset>/test_64_256/hr_256
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+from multiprocessing import Pool
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+from models_storage import LIIF_DIR
+from pretrain_loader import SR3_DATA_DIR, split_dir_name
+from tracing import span
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+DEFAULT_OUTPUT_DIR = os.path.join(LIIF_DIR, 'output')
+DEFAULT_HR_DIR = os.path.join(SR3_DATA_DIR, split_dir_name('test'), 'hr_256')
+DEFAULT_BATCH_SIZE = 64
+REPORT_NAME = 'evaluation'
+
+LIIF_OUTPUT_PATTERN = re.compile(r'^(?P<name>.+?)(?:_x(?P<scale>[\d.]+))?_infered$')
+SR3_OUTPUT_SUFFIX = '_sr.png'
+SR3_TARGET_SUFFIX = '_hr.png'
+
+DATA_RANGE = 255.0
+# PSNR given to identical images instead of infinity
+MAX_PSNR = 100.0
+# Gaussian window of the original SSIM (Wang et al. 2004): 11x11, sigma 1.5
+SSIM_WINDOW = 11
+SSIM_SIGMA = 1.5
+SSIM_C1 = (0.01 * DATA_RANGE) ** 2
+SSIM_C2 = (0.03 * DATA_RANGE) ** 2
+# ITU-R BT.601 luma, as used by the super resolution benchmarks
+Y_WEIGHTS = (np.array([65.481, 128.553, 24.966]) / 255.0).astype(np.float32)
+Y_OFFSET = 16.0
+
+METRICS = ('psnr', 'psnr_y', 'ssim', 'mae')
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def _gaussian_window(size: int = SSIM_WINDOW, sigma: float = SSIM_SIGMA) -> np.ndarray:
+    offsets = np.arange(size) - (size - 1) / 2
+    window = np.exp(-offsets ** 2 / (2 * sigma ** 2))
+    return (window / window.sum()).astype(np.float32)
+
+
+GAUSSIAN_WINDOW = _gaussian_window()
+
+
+def _filter(images: np.ndarray) -> np.ndarray:
+    """This function applies the separable gaussian window to a batch of (n, h, w)
+    images, keeping only the positions where the window fits (as the original SSIM)."""
+    rows = sliding_window_view(images, SSIM_WINDOW, axis=1) @ GAUSSIAN_WINDOW
+    return sliding_window_view(rows, SSIM_WINDOW, axis=2) @ GAUSSIAN_WINDOW
+
+
+def luma(images: np.ndarray) -> np.ndarray:
+    """This function returns the Y channel of a batch of (n, h, w, 3) RGB images."""
+    return images @ Y_WEIGHTS + Y_OFFSET
+
+
+def psnr_batch(outputs: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """This function computes the PSNR of every image of a batch.
+
+    Args:
+        outputs (np.ndarray): (n, ...) images in [0, 255]
+        targets (np.ndarray): ground truth with the same shape
+
+    Returns:
+        np.ndarray: (n,) PSNRs in dB, MAX_PSNR for identical images
+    """
+    axes = tuple(range(1, outputs.ndim))
+    mse = ((outputs - targets) ** 2).mean(axis=axes)
+    with np.errstate(divide='ignore'):
+        psnr = 10 * np.log10(DATA_RANGE ** 2 / mse)
+    return np.minimum(psnr, MAX_PSNR)
+
+
+def ssim_batch(outputs: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """This function computes the SSIM of every image of a batch of single channel images.
+
+    Args:
+        outputs (np.ndarray): (n, h, w) images in [0, 255], at least SSIM_WINDOW pixels wide
+        targets (np.ndarray): ground truth with the same shape
+
+    Returns:
+        np.ndarray: (n,) mean SSIM of every image
+    """
+    mu_x = _filter(outputs)
+    mu_y = _filter(targets)
+    mu_xx, mu_yy, mu_xy = mu_x * mu_x, mu_y * mu_y, mu_x * mu_y
+    sigma_xx = _filter(outputs * outputs) - mu_xx
+    sigma_yy = _filter(targets * targets) - mu_yy
+    sigma_xy = _filter(outputs * targets) - mu_xy
+    ssim_map = ((2 * mu_xy + SSIM_C1) * (2 * sigma_xy + SSIM_C2)) / \
+        ((mu_xx + mu_yy + SSIM_C1) * (sigma_xx + sigma_yy + SSIM_C2))
+    return ssim_map.mean(axis=(1, 2))
+
+
+def image_metrics(outputs: np.ndarray, targets: np.ndarray, border: int = 0) -> dict:
+    """This function computes every metric of a batch of images of the same size.
+
+    Args:
+        outputs (np.ndarray): (n, h, w, 3) RGB images in [0, 255]
+        targets (np.ndarray): ground truth with the same shape
+        border (int, optional): pixels removed from every side before measuring. Defaults to 0.
+
+    Returns:
+        dict: {metric: (n,) array} for every metric in METRICS
+    """
+    if border:
+        outputs = outputs[:, border:-border, border:-border]
+        targets = targets[:, border:-border, border:-border]
+    outputs_y, targets_y = luma(outputs), luma(targets)
+    return {'psnr': psnr_batch(outputs, targets),
+            'psnr_y': psnr_batch(outputs_y, targets_y),
+            'ssim': ssim_batch(outputs_y, targets_y),
+            'mae': np.abs(outputs - targets).mean(axis=(1, 2, 3))}
+
+
+def image_class(name: str) -> str:
+    """This function returns the UCMerced class of an image from its name,
+    e.g. 'agricultural' for 'agricultural07'."""
+    return re.sub(r'\d+$', '', name) or 'unknown'
+
+
+def pair_liif_outputs(output_dir: str, hr_dir: str) -> tuple:
+    """This function pairs the outputs of the liif infer script with their ground truth.
+
+    Args:
+        output_dir (str): directory with the '<name>[_x<scale>]_infered.png' images
+        hr_dir (str): directory with the '<name>.png' ground truth images
+
+    Returns:
+        tuple: list of (name, scale, output path, ground truth path) and list of the
+        outputs without ground truth
+    """
+    pairs, missing = [], []
+    for output_path in sorted(glob.glob(os.path.join(output_dir, '*_infered.png'))):
+        match = LIIF_OUTPUT_PATTERN.match(os.path.splitext(os.path.basename(output_path))[0])
+        target_path = os.path.join(hr_dir, f"{match.group('name')}.png")
+        if os.path.isfile(target_path):
+            pairs.append((match.group('name'), match.group('scale'), output_path, target_path))
+        else:
+            missing.append(output_path)
+    return pairs, missing
+
+
+def pair_sr3_results(results_dir: str) -> tuple:
+    """This function pairs the '<id>_sr.png' results of the SR3 infer script with the
+    '<id>_hr.png' ground truth it writes next to them.
+
+    Args:
+        results_dir (str): directory of the SR3 results
+
+    Returns:
+        tuple: list of (name, scale, output path, ground truth path) and list of the
+        outputs without ground truth
+    """
+    pairs, missing = [], []
+    for output_path in sorted(glob.glob(os.path.join(results_dir, f"*{SR3_OUTPUT_SUFFIX}"))):
+        name = os.path.basename(output_path)[:-len(SR3_OUTPUT_SUFFIX)]
+        target_path = os.path.join(results_dir, f"{name}{SR3_TARGET_SUFFIX}")
+        if os.path.isfile(target_path):
+            pairs.append((name, None, output_path, target_path))
+        else:
+            missing.append(output_path)
+    return pairs, missing
+
+
+def _load_rgb(path: str) -> np.ndarray:
+    with Image.open(path) as img:
+        return np.asarray(img.convert('RGB'), dtype=np.float32)
+
+
+def evaluate_batch(pairs: list, border: int = 0) -> tuple:
+    """This function measures a batch of pairs, grouping the images by size so every
+    group is measured at once.
+
+    Args:
+        pairs (list): list of (name, scale, output path, ground truth path)
+        border (int, optional): pixels removed from every side before measuring. Defaults to 0.
+
+    Returns:
+        tuple: list of rows (one dict per image) and list of (output path, error message)
+    """
+    groups, failures = {}, []
+    for pair in pairs:
+        try:
+            output, target = _load_rgb(pair[2]), _load_rgb(pair[3])
+        except (OSError, ValueError) as error:
+            failures.append((pair[2], str(error)))
+            continue
+        if output.shape != target.shape:
+            failures.append((pair[2], f"size {output.shape[:2]} does not match the ground truth {target.shape[:2]}"))
+            continue
+        groups.setdefault(output.shape, []).append((pair, output, target))
+
+    rows = []
+    for shape, group in groups.items():
+        if min(shape[:2]) - 2 * border < SSIM_WINDOW:
+            failures.extend((pair[2], f"size {shape[:2]} is too small") for pair, _, _ in group)
+            continue
+        metrics = image_metrics(np.stack([output for _, output, _ in group]),
+                                np.stack([target for _, _, target in group]), border)
+        for index, ((name, scale, output_path, _), _, _) in enumerate(group):
+            row = {'name': name, 'class': image_class(name), 'scale': scale, 'output': output_path}
+            row.update({metric: float(metrics[metric][index]) for metric in METRICS})
+            rows.append(row)
+    return rows, failures
+
+
+def _evaluate_task(task: tuple) -> tuple:
+    return evaluate_batch(*task)
+
+
+def summarize(rows: list) -> dict:
+    """This function computes the mean (and the PSNR standard deviation) of the metrics
+    of a list of rows."""
+    if not rows:
+        return {'images': 0}
+    summary = {'images': len(rows)}
+    summary.update({metric: float(np.mean([row[metric] for row in rows])) for metric in METRICS})
+    summary['psnr_std'] = float(np.std([row['psnr'] for row in rows]))
+    return summary
+
+
+def write_report(report: dict, report_dir: str) -> tuple:
+    """This function writes the rows of a report as csv and the whole report as json.
+
+    Returns:
+        tuple: paths of the csv and json files
+    """
+    os.makedirs(report_dir, exist_ok=True)
+    csv_path = os.path.join(report_dir, f"{REPORT_NAME}.csv")
+    json_path = os.path.join(report_dir, f"{REPORT_NAME}.json")
+    with open(csv_path, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=['name', 'class', 'scale', *METRICS, 'output'])
+        writer.writeheader()
+        writer.writerows(report['images'])
+    with open(json_path, 'w') as json_file:
+        json.dump(report, json_file, indent=1)
+    return csv_path, json_path
+
+
+def print_report(report: dict) -> None:
+    """This function prints the per class and aggregate metrics of a report."""
+    print(f"{'class':24}{'images':>7}{'psnr':>9}{'psnr y':>9}{'ssim':>8}{'mae':>8}")
+    for name, summary in list(report['classes'].items()) + [('all', report['aggregate'])]:
+        if summary['images']:
+            print(f"{name[:23]:24}{summary['images']:7d}{summary['psnr']:9.3f}{summary['psnr_y']:9.3f}"
+                  f"{summary['ssim']:8.4f}{summary['mae']:8.3f}")
+
+
+def evaluate_folder(output_dir: str = DEFAULT_OUTPUT_DIR, hr_dir: str = DEFAULT_HR_DIR, sr3: bool = False,
+                    workers: int = None, batch_size: int = DEFAULT_BATCH_SIZE, border: int = 0,
+                    report_dir: str = None) -> dict:
+    """This function evaluates every output of a folder against its ground truth and
+    writes the report.
+
+    Args:
+        output_dir (str, optional): folder of the infered images. Defaults to DEFAULT_OUTPUT_DIR.
+        hr_dir (str, optional): folder of the ground truth of the liif outputs. Defaults to DEFAULT_HR_DIR.
+        sr3 (bool, optional): output_dir holds SR3 results with their own ground truth. Defaults to False.
+        workers (int, optional): number of processes. None uses every core. Defaults to None.
+        batch_size (int, optional): images measured together by a process. Defaults to DEFAULT_BATCH_SIZE.
+        border (int, optional): pixels removed from every side before measuring. Defaults to 0.
+        report_dir (str, optional): folder of the report files. Defaults to output_dir.
+
+    Raises:
+        FileNotFoundError: raised if a folder does not exist
+
+    Returns:
+        dict: {'images': rows, 'classes': {class: summary}, 'aggregate': summary,
+        'missing': outputs without ground truth, 'failed': [(output, error)]}
+    """
+    for folder in [output_dir] + ([] if sr3 else [hr_dir]):
+        if not os.path.isdir(folder):
+            raise FileNotFoundError(f"The directory '{folder}' could not be found!!")
+    pairs, missing = pair_sr3_results(output_dir) if sr3 else pair_liif_outputs(output_dir, hr_dir)
+    tasks = [(pairs[start:start + batch_size], border) for start in range(0, len(pairs), batch_size)]
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+
+    rows, failures = [], []
+    with span('evaluate', files=len(pairs), workers=workers) as current:
+        if workers == 1:
+            results = map(_evaluate_task, tasks)
+        else:
+            pool = Pool(processes=workers)
+            results = pool.imap(_evaluate_task, tasks)
+        try:
+            for batch_rows, batch_failures in results:
+                rows.extend(batch_rows)
+                failures.extend(batch_failures)
+        finally:
+            if workers != 1:
+                pool.close()
+                pool.join()
+        current.add(failed=len(failures))
+
+    classes = {}
+    for row in rows:
+        classes.setdefault(row['class'], []).append(row)
+    report = {'output_dir': os.path.abspath(output_dir), 'hr_dir': None if sr3 else os.path.abspath(hr_dir),
+              'border': border, 'images': rows,
+              'classes': {name: summarize(class_rows) for name, class_rows in sorted(classes.items())},
+              'aggregate': summarize(rows), 'missing': missing, 'failed': failures}
+
+    csv_path, json_path = write_report(report, report_dir or output_dir)
+    print_report(report)
+    for path, error in failures:
+        print(f"Failed '{path}': {error}")
+    if missing:
+        print(f"{len(missing)} outputs have no ground truth and were not evaluated")
+    print(f"Report written to '{csv_path}' and '{json_path}'")
+    return report
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate the infered images against their ground truth.")
+    parser.add_argument('output_dir', nargs='?', default=DEFAULT_OUTPUT_DIR, help="folder of the infered images")
+    parser.add_argument('--hr-dir', default=DEFAULT_HR_DIR, help="folder of the ground truth images")
+    parser.add_argument('--sr3', action='store_true', help="the folder holds SR3 '_sr.png'/'_hr.png' results")
+    parser.add_argument('--workers', type=int, default=None, help="number of processes, defaults to every core")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--border', type=int, default=0, help="pixels removed from every side before measuring")
+    parser.add_argument('--report-dir', default=None, help="folder of the report, defaults to the output folder")
+    args = parser.parse_args()
+    evaluate_folder(args.output_dir, args.hr_dir, args.sr3, args.workers, args.batch_size, args.border,
+                    args.report_dir)
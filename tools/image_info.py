@@ -5,42 +5,164 @@ from the images within our datasets.
 :author: Ruben Moya Vazquez <rmoyav@uoc.edu>
 :date: 29/04/2023
 """
+import json
 import os
 import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from PIL import Image
 from PIL.ExifTags import TAGS
 
+from dataset_storage import DATA_DIR, DATASET1_NAME
+from tracing import span, traced
 
-def imagen_resolution(image_path: str) -> tuple:
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+# Persistent index with the header information of every image
+INDEX_PATH = os.path.join(DATA_DIR, DATASET1_NAME + '_index.sqlite')
+DEFAULT_INDEX_WORKERS = 16
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    mode TEXT,
+    ok INTEGER NOT NULL,
+    exif TEXT
+)
+"""
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+@contextmanager
+def open_image_index(index_path: str = INDEX_PATH):
+    """This function opens (creating it if needed) the image index. The changes are
+    committed and the connection closed when the with block ends.
+
+    Args:
+        index_path (str, optional): path to the SQLite index. Defaults to INDEX_PATH.
+
+    Yields:
+        sqlite3.Connection: connection to the index
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    connection = sqlite3.connect(index_path)
+    try:
+        with connection:
+            connection.execute(INDEX_SCHEMA)
+            yield connection
+    finally:
+        connection.close()
+
+
+def _lookup(image_path: str, index_path: str) -> tuple:
+    """This function returns the indexed row of an image if the index exists
+    and the file did not change since it was indexed.
+
+    Args:
+        image_path (str): image full path
+        index_path (str): path to the SQLite index
+
+    Returns:
+        tuple: (width, height, mode, ok, exif) or None if it is not indexed
+    """
+    if not index_path or not os.path.isfile(index_path):
+        return None
+    stat = os.stat(image_path)
+    with open_image_index(index_path) as connection:
+        row = connection.execute(
+            "SELECT width, height, mode, ok, exif FROM images WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns)).fetchone()
+    return row
+
+
+def _read_exif(img: Image.Image) -> dict:
+    """This function returns the EXIF tags of an opened image by name.
+
+    Args:
+        img (Image.Image): opened image
+
+    Returns:
+        dict: {tag name: value}
+    """
+    metadata = {}
+    exif_data = img.getexif()
+    for tag_id in exif_data:
+        tag = TAGS.get(tag_id, tag_id)
+        data = exif_data.get(tag_id)
+        if isinstance(data, bytes):
+            data = data.decode(errors='replace')
+        metadata[str(tag)] = data if isinstance(data, (int, float, str)) else str(data)
+    return metadata
+
+
+def _read_header(image_path: str) -> tuple:
+    """This function reads the size, mode and EXIF tags of an image. Only the
+    header is parsed, the pixels are not decoded.
+
+    Args:
+        image_path (str): image full path
+
+    Returns:
+        tuple: (width, height, mode, ok, exif as json). ok is 0 if the file could not be opened
+    """
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            return width, height, img.mode, 1, json.dumps(_read_exif(img))
+    except (IOError, OSError, SyntaxError, ValueError):
+        return None, None, None, 0, None
+
+
+def imagen_resolution(image_path: str, index_path: str = None) -> tuple:
     """This function will obtain the resolution of a
     given image in pixels. (w,h)
 
     Args:
         image_path (str): image full path
+        index_path (str, optional): image index to answer from if the image is indexed. Defaults to None.
 
     Returns:
         tuple: tuple with the width and height of the image
     """
-    img = Image.open(image_path)
-    return img.size
+    row = _lookup(image_path, index_path)
+    if row and row[3]:
+        return row[0], row[1]
+    with Image.open(image_path) as img:
+        return img.size
 
 
-def print_image_metadata(image_path: str) -> None:
+def print_image_metadata(image_path: str, index_path: str = None) -> None:
     """This function will print all the metadata
     found within the image used as parameter.
 
     Args:
         image_path (str): the absolute path to the image
+        index_path (str, optional): image index to answer from if the image is indexed. Defaults to None.
     """
-    with Image.open(image_path) as img:
-        exif_data = img.getexif()
-        for tag_id in exif_data:
-            tag = TAGS.get(tag_id, tag_id)
-            data = exif_data.get(tag_id)
-            if isinstance(data, bytes):
-                data = data.decode()
-            print(f"{tag:25}: {data}")
+    row = _lookup(image_path, index_path)
+    if row and row[3]:
+        metadata = json.loads(row[4] or '{}')
+    else:
+        with Image.open(image_path) as img:
+            metadata = _read_exif(img)
+    for tag, data in metadata.items():
+        print(f"{tag:25}: {data}")
 
 
 def delete_folder(path:str) -> None:
@@ -55,31 +177,99 @@ def delete_folder(path:str) -> None:
     else:
         print(f"Given dir '{path}' does not exist!!")
 
-def drop_wrong_images(root_dir: str, std_width: int = 256, std_height: int = 256) -> None:
+
+@traced()
+def index_images(root_dir: str, index_path: str = INDEX_PATH, extension: str = '.tif',
+                 workers: int = DEFAULT_INDEX_WORKERS) -> dict:
+    """This function will store in the index the header information of every image
+    found under the given directory. The images whose size and modification time did
+    not change since they were indexed are skipped, and the ones that do not exist
+    anymore are dropped from the index.
+
+    Args:
+        root_dir (str): path where the images will be searched
+        index_path (str, optional): path to the SQLite index. Defaults to INDEX_PATH.
+        extension (str, optional): extension of the images. Defaults to '.tif'.
+        workers (int, optional): number of threads reading headers. Defaults to DEFAULT_INDEX_WORKERS.
+
+    Returns:
+        dict: counts ('total', 'read', 'skipped', 'dropped') and 'timings' in seconds per step
+    """
+    timings = {}
+    start = time.perf_counter()
+    files = {}
+    for current_path, _, found in os.walk(os.path.abspath(root_dir)):
+        for tmpfile in found:
+            if tmpfile.endswith(extension):
+                full_path = os.path.join(current_path, tmpfile)
+                stat = os.stat(full_path)
+                files[full_path] = (stat.st_size, stat.st_mtime_ns)
+    timings['walk'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prefix = os.path.join(os.path.abspath(root_dir), '')
+    with open_image_index(index_path) as connection:
+        indexed = {path: (size, mtime_ns) for path, size, mtime_ns in connection.execute(
+            "SELECT path, size, mtime_ns FROM images WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))}
+    pending = [path for path, stat in files.items() if indexed.get(path) != stat]
+    dropped = [path for path in indexed if path not in files]
+    timings['lookup'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with span('read_headers', files=len(pending)), ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        headers = list(executor.map(_read_header, pending))
+    timings['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open_image_index(index_path) as connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO images (path, size, mtime_ns, width, height, mode, ok, exif) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(path, *files[path], *header) for path, header in zip(pending, headers)])
+        connection.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in dropped])
+    timings['write'] = time.perf_counter() - start
+
+    return {'total': len(files), 'read': len(pending), 'skipped': len(files) - len(pending),
+            'dropped': len(dropped), 'timings': timings}
+
+
+@traced()
+def drop_wrong_images(root_dir: str, std_width: int = 256, std_height: int = 256,
+                      index_path: str = INDEX_PATH, workers: int = DEFAULT_INDEX_WORKERS) -> dict:
     """This function will remove evey image that does not fit
-    the given standard widht and standard height parameters.
+    the given standard widht and standard height parameters,
+    as well as the images that can not be opened.
 
     Args:
         root_dir (str): path where the images will be searched
         std_width (int, optional): standard width. Defaults to 256.
         std_height (int, optional): standard height. Defaults to 256.
+        index_path (str, optional): path to the SQLite index. Defaults to INDEX_PATH.
+        workers (int, optional): number of threads reading headers. Defaults to DEFAULT_INDEX_WORKERS.
+
+    Returns:
+        dict: the index_images counts plus the 'wrong_size' and 'broken' images removed
     """
     print('Cleaning the dataset of wrong images...')
-    error_path = os.path.join(os.path.dirname(os.path.abspath(root_dir)), 'failed')
-    os.makedirs(error_path, exist_ok=True)
+    summary = index_images(root_dir, index_path, workers=workers)
 
-    for current_path, _, files in os.walk(root_dir):
-        for tmpfile in files:
-            if tmpfile.endswith('.tif'):
-                full_path = os.path.join(current_path, tmpfile)
-                try:
-                    with Image.open(full_path) as image:
-                        width, height = image.size
-                        if width != std_width or height != std_height:
-                            os.remove(full_path)
-                            print(f"Removing: {os.path.basename(full_path)} with dimensions {width}x{height}")
-                except (IOError, OSError):
-                    shutil.move(full_path, os.path.join(error_path, tmpfile))
-                    print(
-                        f"File '{os.path.basename(full_path)}' has some errors and will be stored in {error_path}")
-    delete_folder(error_path)
+    start = time.perf_counter()
+    prefix = os.path.join(os.path.abspath(root_dir), '')
+    with open_image_index(index_path) as connection:
+        wrong = connection.execute(
+            "SELECT path, ok FROM images WHERE substr(path, 1, ?) = ? "
+            "AND (ok = 0 OR width != ? OR height != ?)",
+            (len(prefix), prefix, std_width, std_height)).fetchall()
+        for path, _ in wrong:
+            if os.path.exists(path):
+                os.remove(path)
+        connection.executemany("DELETE FROM images WHERE path = ?", [(path,) for path, _ in wrong])
+    summary['timings']['remove'] = time.perf_counter() - start
+
+    summary['broken'] = sum(1 for _, ok in wrong if not ok)
+    summary['wrong_size'] = len(wrong) - summary['broken']
+    timings = ', '.join(f"{step} {seconds:.2f}s" for step, seconds in summary['timings'].items())
+    print(f"{summary['total']} images checked ({summary['read']} read, {summary['skipped']} unchanged): "
+          f"{summary['wrong_size']} with wrong dimensions and {summary['broken']} with errors removed")
+    print(f"Timings: {timings}")
+    return summary
@@ -7,13 +7,34 @@ different models.
 :date: 23/04/2023
 """
 
+import argparse
 import glob
 import os
+import time
 from itertools import repeat
 from multiprocessing import Pool
 
 from dataset_storage import create_resample_dir
 from PIL import Image, ImageFilter
+from tracing import span
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+# Number of images handed to each worker in a single message
+DEFAULT_CHUNKSIZE = 16
+
+# Number of processed images between two progress messages
+PROGRESS_STEP = 500
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
 
 
 def resample_image(in_image: str, output_dir: str, scale: float, blur: bool = False, radius: float = 3) -> None:
@@ -35,7 +56,24 @@ def resample_image(in_image: str, output_dir: str, scale: float, blur: bool = Fa
             f"The given file '{in_image}' could not be found!!")
 
     img = Image.open(in_image).convert('RGB')
+    resampled_img = _resample(img, scale, blur, radius)
+
+    img_name = os.path.basename(in_image)
+    resampled_img.save(os.path.join(output_dir, img_name))
+
+
+def _resample(img: Image.Image, scale: float, blur: bool = False, radius: float = 3) -> Image.Image:
+    """This function will resample an already decoded image by the given scale.
+
+    Args:
+        img (Image.Image): decoded RGB image
+        scale (float): factor of the resampling
+        blur (bool, optional): condition to add blur to the resampled image. Defaults to False.
+        radius (float, optional): radius of the blur if added. Defaults to 3.
 
+    Returns:
+        Image.Image: the resampled image
+    """
     # Resolving new resolution values
     width, height = img.size
     img_width = int(width // scale)
@@ -48,13 +86,199 @@ def resample_image(in_image: str, output_dir: str, scale: float, blur: bool = Fa
     if blur:
         resampled_img = resampled_img.filter(ImageFilter.GaussianBlur(radius))
 
+    return resampled_img
+
+
+def resample_pyramid(in_image: str, output_dirs: dict, radiuses: dict = None) -> None:
+    """This function will decode the given image once and store a resampled
+    copy of it for every requested scale.
+
+    Args:
+        in_image (str): path to the original imagen to be resampled
+        output_dirs (dict): output directory for every scale, as {scale: directory}
+        radiuses (dict, optional): blur radius for the scales that must be blurred,
+        as {scale: radius}. Scales not found will not be blurred. Defaults to None.
+
+    Raises:
+        FileNotFoundError: raised when the given image path is not a file
+    """
+    if not os.path.isfile(in_image):
+        raise FileNotFoundError(
+            f"The given file '{in_image}' could not be found!!")
+
+    radiuses = radiuses or {}
     img_name = os.path.basename(in_image)
-    resampled_img.save(os.path.join(output_dir, img_name))
+    with Image.open(in_image) as source:
+        img = source.convert('RGB')
+
+    for scale, output_dir in output_dirs.items():
+        radius = radiuses.get(scale)
+        resampled_img = _resample(img, scale, blur=radius is not None, radius=radius)
+        resampled_img.save(os.path.join(output_dir, img_name))
+
+
+def _resize_and_convert(img: Image.Image, size: int) -> Image.Image:
+    """This function resizes the shortest side of the image to the given size and
+    center crops it into a square, as the SR3 'prepare_data.py' script does.
+
+    Args:
+        img (Image.Image): decoded RGB image
+        size (int): side of the output square image
+
+    Returns:
+        Image.Image: the resized image
+    """
+    width, height = img.size
+    if width != size:
+        if width <= height:
+            img = img.resize((size, int(size * height / width)), resample=Image.BICUBIC)
+        else:
+            img = img.resize((int(size * width / height), size), resample=Image.BICUBIC)
+    width, height = img.size
+    left = int(round((width - size) / 2.))
+    top = int(round((height - size) / 2.))
+    return img.crop((left, top, left + size, top + size))
+
+
+def triplet_paths(in_image: str, output_dir: str, sizes: tuple = (64, 256)) -> tuple:
+    """This function returns the paths where prepare_triplet stores the low
+    resolution, high resolution and bicubic upsampled versions of an image.
+
+    Args:
+        in_image (str): path to the original image
+        output_dir (str): split output directory, e.g. 'dataset/train_64_256'
+        sizes (tuple, optional): low and high resolution sizes. Defaults to (64, 256).
+
+    Returns:
+        tuple: the lr, hr and sr paths
+    """
+    name = os.path.basename(in_image).split('.')[0].zfill(5)
+    return (os.path.join(output_dir, f"lr_{sizes[0]}", f"{name}.png"),
+            os.path.join(output_dir, f"hr_{sizes[1]}", f"{name}.png"),
+            os.path.join(output_dir, f"sr_{sizes[0]}_{sizes[1]}", f"{name}.png"))
+
+
+def prepare_triplet(in_image: str, output_dir: str, sizes: tuple = (64, 256)) -> tuple:
+    """This function builds the low resolution, high resolution and bicubic
+    upsampled (sr) images the SR3 'prepare_data.py' script generates for a single
+    image, using the same folder layout and file names.
+
+    Args:
+        in_image (str): path to the original image
+        output_dir (str): split output directory, e.g. 'dataset/train_64_256'
+        sizes (tuple, optional): low and high resolution sizes. Defaults to (64, 256).
+
+    Raises:
+        FileNotFoundError: raised when the given image path is not a file
+
+    Returns:
+        tuple: the lr, hr and sr paths
+    """
+    if not os.path.isfile(in_image):
+        raise FileNotFoundError(
+            f"The given file '{in_image}' could not be found!!")
+
+    with Image.open(in_image) as source:
+        img = source.convert('RGB')
+
+    return write_triplet(img, in_image, output_dir, sizes)
+
+
+def write_triplet(img: Image.Image, in_image: str, output_dir: str, sizes: tuple = (64, 256)) -> tuple:
+    """This function writes the triplet of prepare_triplet from an already decoded
+    image, e.g. one read from an archive.
+
+    Args:
+        img (Image.Image): decoded RGB image
+        in_image (str): name or path of the original image, used to name the outputs
+        output_dir (str): split output directory, e.g. 'dataset/train_64_256'
+        sizes (tuple, optional): low and high resolution sizes. Defaults to (64, 256).
+
+    Returns:
+        tuple: the lr, hr and sr paths
+    """
+    lr_img = _resize_and_convert(img, sizes[0])
+    hr_img = _resize_and_convert(img, sizes[1])
+    sr_img = _resize_and_convert(lr_img, sizes[1])
+
+    paths = triplet_paths(in_image, output_dir, sizes)
+    for path, result in zip(paths, (lr_img, hr_img, sr_img)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        result.save(path)
+    return paths
+
+
+def _call_task(task: tuple) -> tuple:
+    """This function runs a single task inside a pool worker catching its
+    errors so one broken file does not abort the whole run.
+
+    Args:
+        task (tuple): the function to call followed by its arguments
+
+    Returns:
+        tuple: the first argument of the task (usually the file path) and the
+        error message, which will be None if the task succeeded
+    """
+    function, *args = task
+    try:
+        function(*args)
+        return args[0], None
+    except Exception as error:  # pylint: disable=broad-except
+        return args[0], f"{type(error).__name__}: {error}"
+
+
+def run_in_pool(function, tasks: list, workers: int = 1, chunksize: int = DEFAULT_CHUNKSIZE,
+                description: str = 'Processing') -> list:
+    """This function will call the given function once per task, either in the
+    current process (workers=1) or in a pool of processes. The results are
+    reported in the same order the tasks were given and the failing tasks are
+    collected instead of stopping the whole run.
+
+    Args:
+        function (callable): module level function to call for every task
+        tasks (list): list of tuples with the arguments of every call
+        workers (int, optional): number of processes to use. None uses every core. Defaults to 1.
+        chunksize (int, optional): number of tasks sent to a worker at once. Defaults to DEFAULT_CHUNKSIZE.
+        description (str, optional): text used in the progress messages. Defaults to 'Processing'.
+
+    Returns:
+        list: list of tuples (task first argument, error message) for the failed tasks
+    """
+    workers = workers or os.cpu_count() or 1
+    total = len(tasks)
+    failures = []
+    calls = [(function,) + tuple(task) for task in tasks]
+
+    if workers == 1:
+        results = map(_call_task, calls)
+        pool = None
+    else:
+        pool = Pool(processes=min(workers, max(total, 1)))
+        results = pool.imap(_call_task, calls, chunksize=max(chunksize, 1))
 
+    with span(description, category='pool', files=total, workers=min(workers, max(total, 1))) as current:
+        try:
+            for done, (path, error) in enumerate(results, start=1):
+                if error is not None:
+                    failures.append((path, error))
+                if done % PROGRESS_STEP == 0 or done == total:
+                    print(f"{description}: {done}/{total} done, {len(failures)} failed")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        current.add(failed=len(failures))
 
-def process_images_in_folder(hr_dir: str, scale: float, blur: bool = False, radius: float = 3) -> None:
+    for path, error in failures:
+        print(f"Failed '{path}': {error}")
+
+    return failures
+
+
+def process_images_in_folder(hr_dir: str, scale: float, blur: bool = False, radius: float = 3,
+                             workers: int = 1, chunksize: int = DEFAULT_CHUNKSIZE) -> list:
     """This function will resample all the images found in a given directory,
-    containing the original high resolution imagenes, into an output directory, 
+    containing the original high resolution imagenes, into an output directory,
     containing the low resolution generated images.
 
     Args:
@@ -62,10 +286,110 @@ def process_images_in_folder(hr_dir: str, scale: float, blur: bool = False, radi
         scale (float): Scale to resample the images
         blur (bool, optional): Condition to add blur to the output images. Defaults to False.
         radius (float, optional): Blur radius. Defaults to 3.
+        workers (int, optional): Number of processes to use. None uses every core. Defaults to 1.
+        chunksize (int, optional): Number of images sent to a worker at once. Defaults to DEFAULT_CHUNKSIZE.
+
+    Returns:
+        list: list of tuples (image path, error message) for the images that could not be resampled
     """
     output_dir = create_resample_dir(hr_dir, scale)
     # Lista de paths completos de cada imagen en la carpeta
     image_paths = sorted(glob.glob(os.path.join(hr_dir, '*.tif'), recursive=False))
-                         
-    for path in image_paths:
-        resample_image(os.path.join(hr_dir, path), output_dir, scale, blur, radius)
+    tasks = list(zip(image_paths, repeat(output_dir), repeat(scale), repeat(blur), repeat(radius)))
+
+    return run_in_pool(resample_image, tasks, workers=workers, chunksize=chunksize,
+                       description=f"Resampling x{scale}")
+
+
+def process_pyramid_in_folder(hr_dir: str, scales: list, radiuses: dict = None, workers: int = 1,
+                              chunksize: int = DEFAULT_CHUNKSIZE) -> list:
+    """This function will generate every requested low resolution version of the
+    images found in the given directory in a single pass, decoding each high
+    resolution image only once. Every scale gets its own 'lr_<res>' directory,
+    the same one process_images_in_folder would have created.
+
+    Args:
+        hr_dir (str): High resolution dir containing the input images
+        scales (list): Scales to resample the images, e.g. [2, 4, 8]
+        radiuses (dict, optional): Blur radius for the scales that must be blurred,
+        as {scale: radius}. Defaults to None (no blur).
+        workers (int, optional): Number of processes to use. None uses every core. Defaults to 1.
+        chunksize (int, optional): Number of images sent to a worker at once. Defaults to DEFAULT_CHUNKSIZE.
+
+    Returns:
+        list: list of tuples (image path, error message) for the images that could not be resampled
+    """
+    output_dirs = {scale: create_resample_dir(hr_dir, scale) for scale in scales}
+    image_paths = sorted(glob.glob(os.path.join(hr_dir, '*.tif'), recursive=False))
+    tasks = list(zip(image_paths, repeat(output_dirs), repeat(radiuses)))
+
+    return run_in_pool(resample_pyramid, tasks, workers=workers, chunksize=chunksize,
+                       description=f"Resampling x{', x'.join(str(scale) for scale in scales)}")
+
+
+def benchmark_process_images(hr_dir: str, scale: float, max_workers: int = None,
+                             chunksize: int = DEFAULT_CHUNKSIZE) -> list:
+    """This function will resample the given directory once per worker count
+    (1, 2, 4, ... up to max_workers) and print the throughput obtained in each
+    run, so the scaling across cores can be checked.
+
+    Args:
+        hr_dir (str): High resolution dir containing the input images
+        scale (float): Scale to resample the images
+        max_workers (int, optional): Highest number of processes to try. Defaults to every core.
+        chunksize (int, optional): Number of images sent to a worker at once. Defaults to DEFAULT_CHUNKSIZE.
+
+    Returns:
+        list: list of dicts with the workers, seconds and images per second of every run
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    image_num = len(glob.glob(os.path.join(hr_dir, '*.tif'), recursive=False))
+    worker_counts = []
+    workers = 1
+    while workers < max_workers:
+        worker_counts.append(workers)
+        workers *= 2
+    worker_counts.append(max_workers)
+
+    results = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        process_images_in_folder(hr_dir, scale, workers=workers, chunksize=chunksize)
+        elapsed = time.perf_counter() - start
+        results.append({'workers': workers, 'seconds': elapsed,
+                        'images_per_second': image_num / elapsed if elapsed else 0.0})
+
+    base = results[0]['images_per_second'] or 1.0
+    print(f"{'workers':>8} {'seconds':>10} {'img/s':>10} {'speedup':>8}")
+    for result in results:
+        print(f"{result['workers']:>8} {result['seconds']:>10.2f} {result['images_per_second']:>10.1f} "
+              f"{result['images_per_second'] / base:>7.2f}x")
+    return results
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resample a folder of high resolution images.")
+    parser.add_argument('hr_dir')
+    parser.add_argument('--scale', type=int, default=4)
+    parser.add_argument('--scales', type=int, nargs='+',
+                        help="generate several scales in a single pass, e.g. --scales 2 4 8")
+    parser.add_argument('--blur', type=float, nargs='+', default=[],
+                        help="blur radius for every scale given in --scales (0 = no blur)")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--benchmark', action='store_true',
+                        help="measure the throughput from 1 to --workers processes")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark_process_images(args.hr_dir, args.scale, args.workers, args.chunksize)
+    elif args.scales:
+        blur_radiuses = {scale: radius for scale, radius in zip(args.scales, args.blur) if radius > 0}
+        process_pyramid_in_folder(args.hr_dir, args.scales, blur_radiuses, workers=args.workers,
+                                  chunksize=args.chunksize)
+    else:
+        process_images_in_folder(args.hr_dir, args.scale, workers=args.workers, chunksize=args.chunksize)
@@ -0,0 +1,375 @@
+"""
+This module contains a scheduler of the train, validation and test jobs of the
+models. The jobs are kept in a persistent queue under 'data/jobs', so they can
+be submitted from several places and the queue survives the scheduler: when it
+starts again, the jobs left running by a dead scheduler are queued again, once
+their own process is dead too.
+
+Every job is a subprocess started in its model repository (no os.chdir), with
+its output in its own log file. Up to 'max_jobs' run at the same time, each one
+pinned to its own slice of the CPUs and with its thread pools (OpenMP, MKL...)
+sized to that slice, so a set of validations of many checkpoints fills the
+machine without the jobs fighting for the cores.
+
+    python tools/job_scheduler.py val-liif --config train_UCMerced_LandUse-64-256.yaml --models save/a/epoch-10.pth save/a/epoch-20.pth
+    python tools/job_scheduler.py run --max-jobs 4
+    python tools/job_scheduler.py status
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import time
+
+from filelock import FileLock
+
+from checkpoint_catalog import resolve_checkpoint
+from dataset_storage import DATA_DIR
+from models_storage import LIIF_DIR, SR3_DIR
+from tracing import traced
+from trainvaltest_functions import liif_test_command, liif_train_command, liif_val_command, sr3_command
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+JOBS_DIR = os.path.join(DATA_DIR, 'jobs')
+QUEUE_PATH = os.path.join(JOBS_DIR, 'queue.json')
+LOGS_DIR = os.path.join(JOBS_DIR, 'logs')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+# Running job whose scheduler died while its process kept running
+ORPHANED = 'orphaned'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED_STATUSES = (DONE, FAILED)
+
+# Thread pools sized to the CPUs of every job
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+# Threads given to every job when max_jobs is not set
+DEFAULT_THREADS_PER_JOB = 4
+POLL_SECONDS = 1.0
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def _pid_alive(pid: int) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Jobs stored in a json file, every change is made holding a file lock so
+    several processes can use the same queue."""
+
+    def __init__(self, path: str = QUEUE_PATH):
+        self.path = path
+        self.lock = FileLock(path + '.lock')
+
+    def _read(self) -> dict:
+        if not os.path.isfile(self.path):
+            return {'next_id': 1, 'jobs': []}
+        with open(self.path, 'r') as queue_file:
+            return json.load(queue_file)
+
+    def _write(self, queue: dict) -> None:
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as queue_file:
+            json.dump(queue, queue_file, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def jobs(self) -> list:
+        """Returns the jobs of the queue, in submission order."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            return self._read()['jobs']
+
+    def submit(self, name: str, cmd: list, cwd: str) -> int:
+        """Adds a job to the queue and returns its id."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            queue = self._read()
+            job_id = queue['next_id']
+            queue['next_id'] += 1
+            queue['jobs'].append({'id': job_id, 'name': name, 'cmd': cmd, 'cwd': cwd, 'status': QUEUED,
+                                  'log': os.path.join(LOGS_DIR, f"{job_id:05d}_{name}.log"),
+                                  'submitted': time.time(), 'started': None, 'finished': None,
+                                  'returncode': None, 'pid': None, 'owner': None, 'cpus': None, 'error': None})
+            self._write(queue)
+        return job_id
+
+    def update(self, job_id: int, **fields) -> None:
+        with self.lock:
+            queue = self._read()
+            for job in queue['jobs']:
+                if job['id'] == job_id:
+                    job.update(fields)
+            self._write(queue)
+
+    def claim(self) -> dict:
+        """Marks the oldest queued job as running by this process and returns it,
+        None if there are no queued jobs."""
+        with self.lock:
+            queue = self._read()
+            for job in queue['jobs']:
+                if job['status'] == QUEUED:
+                    job.update(status=RUNNING, owner=os.getpid(), started=time.time())
+                    self._write(queue)
+                    return job
+        return None
+
+    def requeue_orphans(self) -> int:
+        """Queues again the running jobs whose scheduler and process are dead and returns
+        how many. The jobs whose process outlived the scheduler are marked as orphaned and
+        left alone, so they do not run twice, until their process ends too."""
+        requeued = 0
+        with self.lock:
+            queue = self._read()
+            changed = False
+            for job in queue['jobs']:
+                if job['status'] not in (RUNNING, ORPHANED) or _pid_alive(job['owner']):
+                    continue
+                if _pid_alive(job['pid']):
+                    changed |= job['status'] != ORPHANED
+                    job.update(status=ORPHANED, owner=None)
+                else:
+                    job.update(status=QUEUED, owner=None, pid=None, started=None)
+                    requeued += 1
+                    changed = True
+            if changed:
+                self._write(queue)
+        return requeued
+
+    def clear(self) -> int:
+        """Removes the finished jobs from the queue and returns how many."""
+        with self.lock:
+            queue = self._read()
+            remaining = [job for job in queue['jobs'] if job['status'] not in FINISHED_STATUSES]
+            removed = len(queue['jobs']) - len(remaining)
+            queue['jobs'] = remaining
+            self._write(queue)
+        return removed
+
+
+def cpu_slots(max_jobs: int) -> list:
+    """This function splits the CPUs this process can use in max_jobs disjoint slices.
+
+    Args:
+        max_jobs (int): number of slices
+
+    Returns:
+        list: list of lists of cpu ids
+    """
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    size = max(len(cpus) // max_jobs, 1)
+    return [cpus[(slot * size) % len(cpus):][:size] for slot in range(max_jobs)]
+
+
+def _pin_to(cpus: list) -> None:
+    """This function pins the calling process to some CPUs. It runs in the child of
+    a job before the command is executed, so the threads the command starts are
+    pinned from the start."""
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError:
+        pass
+
+
+def _launch(job: dict, cpus: list, pin: bool) -> subprocess.Popen:
+    """This function starts the process of a job with its output in its log file."""
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    env = dict(os.environ)
+    env.update({var: str(len(cpus)) for var in THREAD_ENV_VARS})
+    pin = pin and hasattr(os, 'sched_setaffinity')
+    with open(job['log'], 'a') as log_file:
+        log_file.write(f"$ cd {job['cwd']} && {' '.join(job['cmd'])}\n")
+        log_file.flush()
+        return subprocess.Popen(job['cmd'], cwd=job['cwd'], env=env, stdout=log_file,
+                                stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                preexec_fn=(lambda: _pin_to(cpus)) if pin else None)
+
+
+@traced(category='subprocess')
+def run_queue(max_jobs: int = None, pin: bool = True, queue: JobQueue = None) -> dict:
+    """This function runs the queued jobs until the queue is empty, max_jobs at the
+    same time. If it is interrupted the running jobs are stopped and queued again.
+
+    Args:
+        max_jobs (int, optional): jobs running at the same time. Defaults to the CPUs
+        divided by DEFAULT_THREADS_PER_JOB.
+        pin (bool, optional): pin every job to its own slice of the CPUs. Defaults to True.
+        queue (JobQueue, optional): queue to run. Defaults to the one in QUEUE_PATH.
+
+    Returns:
+        dict: number of jobs 'done' and 'failed'
+    """
+    queue = queue or JobQueue()
+    max_jobs = max_jobs or max((os.cpu_count() or 1) // DEFAULT_THREADS_PER_JOB, 1)
+    requeued = queue.requeue_orphans()
+    if requeued:
+        print(f"{requeued} jobs of a stopped scheduler were queued again")
+
+    free_slots = cpu_slots(max_jobs)
+    running = {}
+    counts = {DONE: 0, FAILED: 0}
+    try:
+        while True:
+            while free_slots:
+                job = queue.claim()
+                if job is None:
+                    break
+                cpus = free_slots.pop(0)
+                try:
+                    process = _launch(job, cpus, pin)
+                except (OSError, ValueError, subprocess.SubprocessError) as error:
+                    # A job that can not be started fails on its own, its slot goes to the next one
+                    queue.update(job['id'], status=FAILED, error=f"{type(error).__name__}: {error}",
+                                 finished=time.time())
+                    counts[FAILED] += 1
+                    free_slots.append(cpus)
+                    print(f"Job {job['id']} '{job['name']}' could not be started: {error}")
+                    continue
+                queue.update(job['id'], pid=process.pid, cpus=cpus)
+                running[job['id']] = (job, process, cpus)
+                print(f"Started job {job['id']} '{job['name']}' on cpus {cpus[0]}-{cpus[-1]}, log in '{job['log']}'")
+            if not running:
+                break
+
+            time.sleep(POLL_SECONDS)
+            for job_id, (job, process, cpus) in list(running.items()):
+                returncode = process.poll()
+                if returncode is None:
+                    continue
+                status = DONE if returncode == 0 else FAILED
+                queue.update(job_id, status=status, returncode=returncode, finished=time.time())
+                counts[status] += 1
+                free_slots.append(cpus)
+                del running[job_id]
+                print(f"Job {job_id} '{job['name']}' {status} in {time.time() - job['started']:.0f}s")
+    finally:
+        for job_id, (job, process, _) in running.items():
+            process.terminate()
+            process.wait()
+            queue.update(job_id, status=QUEUED, owner=None, pid=None, started=None)
+            print(f"Job {job_id} '{job['name']}' stopped and queued again")
+    return counts
+
+
+def submit_sr3(phase: str, config_file: str, queue: JobQueue = None) -> int:
+    """This function queues a SR3 'train', 'val' or 'test' job and returns its id."""
+    queue = queue or JobQueue()
+    return queue.submit(f"sr3_{phase}", sr3_command(phase, config_file), SR3_DIR)
+
+
+def submit_liif_train(config_file: str, queue: JobQueue = None) -> int:
+    """This function queues a liif training job and returns its id."""
+    queue = queue or JobQueue()
+    return queue.submit('liif_train', liif_train_command(config_file), LIIF_DIR)
+
+
+def submit_liif_validations(config_file: str, model_paths: list, queue: JobQueue = None) -> list:
+    """This function queues a liif validation job per checkpoint.
+
+    Args:
+        config_file (str): name of the config file under the liif config dir
+        model_paths (list): paths to the checkpoints, relative to the liif repository
+        queue (JobQueue, optional): queue of the jobs. Defaults to the one in QUEUE_PATH.
+
+    Returns:
+        list: ids of the queued jobs, the missing checkpoints are skipped
+    """
+    queue = queue or JobQueue()
+    job_ids = []
+    for model_path in model_paths:
+        cmd = liif_val_command(config_file, model_path)
+        if cmd is None:
+            print(f"The checkpoint '{model_path}' could not be found, skipping it")
+            continue
+        name = 'liif_val_' + os.path.splitext(model_path)[0].replace(os.sep, '_').strip('_.')
+        job_ids.append(queue.submit(name, cmd, LIIF_DIR))
+    return job_ids
+
+
+def submit_liif_test(input_dir: str, model_path: str, device: str = None, queue: JobQueue = None) -> int:
+    """This function queues a liif inference job and returns its id, None if the
+    checkpoint or the input dir do not exist."""
+    queue = queue or JobQueue()
+    cmd = liif_test_command(input_dir, model_path, device)
+    return queue.submit('liif_test', cmd, LIIF_DIR) if cmd else None
+
+
+def print_status(jobs: list) -> None:
+    """This function prints a row per job of the queue."""
+    print(f"{'id':>5}  {'name':40}{'status':>8}{'code':>6}{'seconds':>9}  cpus")
+    for job in jobs:
+        seconds = (job['finished'] or time.time()) - job['started'] if job['started'] else 0
+        code = '' if job['returncode'] is None else job['returncode']
+        cpus = f"{job['cpus'][0]}-{job['cpus'][-1]}" if job['cpus'] else ''
+        print(f"{job['id']:5d}  {job['name'][:39]:40}{job['status']:>8}{code:>6}{seconds:9.0f}  {cpus}")
+        if job.get('error'):
+            print(f"{'':7}{job['error']}")
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Queue and run train/val/test jobs of the models.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="run the queued jobs")
+    run_parser.add_argument('--max-jobs', type=int, default=None, help="jobs running at the same time")
+    run_parser.add_argument('--no-pin', action='store_true', help="do not pin the jobs to CPUs")
+    sr3_parser = subparsers.add_parser('sr3', help="queue a SR3 job")
+    sr3_parser.add_argument('phase', choices=['train', 'val', 'test'])
+    sr3_parser.add_argument('--config', required=True)
+    train_parser = subparsers.add_parser('train-liif', help="queue a liif training job")
+    train_parser.add_argument('--config', required=True)
+    val_parser = subparsers.add_parser('val-liif', help="queue a liif validation job per checkpoint")
+    val_parser.add_argument('--config', required=True)
+    val_parser.add_argument('--models', nargs='+', required=True, help="checkpoints, relative to the liif repository, or 'best', 'latest' or 'epoch:N'")
+    test_parser = subparsers.add_parser('test-liif', help="queue a liif inference job")
+    test_parser.add_argument('--input', required=True)
+    test_parser.add_argument('--model', required=True)
+    test_parser.add_argument('--device', default=None)
+    subparsers.add_parser('status', help="print the jobs of the queue")
+    subparsers.add_parser('clear', help="remove the finished jobs from the queue")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_queue(args.max_jobs, pin=not args.no_pin)
+        print(f"{results[DONE]} jobs done, {results[FAILED]} failed")
+        if results[FAILED]:
+            raise SystemExit(1)
+    elif args.command == 'sr3':
+        print(f"Queued job {submit_sr3(args.phase, args.config)}")
+    elif args.command == 'train-liif':
+        print(f"Queued job {submit_liif_train(args.config)}")
+    elif args.command == 'val-liif':
+        print(f"Queued jobs {submit_liif_validations(args.config, [resolve_checkpoint(m) for m in args.models])}")
+    elif args.command == 'test-liif':
+        print(f"Queued job {submit_liif_test(args.input, args.model, args.device)}")
+    elif args.command == 'status':
+        print_status(JobQueue().jobs())
+    else:
+        print(f"Removed {JobQueue().clear()} finished jobs")
@@ -0,0 +1,229 @@
+"""
+This module contains a client for the Liif inference server (infer_server.py,
+copied into the liif repository), and a benchmark measuring its latency and
+throughput with several concurrent clients.
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+# Must match the defaults of liif_script/infer_server.py
+DEFAULT_URL = 'http://127.0.0.1:8765'
+DEFAULT_TIMEOUT = 300
+IMAGE_EXTENSIONS = ('.png', '.tif', '.tiff', '.jpg', '.jpeg', '.bmp')
+DEFAULT_CONCURRENCY = (1, 4, 16)
+DEFAULT_REQUESTS = 64
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def server_status(url: str = DEFAULT_URL, timeout: float = DEFAULT_TIMEOUT) -> dict:
+    """This function asks the server for its device, loaded models and batching stats.
+
+    Args:
+        url (str, optional): base url of the server. Defaults to DEFAULT_URL.
+        timeout (float, optional): seconds to wait for the answer. Defaults to DEFAULT_TIMEOUT.
+
+    Returns:
+        dict: the server status
+    """
+    with urllib.request.urlopen(f"{url}/health", timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def infer_remote(image: bytes, scale: float = None, output_size: tuple = None, model: str = None,
+                 url: str = DEFAULT_URL, timeout: float = DEFAULT_TIMEOUT) -> bytes:
+    """This function sends an encoded image to the server and returns the inferred one.
+
+    Args:
+        image (bytes): content of an image file
+        scale (float, optional): upsampling factor. Defaults to None.
+        output_size (tuple, optional): (h, w) of the output. Defaults to 256x256 when no scale is given.
+        model (str, optional): checkpoint relative to the save directory. Defaults to the server's one.
+        url (str, optional): base url of the server. Defaults to DEFAULT_URL.
+        timeout (float, optional): seconds to wait for the answer. Defaults to DEFAULT_TIMEOUT.
+
+    Raises:
+        RuntimeError: raised if the server could not infer the image
+
+    Returns:
+        bytes: the inferred image as PNG
+    """
+    params = {}
+    if model:
+        params['model'] = model
+    if scale:
+        params['scale'] = scale
+    if output_size:
+        params['size'] = f"{output_size[0]}x{output_size[1]}"
+    request = urllib.request.Request(f"{url}/infer?{urlencode(params)}", data=image, method='POST',
+                                     headers={'Content-Type': 'application/octet-stream'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.read()
+    except urllib.error.HTTPError as err:
+        raise RuntimeError(f"The server answered {err.code}: {err.read().decode(errors='replace')}") from err
+
+
+def list_images(path: str) -> list:
+    """This function returns the given image, or the images of the given directory.
+
+    Args:
+        path (str): an image or a directory
+
+    Returns:
+        list: sorted image paths
+    """
+    if os.path.isfile(path):
+        return [path]
+    return sorted(os.path.join(path, found) for found in os.listdir(path)
+                  if os.path.splitext(found)[1].lower() in IMAGE_EXTENSIONS)
+
+
+def infer_folder(input_path: str, output_dir: str, scale: float = None, output_size: tuple = None,
+                 model: str = None, url: str = DEFAULT_URL, concurrency: int = 4) -> int:
+    """This function infers every image of a directory through the server, storing them
+    in the output directory as '<name>_infered.png'.
+
+    Args:
+        input_path (str): an image or a directory of images
+        output_dir (str): directory where the outputs are stored
+        scale (float, optional): upsampling factor. Defaults to None.
+        output_size (tuple, optional): (h, w) of the outputs. Defaults to None.
+        model (str, optional): checkpoint relative to the save directory. Defaults to the server's one.
+        url (str, optional): base url of the server. Defaults to DEFAULT_URL.
+        concurrency (int, optional): requests sent at the same time. Defaults to 4.
+
+    Returns:
+        int: number of images inferred
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    def infer_one(path: str) -> None:
+        with open(path, 'rb') as source:
+            result = infer_remote(source.read(), scale, output_size, model, url)
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(os.path.join(output_dir, f"{name}_infered.png"), 'wb') as destination:
+            destination.write(result)
+
+    paths = list_images(input_path)
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        list(executor.map(infer_one, paths))
+    return len(paths)
+
+
+def _percentile(values: list, percent: float) -> float:
+    """This function returns the given percentile of a sorted list of values."""
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
+
+
+def benchmark_server(input_path: str, scale: float = None, output_size: tuple = None, model: str = None,
+                     url: str = DEFAULT_URL, concurrency: tuple = DEFAULT_CONCURRENCY,
+                     requests: int = DEFAULT_REQUESTS) -> list:
+    """This function sends the same number of requests with several numbers of concurrent
+    clients, cycling over the given images, and prints the latency and throughput of each.
+
+    Args:
+        input_path (str): an image or a directory of images
+        scale (float, optional): upsampling factor. Defaults to None.
+        output_size (tuple, optional): (h, w) of the outputs. Defaults to None.
+        model (str, optional): checkpoint relative to the save directory. Defaults to the server's one.
+        url (str, optional): base url of the server. Defaults to DEFAULT_URL.
+        concurrency (tuple, optional): numbers of concurrent clients. Defaults to DEFAULT_CONCURRENCY.
+        requests (int, optional): requests sent per concurrency level. Defaults to DEFAULT_REQUESTS.
+
+    Returns:
+        list: one dict per concurrency level with the latencies in ms and the throughput
+    """
+    images = []
+    for path in list_images(input_path):
+        with open(path, 'rb') as source:
+            images.append(source.read())
+    if not images:
+        raise FileNotFoundError(f"No images could be found at '{input_path}'!!")
+
+    def timed(position: int) -> float:
+        start = time.perf_counter()
+        infer_remote(images[position % len(images)], scale, output_size, model, url)
+        return (time.perf_counter() - start) * 1000
+
+    # The first request may load the model, it is not measured
+    timed(0)
+    results = []
+    print(f"{'clients':>8}{'req/s':>9}{'mean ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for clients in concurrency:
+        latencies = []
+        errors = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            futures = [executor.submit(timed, position) for position in range(requests)]
+            for future in futures:
+                try:
+                    latencies.append(future.result())
+                except (RuntimeError, OSError):
+                    errors += 1
+        wall = time.perf_counter() - start
+        latencies.sort()
+        result = {'clients': clients, 'requests': requests, 'errors': errors, 'wall_time': wall,
+                  'throughput': len(latencies) / wall, 'mean_ms': sum(latencies) / max(len(latencies), 1),
+                  'p50_ms': _percentile(latencies, 50), 'p95_ms': _percentile(latencies, 95),
+                  'p99_ms': _percentile(latencies, 99)}
+        results.append(result)
+        print(f"{clients:8d}{result['throughput']:9.1f}{result['mean_ms']:10.1f}{result['p50_ms']:9.1f}"
+              f"{result['p95_ms']:9.1f}{result['p99_ms']:9.1f}{errors:8d}")
+    print(f"Server: {server_status(url)['stats']}")
+    return results
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Client of the Liif inference server")
+    parser.add_argument('input', help="image or directory of images to infer")
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--model', default=None, help="checkpoint relative to the server's save directory")
+    parser.add_argument('--scale', type=float, default=None, help="upsampling factor of the outputs")
+    parser.add_argument('--output-size', type=int, nargs=2, default=None, metavar=('H', 'W'),
+                        help="size of the outputs (default 256 256 when no --scale is given)")
+    parser.add_argument('--output', default='output', help="directory where the outputs are stored")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=list(DEFAULT_CONCURRENCY),
+                        help="concurrent requests (the first value when not benchmarking)")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="measure latency and throughput instead of storing the outputs")
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS,
+                        help="requests sent per concurrency level when benchmarking")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_server(args.input, args.scale, args.output_size, args.model, args.url,
+                         tuple(args.concurrency), args.requests)
+    else:
+        start = time.perf_counter()
+        count = infer_folder(args.input, args.output, args.scale, args.output_size, args.model, args.url,
+                             args.concurrency[0])
+        print(f"{count} images inferred in {time.perf_counter() - start:.2f}s")
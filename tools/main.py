@@ -6,16 +6,22 @@ problems.
 :author: Ruben Moya Vazquez <rmoyav@uoc.edu>
 :date: 28/05/2023
 """
+import argparse
 import os
 
 from models_storage import (download_repos, copy_config_files_sr3, copy_config_folder_liif,
-                            copy_liif_infer_file, LIIF_CONFIG_DIR, SR3_CONFIG_DIR, LIIF_TRAIN_CONFIG,
+                            copy_liif_infer_file, copy_sr3_infer_file, write_fast_sampling_configs, copy_dataset_adapters, LIIF_CONFIG_DIR, SR3_CONFIG_DIR, LIIF_TRAIN_CONFIG,
                             LIIF_SAVE_DIR, LIIF_DIR)
-from pretrain_loader import pretrain_load
-from trainvaltest_functions import (train_sr3, train_liif, val_sr3, val_liif, test_sr3, 
-                                    test_liif, select_file_from_config_dir, select_model)
+from pretrain_loader import update_pretrain_load, export_prepared_shards
+from trainvaltest_functions import (train_sr3, train_liif, val_sr3, val_liif, test_sr3, test_sr3_fast,
+                                    test_liif, serve_liif, export_liif, select_file_from_config_dir,
+                                    select_model)
+from archive_ingest import find_archive, ingest_archive
 from dataset_storage import DATA_DIR, DATASET1_NAME
+from evaluation import evaluate_folder
 from image_info import drop_wrong_images
+from pipeline import run_pipeline
+from tracing import DEFAULT_TRACE_FILE, enable, traced
 
 ###############################################################################
 #                                                                             #
@@ -34,7 +40,7 @@ def get_seed_value() -> int:
     choice = input("Do you want to set a seed for the data splitting?: [y/n]")
     if choice == 'y':
         try:
-            custom_seed = int(input("Give the new value for the seed (-1 = random): "))
+            custom_seed = int(input("Give the new value for the seed (-1 = keep the previous one or random): "))
         except ValueError:
             print("The given value is not of the expected type (integer)")
             print("The script will be using default seed value")
@@ -99,28 +105,45 @@ def get_liif_input_dir() -> str:
             print(f"'{rel_path}' directory could not be found under '~/models/liif'. Please, try again.")
 
 
+@traced(category='menu')
 def option1() -> None:
     print("Downloading model repos...")
     download_repos()
     print("Done!!")
 
+@traced(category='menu')
 def option2() -> None:
     seed = get_seed_value()
     train_percent, val_percent = get_train_val()
-    print("Removing images with errors...")
-    drop_wrong_images(os.path.join(DATA_DIR, DATASET1_NAME, 'Images'))
-    print("Executing pre-train scripts...")
-    pretrain_load(train_percent=train_percent, val_percent=val_percent, seed=seed)
+    archive_path = find_archive()
+    if not os.path.isdir(os.path.join(DATA_DIR, DATASET1_NAME, 'Images')) and archive_path:
+        print(f"Preparing the data straight from '{archive_path}'...")
+        ingest_archive(archive_path, train_percent=train_percent, val_percent=val_percent, seed=seed)
+    else:
+        print("Removing images with errors...")
+        drop_wrong_images(os.path.join(DATA_DIR, DATASET1_NAME, 'Images'))
+        print("Executing pre-train scripts...")
+        summary = update_pretrain_load(train_percent=train_percent, val_percent=val_percent, seed=seed)
+        print(f"Prepared {summary['processed']} images ({summary['unchanged']} unchanged, "
+              f"{summary['failed']} failed, {summary['removed']} stale files removed)")
+    if input("Do you want to pack the prepared data into shards?: [y/n]") == 'y':
+        print("Packing prepared data...")
+        export_prepared_shards()
     try:
         print("Copying configuration files...")
         copy_config_files_sr3()
+        write_fast_sampling_configs()
         copy_config_folder_liif()
         print("Copying infer script...")
         copy_liif_infer_file()
+        copy_sr3_infer_file()
+        print("Copying dataset adapters...")
+        copy_dataset_adapters()
     except FileNotFoundError:
         print("One or more of the files could not be copied. Please copy it manually.")
     print("Done!!")
 
+@traced(category='menu')
 def option3() -> None:
     print("SR3 training configuration selection.")
     config = select_file_from_config_dir(SR3_CONFIG_DIR)
@@ -128,6 +151,7 @@ def option3() -> None:
     train_sr3(config)
     print("Done!!")
 
+@traced(category='menu')
 def option4() -> None:
     print("Liif training configuration selection.")
     config = select_file_from_config_dir(os.path.join(LIIF_CONFIG_DIR, LIIF_TRAIN_CONFIG))
@@ -135,6 +159,7 @@ def option4() -> None:
     train_liif(config)
     print("Done!!")
 
+@traced(category='menu')
 def option5() -> None:
     print("SR3 validation configuration selection.")
     config = select_file_from_config_dir(SR3_CONFIG_DIR)
@@ -142,6 +167,7 @@ def option5() -> None:
     val_sr3(config)
     print("Done!!")
 
+@traced(category='menu')
 def option6() -> None:
     print("Liif training configuration selection.")
     config = select_file_from_config_dir(os.path.join(LIIF_CONFIG_DIR, LIIF_TRAIN_CONFIG))
@@ -151,6 +177,7 @@ def option6() -> None:
         val_liif(config, model_path)
         print("Done!!")
     
+@traced(category='menu')
 def option7() -> None:
     print("SR3 testing configuration selection.")
     config = select_file_from_config_dir(SR3_CONFIG_DIR)
@@ -158,6 +185,7 @@ def option7() -> None:
     test_sr3(config)
     print("Done!!")
 
+@traced(category='menu')
 def option8() -> None:
     input_dir = get_liif_input_dir()
     model_path = select_model(LIIF_SAVE_DIR)
@@ -166,6 +194,45 @@ def option8() -> None:
         test_liif(input_dir, model_path)
         print("Done!!")
 
+@traced(category='menu')
+def option9() -> None:
+    model_path = select_model(LIIF_SAVE_DIR)
+    if model_path:
+        print("Launching Liif inference server. Press Ctrl+c to stop it...")
+        try:
+            serve_liif([model_path])
+        except KeyboardInterrupt:
+            pass
+        print("Done!!")
+
+@traced(category='menu')
+def option10() -> None:
+    model_path = select_model(LIIF_SAVE_DIR)
+    if model_path:
+        bf16 = input("Do you want to run the exported model in bf16 precision?: [y/n]") == 'y'
+        print("Exporting Liif model for CPU inference...")
+        if export_liif(model_path, bf16=bf16):
+            print("Done!!")
+        else:
+            print("The exported model loses quality or could not be created. Please check the report above.")
+
+@traced(category='menu')
+def option11() -> None:
+    print("Evaluating the Liif infered images against the test split...")
+    try:
+        evaluate_folder()
+        print("Done!!")
+    except FileNotFoundError as error:
+        print(f"{error} Please, prepare the data and infer some images first.")
+
+@traced(category='menu')
+def option12() -> None:
+    print("SR3 testing configuration selection.")
+    config = select_file_from_config_dir(SR3_CONFIG_DIR)
+    print("Launch SR3 fast infering process (50, 100 and 250 steps)...")
+    test_sr3_fast(config)
+    print("Done!!")
+
 def main():
     while True:
         print("==================================")
@@ -179,6 +246,10 @@ def main():
         print("6. Launch Liif validation")
         print("7. Launch SR3 infering process")
         print("8. Launch Liif infering process")
+        print("9. Launch Liif inference server")
+        print("10. Export Liif model for CPU inference")
+        print("11. Evaluate Liif infered images")
+        print("12. Launch SR3 fast infering process")
         print("*. Give any other option to leave")
         print("==================================")
         choice = input("Choose one of the given options: ")
@@ -199,6 +270,14 @@ def main():
             option7()
         elif choice == '8':
             option8()
+        elif choice == '9':
+            option9()
+        elif choice == '10':
+            option10()
+        elif choice == '11':
+            option11()
+        elif choice == '12':
+            option12()
         else:
             print("Option not found. Bye!.")
             break
@@ -211,4 +290,19 @@ def main():
 ###############################################################################
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Super resolution pipeline menu.")
+    parser.add_argument('--trace', nargs='?', const=DEFAULT_TRACE_FILE, default=None, metavar='FILE',
+                        help="trace the steps into a Chrome trace json file (also enabled with SR_TRACE=FILE)")
+    parser.add_argument('--pipeline', default=None, metavar='FILE',
+                        help="run the stages of a json pipeline file instead of the menu")
+    parser.add_argument('--max-workers', type=int, default=None, help="pipeline stages running at the same time")
+    parser.add_argument('--force', action='store_true', help="run every pipeline stage even if it is up to date")
+    args = parser.parse_args()
+    if args.trace:
+        enable(args.trace)
+    if args.pipeline:
+        results = run_pipeline(args.pipeline, args.max_workers, args.force)
+        if any(result['status'] in ('failed', 'blocked') for result in results.values()):
+            raise SystemExit(1)
+    else:
+        main()
\ No newline at end of file
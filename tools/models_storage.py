@@ -8,10 +8,14 @@ problems.
 """
 
 import os
+import re
 import git
 import shutil
 
+import numpy as np
+
 from dataset_storage import ROOT_DIR
+from tracing import traced
 
 ###############################################################################
 #                                                                             #
@@ -32,6 +36,13 @@ SR3_DIR = os.path.join(ROOT_DIR, 'models', SR3_REPO_NAME)
 SR3_CONFIG_DIR = os.path.join(SR3_DIR, 'config')
 SR3_CONFIG_TRAIN_FILENAME = 'sr_sr3_64_256.json'
 SR3_CONFIG_TEST_FILENAME = 'sr_sr3_64_256_test.json'
+# Written by autotune.py for this machine, installed when it exists
+SR3_TUNED_CONFIG_FILENAME = 'sr_sr3_64_256_tuned.json'
+# Fast sampling script copied into the SR3 repository and the steps of the configs written for it
+SR3_SCRIPT_FOLDER = os.path.join(ROOT_DIR, 'sr3_script')
+SR3_FAST_INFER_SCRIPT_NAME = 'infer_fast.py'
+FAST_SAMPLING_STEPS = [50, 100, 250]
+SR3_VAL_SCHEDULE_PATTERN = re.compile(r'"beta_schedule"\s*:\s*\{.*?"val"\s*:\s*\{(?P<body>[^}]*)\}', re.DOTALL)
 
 # Liif repo
 LIIF_REPO = "https://github.com/yinboc/liif.git"
@@ -42,36 +53,155 @@ LIIF_TEST_CONFIG_DIR = os.path.join(LIIF_CONFIG_DIR, 'test')
 LIIF_TRAIN_CONFIG = "train-UCMerced_LandUse"
 LIIF_TEST_CONFIG_FILENAME = "test-UCMerced_LandUse-64-256.yaml"
 INFER_SCRIPT_NAME = "infer.py"
+INFER_SERVER_SCRIPT_NAME = "infer_server.py"
+EXPORT_SCRIPT_NAME = "export_model.py"
+# Modules of the infer script
+INFER_MODULE_NAMES = ["infer_cache.py", "liif_query.py", "tile_io.py"]
+# Scripts copied into the liif repository, the others import the infer script
+INFER_SCRIPT_NAMES = [INFER_SCRIPT_NAME, INFER_SERVER_SCRIPT_NAME, EXPORT_SCRIPT_NAME] + INFER_MODULE_NAMES
 INFER_SCRIPT_FOLDER = os.path.join(ROOT_DIR, 'liif_script')
 LIIF_SAVE_DIR = os.path.join(LIIF_DIR, 'save')
 
+# Dataset adapters installed into both model repositories
+TOOLS_DIR = os.path.join(ROOT_DIR, 'tools')
+ADAPTER_MODULES = ['shard_storage', 'degradation', 'shm_cache']
+LIIF_DATASETS_DIR = os.path.join(LIIF_DIR, 'datasets')
+SR3_DATA_PACKAGE_DIR = os.path.join(SR3_DIR, 'data')
+# LIIF dataset names served by the adapters: {name: (module, class)}
+LIIF_DATASET_ADAPTERS = {'shard-folder': ('shard_storage', 'ShardImageFolder'),
+                         'shard-paired-folders': ('shard_storage', 'ShardPairedFolders'),
+                         'degraded-paired': ('degradation', 'DegradedPairedFolders'),
+                         'shm-folder': ('shm_cache', 'ShmImageFolder'),
+                         'shm-paired-folders': ('shm_cache', 'ShmPairedFolders')}
+# SR3 'datatype' values served by the adapters: {datatype: (module, class)}
+SR3_DATATYPE_ADAPTERS = {'shard': ('shard_storage', 'ShardLRHRDataset'),
+                         'degraded': ('degradation', 'DegradedLRHRDataset'),
+                         'shm': ('shm_cache', 'ShmLRHRDataset')}
+SR3_DATASET_IMPORT = "    from data.LRHR_dataset import LRHRDataset as D\n"
+ADAPTER_PATCH_BEGIN = "    # tfm_super_resolution dataset adapters >>>\n"
+ADAPTER_PATCH_END = "    # tfm_super_resolution dataset adapters <<<\n"
+LIIF_ADAPTER_PATCH_BEGIN = ADAPTER_PATCH_BEGIN.lstrip()
+LIIF_ADAPTER_PATCH_END = ADAPTER_PATCH_END.lstrip()
+
 ###############################################################################
 #                                                                             #
 #                                 FUNCTIONS                                   #
 #                                                                             #
 ###############################################################################
 
+@traced()
 def copy_liif_infer_file() -> None:
-    """This function is meant to copy the infer.py script into the liif
-    repository dir to be used after.
+    """This function is meant to copy the infer.py script, and the inference server
+    and model export scripts built on it, into the liif repository dir to be used after.
 
     Raises:
-        FileNotFoundError: raised if the infer.py script file does not exist
+        FileNotFoundError: raised if one of the script files does not exist
         FileNotFoundError: raised if the liif model folder could not be found
     """
-    source_file = os.path.join(INFER_SCRIPT_FOLDER, INFER_SCRIPT_NAME)
-
-    if not os.path.isfile(source_file):
-        raise FileNotFoundError(f"The file '{INFER_SCRIPT_NAME}' could not be found at '{source_file}'!!")
+    for script_name in INFER_SCRIPT_NAMES:
+        source_file = os.path.join(INFER_SCRIPT_FOLDER, script_name)
+        if not os.path.isfile(source_file):
+            raise FileNotFoundError(f"The file '{script_name}' could not be found at '{source_file}'!!")
     
     if not os.path.exists(LIIF_DIR):
         raise FileNotFoundError(f"The '{LIIF_DIR}' does not exist. Please download the model repositories before copying the files!!")
 
-    destination_file = os.path.join(LIIF_DIR, INFER_SCRIPT_NAME)
-    shutil.copy(source_file, destination_file)
-    print(f"The config file '{INFER_SCRIPT_NAME}' has been copied to '{LIIF_DIR}'.")
+    for script_name in INFER_SCRIPT_NAMES:
+        shutil.copy(os.path.join(INFER_SCRIPT_FOLDER, script_name), os.path.join(LIIF_DIR, script_name))
+        print(f"The script '{script_name}' has been copied to '{LIIF_DIR}'.")
+
+
+def _liif_adapter_patch() -> str:
+    """This function builds the lines that register the adapters in LIIF's dataset
+    registry, appended to its 'datasets' package.
+
+    Returns:
+        str: the lines of the patch
+    """
+    lines = [LIIF_ADAPTER_PATCH_BEGIN, "from .datasets import register\n"]
+    lines.append(f"from . import {', '.join(ADAPTER_MODULES)}\n")
+    for name, (module, class_name) in LIIF_DATASET_ADAPTERS.items():
+        lines.append(f"register('{name}')({module}.{class_name})\n")
+    lines.append(LIIF_ADAPTER_PATCH_END)
+    return ''.join(lines)
 
 
+def _sr3_adapter_patch() -> str:
+    """This function builds the lines that make SR3's create_dataset choose the
+    dataset class by 'datatype', falling back to its own LRHRDataset.
+
+    Returns:
+        str: the lines replacing SR3_DATASET_IMPORT
+    """
+    lines = [ADAPTER_PATCH_BEGIN]
+    for position, (datatype, (module, class_name)) in enumerate(SR3_DATATYPE_ADAPTERS.items()):
+        keyword = 'if' if position == 0 else 'elif'
+        lines.append(f"    {keyword} dataset_opt['datatype'] == '{datatype}':\n")
+        lines.append(f"        from data.{module} import {class_name} as D\n")
+    lines.append("    else:\n")
+    lines.append("    " + SR3_DATASET_IMPORT)
+    lines.append(ADAPTER_PATCH_END)
+    return ''.join(lines)
+
+
+@traced()
+def copy_dataset_adapters() -> None:
+    """This function is meant to copy the dataset adapter modules into both model
+    repositories and register them, so their configuration files can point at the
+    packed datasets.
+
+    Raises:
+        FileNotFoundError: raised if an adapter module does not exist
+        FileNotFoundError: raised if the model repositories could not be found
+    """
+    liif_init = os.path.join(LIIF_DATASETS_DIR, '__init__.py')
+    sr3_init = os.path.join(SR3_DATA_PACKAGE_DIR, '__init__.py')
+    for init_file in (liif_init, sr3_init):
+        if not os.path.isfile(init_file):
+            raise FileNotFoundError(f"The file '{init_file}' does not exist. Please download the model repositories before copying the files!!")
+
+    for module in ADAPTER_MODULES:
+        source_file = os.path.join(TOOLS_DIR, f"{module}.py")
+        if not os.path.isfile(source_file):
+            raise FileNotFoundError(f"The file '{module}.py' could not be found at '{source_file}'!!")
+        for destination_dir in (LIIF_DATASETS_DIR, SR3_DATA_PACKAGE_DIR):
+            shutil.copy(source_file, os.path.join(destination_dir, f"{module}.py"))
+        print(f"The adapter '{module}.py' has been copied to '{LIIF_DATASETS_DIR}' and '{SR3_DATA_PACKAGE_DIR}'.")
+
+    # LIIF creates the datasets by name from the registry its package fills on import
+    with open(liif_init, 'r') as init_file:
+        content = init_file.read()
+    # Imports appended by earlier versions, when the modules registered themselves
+    for module in ADAPTER_MODULES:
+        content = content.replace(f"from . import {module}\n", '')
+    if LIIF_ADAPTER_PATCH_BEGIN in content and LIIF_ADAPTER_PATCH_END in content:
+        start = content.index(LIIF_ADAPTER_PATCH_BEGIN)
+        end = content.index(LIIF_ADAPTER_PATCH_END) + len(LIIF_ADAPTER_PATCH_END)
+        content = content[:start] + _liif_adapter_patch() + content[end:]
+    else:
+        content += ('' if content.endswith('\n') else '\n') + _liif_adapter_patch()
+    with open(liif_init, 'w') as init_file:
+        init_file.write(content)
+    print(f"The dataset adapters have been registered in '{liif_init}'.")
+
+    # SR3 creates every dataset with LRHRDataset, so the choice by datatype is added
+    with open(sr3_init, 'r') as init_file:
+        content = init_file.read()
+    if ADAPTER_PATCH_BEGIN in content and ADAPTER_PATCH_END in content:
+        start = content.index(ADAPTER_PATCH_BEGIN)
+        end = content.index(ADAPTER_PATCH_END) + len(ADAPTER_PATCH_END)
+        content = content[:start] + _sr3_adapter_patch() + content[end:]
+    elif SR3_DATASET_IMPORT in content:
+        content = content.replace(SR3_DATASET_IMPORT, _sr3_adapter_patch(), 1)
+    else:
+        print(f"'{sr3_init}' could not be patched. Please select the adapters by datatype manually.")
+        return
+    with open(sr3_init, 'w') as init_file:
+        init_file.write(content)
+    print(f"The dataset adapters have been registered in '{sr3_init}'.")
+
+
+@traced()
 def copy_config_folder_liif() -> None:
     """This function will copy the configuration for the liif model into
     its config directory.
@@ -104,6 +234,7 @@ def copy_config_folder_liif() -> None:
     print(f"The folder '{LIIF_TRAIN_CONFIG}' has been copied to '{destination_folder}'!!")
 
 
+@traced()
 def copy_config_files_sr3() -> None:
     """This function is meant to copy the config files for SR3 model into
     its default configuration folder.
@@ -132,7 +263,105 @@ def copy_config_files_sr3() -> None:
     shutil.copy(source_file_2, destination_file_2)
     print(f"The config file '{SR3_CONFIG_TEST_FILENAME}' has been copied to '{SR3_CONFIG_DIR}'.")
 
+    tuned_file = os.path.join(CONFIG_DIR, SR3_TUNED_CONFIG_FILENAME)
+    if os.path.isfile(tuned_file):
+        shutil.copy(tuned_file, os.path.join(SR3_CONFIG_DIR, SR3_TUNED_CONFIG_FILENAME))
+        print(f"The config file '{SR3_TUNED_CONFIG_FILENAME}' has been copied to '{SR3_CONFIG_DIR}'.")
 
+
+@traced()
+def copy_sr3_infer_file() -> None:
+    """This function is meant to copy the fast sampling infer script into the SR3
+    repository dir to be used after.
+
+    Raises:
+        FileNotFoundError: raised if the script file does not exist
+        FileNotFoundError: raised if the SR3 model folder could not be found
+    """
+    source_file = os.path.join(SR3_SCRIPT_FOLDER, SR3_FAST_INFER_SCRIPT_NAME)
+    if not os.path.isfile(source_file):
+        raise FileNotFoundError(f"The file '{SR3_FAST_INFER_SCRIPT_NAME}' could not be found at '{source_file}'!!")
+
+    if not os.path.exists(SR3_DIR):
+        raise FileNotFoundError(f"The '{SR3_DIR}' does not exist. Please download the model repositories before copying the files!!")
+
+    shutil.copy(source_file, os.path.join(SR3_DIR, SR3_FAST_INFER_SCRIPT_NAME))
+    print(f"The script '{SR3_FAST_INFER_SCRIPT_NAME}' has been copied to '{SR3_DIR}'.")
+
+
+def rescaled_linear_end(n_timestep: int, linear_start: float, linear_end: float, steps: int) -> float:
+    """This function finds the linear_end of a linear schedule of the given steps that
+    ends at the same noise level as the original schedule, so the network sees the
+    noise levels it was trained on.
+
+    Args:
+        n_timestep (int): steps of the original schedule
+        linear_start (float): first beta of both schedules
+        linear_end (float): last beta of the original schedule
+        steps (int): steps of the new schedule
+
+    Returns:
+        float: last beta of the new schedule
+    """
+    target = np.log1p(-np.linspace(linear_start, linear_end, n_timestep)).sum()
+    low, high = linear_start, 1 - 1e-9
+    for _ in range(100):
+        middle = (low + high) / 2
+        if np.log1p(-np.linspace(linear_start, middle, steps)).sum() > target:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+@traced()
+def write_fast_sampling_configs(steps: list = FAST_SAMPLING_STEPS,
+                                config_file: str = SR3_CONFIG_TEST_FILENAME) -> list:
+    """This function writes copies of a SR3 config whose 'val' schedule has fewer steps,
+    for SR3's infer.py or the ancestral sampler of infer_fast.py, into the SR3 config
+    dir. Only the name and the schedule are changed, the comments are kept.
+
+    Args:
+        steps (list, optional): steps of every config. Defaults to FAST_SAMPLING_STEPS.
+        config_file (str, optional): config under CONFIG_DIR. Defaults to SR3_CONFIG_TEST_FILENAME.
+
+    Raises:
+        FileNotFoundError: raised if the config file cannot be found within CONFIG_DIR
+        ValueError: raised if the config has no linear 'val' schedule
+
+    Returns:
+        list: names of the written config files
+    """
+    source_file = os.path.join(CONFIG_DIR, config_file)
+    if not os.path.isfile(source_file):
+        raise FileNotFoundError(f"The config file '{config_file}' cannot be found in '{CONFIG_DIR}'!!")
+    with open(source_file, 'r') as config:
+        content = config.read()
+
+    schedule = SR3_VAL_SCHEDULE_PATTERN.search(content)
+    values = dict(re.findall(r'"(\w+)"\s*:\s*"?([\w.+-]+)"?', schedule.group('body'))) if schedule else {}
+    if values.get('schedule') != 'linear':
+        raise ValueError(f"The config file '{config_file}' has no linear 'val' schedule!!")
+    n_timestep, linear_start, linear_end = int(values['n_timestep']), float(values['linear_start']), float(values['linear_end'])
+
+    if not os.path.exists(SR3_CONFIG_DIR):
+        os.makedirs(SR3_CONFIG_DIR)
+    written = []
+    for step_count in steps:
+        body = re.sub(r'("n_timestep"\s*:\s*)\d+', rf"\g<1>{step_count}", schedule.group('body'), count=1)
+        new_end = rescaled_linear_end(n_timestep, linear_start, linear_end, step_count)
+        body = re.sub(r'("linear_end"\s*:\s*)[\d.eE+-]+', rf"\g<1>{new_end:.6g}", body, count=1)
+        new_content = content[:schedule.start('body')] + body + content[schedule.end('body'):]
+        new_content = re.sub(r'("name"\s*:\s*")([^"]*)"', rf'\g<1>\g<2>_{step_count}steps"', new_content, count=1)
+        name = f"{os.path.splitext(config_file)[0]}_{step_count}steps.json"
+        with open(os.path.join(SR3_CONFIG_DIR, name), 'w') as config:
+            config.write(new_content)
+        written.append(name)
+        print(f"The config file '{name}' has been written to '{SR3_CONFIG_DIR}' (linear_end={new_end:.6g}).")
+    return written
+
+
+@traced()
 def download_repos() -> None:
     """This function will download the model repositories
     if it is not done yet.
@@ -0,0 +1,380 @@
+"""
+This module contains a non interactive runner of the workflow. It reads a
+pipeline file describing the stages to run and the stages each one depends on,
+and runs them as a dependency graph: the stages whose dependencies are done run
+at the same time, up to 'max_workers'.
+
+    {
+        "max_workers": 4,
+        "stages": {
+            "download":     {"action": "download_repos", "outputs": ["models/liif", "models/Image-Super-Resolution-via-Iterative-Refinement"]},
+            "clean":        {"action": "drop_wrong_images", "args": {"root_dir": "data/UCMerced_LandUse/Images"}},
+            "prepare":      {"action": "prepare_data", "args": {"seed": 1234, "train_percent": 0.6, "val_percent": 0.2},
+                             "after": ["clean", "download"], "always": true},
+            "sr3_configs":  {"action": "copy_sr3_configs", "after": ["download"], "inputs": ["model_config"]},
+            "liif_configs": {"action": "copy_liif_configs", "after": ["download"], "inputs": ["model_config"]},
+            "val_best":     {"action": "val_liif", "after": ["liif_configs", "prepare"],
+                             "args": {"config": "train_UCMerced_LandUse-64-256.yaml", "model": "best"}}
+        }
+    }
+
+    python tools/pipeline.py pipeline.json        (or python tools/main.py --pipeline pipeline.json)
+
+A stage is skipped when it already succeeded with the same action and arguments,
+its 'inputs' (files or folders) did not change, its 'outputs' exist and none of
+its dependencies ran again. Stages with "always": true run every time, which
+suits the ones that are incremental by themselves. What every stage did is kept
+in '<pipeline file>.state.json'.
+
+Relative paths in the pipeline are relative to the project root, but the
+checkpoints and inputs of the liif stages are relative to the liif repository. A
+checkpoint can also be chosen from the checkpoint catalog when the stage starts,
+with "best", "latest" or "epoch:N". The stages queueing jobs ('queue_val_liif')
+only add them to the queue of job_scheduler, a 'run_jobs' stage runs them
+max_jobs at a time.
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from archive_ingest import ingest_archive
+from autotune import autotune
+from checkpoint_catalog import resolve_checkpoint
+from dataset_storage import ROOT_DIR
+from degradation import degrade_folder
+from evaluation import evaluate_folder
+from image_info import drop_wrong_images
+from image_resampler import process_images_in_folder, process_pyramid_in_folder
+from job_scheduler import run_queue, submit_liif_validations
+from models_storage import (LIIF_DIR, copy_config_files_sr3, copy_config_folder_liif, copy_dataset_adapters,
+                            copy_liif_infer_file, copy_sr3_infer_file, download_repos,
+                            write_fast_sampling_configs)
+from pretrain_loader import export_prepared_shards, pretrain_load, update_pretrain_load
+from tracing import span
+from trainvaltest_functions import (export_liif, test_liif, test_sr3, test_sr3_fast, train_liif, train_sr3,
+                                    val_liif, val_sr3)
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+# Functions a stage can run: {action: function}
+ACTIONS = {
+    'download_repos': download_repos,
+    'drop_wrong_images': drop_wrong_images,
+    'prepare_data': update_pretrain_load,
+    'ingest_archive': ingest_archive,
+    'pretrain_load': pretrain_load,
+    'pack_shards': export_prepared_shards,
+    'resample': process_images_in_folder,
+    'resample_pyramid': process_pyramid_in_folder,
+    'copy_sr3_configs': copy_config_files_sr3,
+    'copy_liif_configs': copy_config_folder_liif,
+    'copy_liif_scripts': copy_liif_infer_file,
+    'copy_sr3_scripts': copy_sr3_infer_file,
+    'sr3_fast_configs': write_fast_sampling_configs,
+    'copy_dataset_adapters': copy_dataset_adapters,
+    'train_sr3': train_sr3,
+    'val_sr3': val_sr3,
+    'test_sr3': test_sr3,
+    'test_sr3_fast': test_sr3_fast,
+    'train_liif': train_liif,
+    'val_liif': val_liif,
+    'test_liif': test_liif,
+    'export_liif': export_liif,
+    'queue_val_liif': submit_liif_validations,
+    'run_jobs': run_queue,
+    'evaluate': evaluate_folder,
+    'degrade': degrade_folder,
+    'autotune': autotune,
+}
+
+# Arguments holding paths, made absolute from the project root
+PATH_ARGS = ('root_dir', 'data_dir', 'hr_dir', 'manifest_path', 'output_dir', 'report_dir', 'archive_path')
+
+# Friendlier names for the arguments of the launchers
+ARG_ALIASES = {'config': 'config_file', 'model': 'model_path', 'input': 'input_dir'}
+
+DEFAULT_MAX_WORKERS = 4
+STATE_SUFFIX = '.state.json'
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def _resolve(path: str) -> str:
+    """This function makes a path of the pipeline file absolute from the project root."""
+    return path if os.path.isabs(path) else os.path.join(ROOT_DIR, path)
+
+
+def load_pipeline(pipeline_path: str) -> dict:
+    """This function reads and validates a pipeline file.
+
+    Args:
+        pipeline_path (str): path to the json pipeline file
+
+    Raises:
+        FileNotFoundError: raised if the pipeline file does not exist
+        ValueError: raised if a stage uses an unknown action or arguments, depends on an
+        unknown stage or the dependencies have a cycle
+
+    Returns:
+        dict: {'max_workers', 'stages': {name: {'action', 'args', 'after', 'inputs', 'outputs', 'always'}}}
+    """
+    if not os.path.isfile(pipeline_path):
+        raise FileNotFoundError(f"The pipeline file '{pipeline_path}' could not be found!!")
+    with open(pipeline_path, 'r') as pipeline_file:
+        pipeline = json.load(pipeline_file)
+
+    stages = {}
+    for name, stage in pipeline.get('stages', {}).items():
+        action = stage.get('action')
+        if action not in ACTIONS:
+            raise ValueError(f"Stage '{name}' uses the unknown action '{action}', choose between {list(ACTIONS)}")
+        args = {ARG_ALIASES.get(key, key): value for key, value in stage.get('args', {}).items()}
+        args = {key: _resolve(value) if key in PATH_ARGS else value for key, value in args.items()}
+        try:
+            inspect.signature(ACTIONS[action]).bind(**args)
+        except TypeError as err:
+            raise ValueError(f"Stage '{name}' has wrong arguments for '{action}': {err}") from err
+        stages[name] = {'action': action, 'args': args, 'after': list(stage.get('after', [])),
+                        'inputs': [_resolve(path) for path in stage.get('inputs', [])],
+                        'outputs': [_resolve(path) for path in stage.get('outputs', [])],
+                        'always': bool(stage.get('always', False))}
+
+    for name, stage in stages.items():
+        unknown = [dependency for dependency in stage['after'] if dependency not in stages]
+        if unknown:
+            raise ValueError(f"Stage '{name}' depends on the unknown stages {unknown}")
+    execution_order(stages)
+    return {'max_workers': pipeline.get('max_workers', DEFAULT_MAX_WORKERS), 'stages': stages}
+
+
+def execution_order(stages: dict) -> list:
+    """This function groups the stages in levels: every stage only depends on stages
+    of previous levels, so the stages of a level can run at the same time.
+
+    Args:
+        stages (dict): stages returned by load_pipeline
+
+    Raises:
+        ValueError: raised if the dependencies have a cycle
+
+    Returns:
+        list: list of lists of stage names
+    """
+    pending = {name: set(stage['after']) for name, stage in stages.items()}
+    levels = []
+    while pending:
+        level = sorted(name for name, dependencies in pending.items() if not dependencies)
+        if not level:
+            raise ValueError(f"The dependencies of the stages {sorted(pending)} have a cycle")
+        levels.append(level)
+        for name in level:
+            del pending[name]
+        for dependencies in pending.values():
+            dependencies.difference_update(level)
+    return levels
+
+
+def _path_signature(path: str) -> list:
+    """This function summarizes the state of a file or folder: size and modification
+    time of a file, or number of files, total size and latest modification of a folder."""
+    if not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+    count = size = latest = 0
+    for current_path, _, files in os.walk(path):
+        for found in files:
+            stat = os.stat(os.path.join(current_path, found))
+            count += 1
+            size += stat.st_size
+            latest = max(latest, stat.st_mtime_ns)
+    return [count, size, latest]
+
+
+def fingerprint(stage: dict) -> str:
+    """This function hashes what a stage does and the state of its inputs.
+
+    Args:
+        stage (dict): a stage returned by load_pipeline
+
+    Returns:
+        str: hexadecimal hash
+    """
+    content = {'action': stage['action'], 'args': stage['args'],
+               'inputs': {path: _path_signature(path) for path in stage['inputs']}}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _load_state(state_path: str) -> dict:
+    if not os.path.isfile(state_path):
+        return {}
+    try:
+        with open(state_path, 'r') as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(state: dict, state_path: str) -> None:
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as state_file:
+        json.dump(state, state_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+def resolve_checkpoints(stage: dict) -> dict:
+    """This function replaces the checkpoint criteria ('best', 'latest', 'epoch:N') in the
+    arguments of a stage by the checkpoints they select now, and adds the checkpoints to
+    the inputs of the stage so it runs again when they change.
+
+    Args:
+        stage (dict): a stage returned by load_pipeline
+
+    Raises:
+        FileNotFoundError: raised if no checkpoint matches a criterion
+
+    Returns:
+        dict: a copy of the stage with the checkpoints resolved
+    """
+    args = dict(stage['args'])
+    if isinstance(args.get('model_path'), str):
+        args['model_path'] = resolve_checkpoint(args['model_path'])
+    if isinstance(args.get('model_paths'), list):
+        args['model_paths'] = [resolve_checkpoint(model_path) for model_path in args['model_paths']]
+    models = [args['model_path']] if isinstance(args.get('model_path'), str) else args.get('model_paths', [])
+    return dict(stage, args=args, inputs=stage['inputs'] + [os.path.join(LIIF_DIR, model) for model in models])
+
+
+def run_stage(name: str, stage: dict) -> None:
+    """This function runs the action of a stage.
+
+    Args:
+        name (str): name of the stage
+        stage (dict): a stage returned by load_pipeline
+    """
+    with span(f"stage {name}", category='pipeline', action=stage['action']):
+        ACTIONS[stage['action']](**stage['args'])
+
+
+def run_pipeline(pipeline_path: str, max_workers: int = None, force: bool = False, dry_run: bool = False) -> dict:
+    """This function runs the stages of a pipeline file, the independent ones at the
+    same time. A failing stage does not stop the others, but the stages depending on
+    it are not run.
+
+    Args:
+        pipeline_path (str): path to the json pipeline file
+        max_workers (int, optional): stages running at the same time. Defaults to the pipeline's value.
+        force (bool, optional): run every stage even if it is up to date. Defaults to False.
+        dry_run (bool, optional): only print the levels of stages that would run. Defaults to False.
+
+    Returns:
+        dict: {stage: {'status': 'done', 'skipped', 'failed' or 'blocked', 'seconds', 'error'}}
+    """
+    pipeline = load_pipeline(pipeline_path)
+    stages = pipeline['stages']
+    max_workers = max_workers or pipeline['max_workers']
+    levels = execution_order(stages)
+    if dry_run:
+        for position, level in enumerate(levels, start=1):
+            described = [f"{name} ({stages[name]['action']})" for name in level]
+            print(f"Level {position}: {', '.join(described)}")
+        return {}
+
+    state_path = pipeline_path + STATE_SUFFIX
+    state = _load_state(state_path)
+    results = {}
+    ran = set()
+    running = {}
+
+    def is_up_to_date(name: str, digest: str) -> bool:
+        stage = stages[name]
+        previous = state.get(name, {})
+        return (not force and not stage['always'] and previous.get('fingerprint') == digest
+                and previous.get('status') == 'done' and not ran.intersection(stage['after'])
+                and all(os.path.exists(path) for path in stage['outputs']))
+
+    def timed_run(name: str, stage: dict) -> float:
+        start = time.perf_counter()
+        run_stage(name, stage)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        while len(results) < len(stages):
+            for name, stage in stages.items():
+                if name in results or name in running.values():
+                    continue
+                statuses = [results.get(dependency, {}).get('status') for dependency in stage['after']]
+                if any(status in ('failed', 'blocked') for status in statuses):
+                    results[name] = {'status': 'blocked', 'seconds': 0.0, 'error': 'a dependency failed'}
+                    print(f"Stage '{name}' will not run because a dependency failed")
+                elif all(status in ('done', 'skipped') for status in statuses):
+                    try:
+                        stage = resolve_checkpoints(stage)
+                    except FileNotFoundError as error:
+                        results[name] = {'status': 'failed', 'seconds': 0.0, 'error': str(error)}
+                        print(f"Stage '{name}' failed: {error}")
+                        continue
+                    digest = fingerprint(stage)
+                    if is_up_to_date(name, digest):
+                        results[name] = {'status': 'skipped', 'seconds': 0.0, 'error': None}
+                        print(f"Stage '{name}' is up to date")
+                    else:
+                        print(f"Starting stage '{name}' ({stage['action']})")
+                        running[executor.submit(timed_run, name, stage)] = name
+                        state[name] = {'fingerprint': digest, 'status': 'running'}
+            if not running:
+                continue
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                ran.add(name)
+                try:
+                    results[name] = {'status': 'done', 'seconds': future.result(), 'error': None}
+                    print(f"Stage '{name}' done in {results[name]['seconds']:.1f}s")
+                except Exception as error:  # pylint: disable=broad-except
+                    results[name] = {'status': 'failed', 'seconds': 0.0, 'error': f"{type(error).__name__}: {error}"}
+                    print(f"Stage '{name}' failed: {results[name]['error']}")
+                state[name]['status'] = results[name]['status']
+                state[name]['finished'] = time.time()
+                _save_state(state, state_path)
+
+    print(f"{'stage':24}{'action':24}{'status':>9}{'seconds':>10}")
+    for name, result in results.items():
+        print(f"{name:24}{stages[name]['action']:24}{result['status']:>9}{result['seconds']:10.1f}")
+    return results
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a pipeline file without the interactive menu.")
+    parser.add_argument('pipeline', help="json pipeline file")
+    parser.add_argument('--max-workers', type=int, default=None, help="stages running at the same time")
+    parser.add_argument('--force', action='store_true', help="run every stage even if it is up to date")
+    parser.add_argument('--dry-run', action='store_true', help="only print the stages that would run")
+    args = parser.parse_args()
+    pipeline_results = run_pipeline(args.pipeline, args.max_workers, args.force, args.dry_run)
+    if any(result['status'] in ('failed', 'blocked') for result in pipeline_results.values()):
+        raise SystemExit(1)
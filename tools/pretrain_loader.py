@@ -6,11 +6,19 @@ be used within our code but do not fit in any other module.
 :date: 31/04/2023
 """
 
+import glob
 import os
+import random
 import subprocess
 import shutil
-from dataset_storage import ROOT_DIR, READY_DIR, train_val_test_split
+from dataset_manifest import (MANIFEST_PATH, delete_manifest, is_up_to_date, load_manifest,
+                              remove_outputs, save_manifest, scan_sources)
+from dataset_storage import (ROOT_DIR, READY_DIR, DATA_DIR, DATASET1_NAME, assign_split, copy_file,
+                             copy_many, train_val_test_split)
+from image_resampler import prepare_triplet, run_in_pool, triplet_paths
 from models_storage import LIIF_DIR, SR3_DIR
+from shard_storage import export_shards
+from tracing import span, traced
 
 ###############################################################################
 #                                                                             #
@@ -18,14 +26,16 @@ from models_storage import LIIF_DIR, SR3_DIR
 #                                                                             #
 ###############################################################################
 
+SIZES = (64, 256)
 DATASET_OUTPUT = os.path.join(ROOT_DIR, 'models', 'Image-Super-Resolution-via-Iterative-Refinement',
                       'dataset')
 SCRIPT = os.path.join(ROOT_DIR, 'models', 'Image-Super-Resolution-via-Iterative-Refinement',
                       'data', 'prepare_data.py')
-PARAMETERS = ['--path', READY_DIR, '--out', DATASET_OUTPUT, '--size', '64,256']
+PARAMETERS = ['--path', READY_DIR, '--out', DATASET_OUTPUT, '--size', ','.join(str(size) for size in SIZES)]
 
 LIIF_DATA_DIR = os.path.join(LIIF_DIR, 'load')
 SR3_DATA_DIR = os.path.join(SR3_DIR, 'dataset')
+SPLITS = ('train', 'val', 'test')
 
 ###############################################################################
 #                                                                             #
@@ -35,23 +45,284 @@ SR3_DATA_DIR = os.path.join(SR3_DIR, 'dataset')
 
 def call_prepare_data(script_path:str, parameters:list) -> None:
     cmd = ['python', script_path] + parameters
-    subprocess.run(cmd)
+    with span(os.path.basename(script_path), category='subprocess', cmd=' '.join(cmd)):
+        subprocess.run(cmd, check=True)
 
 
-def pretrain_load(train_percent=.6, val_percent=.2, seed: int = -1) -> None:
-    train_val_test_split(train_percent=train_percent, val_percent=val_percent, seed=seed)
-    for elem in ('train', 'val', 'test'):
-        custom_parameters = PARAMETERS.copy()
-        custom_parameters[1] = os.path.join(PARAMETERS[1], elem)
-        custom_parameters[3] = os.path.join(PARAMETERS[3], elem)
-        print(custom_parameters)
-        call_prepare_data(SCRIPT, custom_parameters)
+def remove_path(path: str) -> None:
+    """This function removes a file, a directory or a link to a directory
+    without following the link.
+
+    Args:
+        path (str): path to remove
+    """
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
 
+@traced()
+def expose_to_liif(mode: str = 'symlink') -> None:
+    """This function makes every prepared split of the SR3 dataset folder visible
+    under the LIIF 'load' folder without copying the images. A symlink to the split
+    folder is used when possible and a tree of hardlinks otherwise.
+
+    Args:
+        mode (str, optional): 'symlink', 'hardlink' or 'copy'. Defaults to 'symlink'.
+    """
     os.makedirs(LIIF_DATA_DIR, exist_ok=True)
     for elem in os.listdir(SR3_DATA_DIR):
-        if "64_256" in elem:
-            shutil.copytree(os.path.join(SR3_DATA_DIR, elem),
-                            os.path.join(LIIF_DATA_DIR, elem), dirs_exist_ok=True)
+        source = os.path.join(SR3_DATA_DIR, elem)
+        destination = os.path.join(LIIF_DATA_DIR, elem)
+        if f"{SIZES[0]}_{SIZES[1]}" not in elem or not os.path.isdir(source):
+            continue
+        if (mode == 'symlink' and os.path.islink(destination)
+                and os.path.realpath(destination) == os.path.realpath(source)):
+            continue
+        remove_path(destination)
+
+        if mode == 'symlink':
+            try:
+                os.symlink(source, destination, target_is_directory=True)
+                continue
+            except OSError:
+                print(f"'{destination}' could not be created as a symlink, hardlinks will be used")
+        pairs = []
+        for current_path, _, files in os.walk(source):
+            target_dir = os.path.join(destination, os.path.relpath(current_path, source))
+            os.makedirs(target_dir, exist_ok=True)
+            pairs.extend((os.path.join(current_path, name), os.path.join(target_dir, name)) for name in files)
+        copy_many(pairs, mode='copy' if mode == 'copy' else 'hardlink')
+
+
+@traced()
+def prepare_splits(workers: int = None) -> dict:
+    """This function builds the LR/HR/SR triplets of the three splits of READY_DIR
+    at the same time on a single pool of processes, writing the same files the SR3
+    'prepare_data.py' script writes.
+
+    Args:
+        workers (int, optional): number of processes. Defaults to every core.
+
+    Returns:
+        dict: {split: {'total': number of images, 'failed': list of (path, error)}}
+    """
+    tasks = []
+    summary = {}
+    for split in SPLITS:
+        output_dir = os.path.join(SR3_DATA_DIR, split_dir_name(split))
+        remove_path(output_dir)
+        images = sorted(glob.glob(os.path.join(READY_DIR, split, '*')))
+        tasks.extend((image, output_dir, SIZES) for image in images)
+        summary[split] = {'total': len(images), 'failed': []}
+
+    failures = run_in_pool(prepare_triplet, tasks, workers=workers, description="Preparing splits")
+    for path, error in failures:
+        split = os.path.basename(os.path.dirname(path))
+        summary[split]['failed'].append((path, error))
+    return summary
+
+
+@traced()
+def pretrain_load(train_percent=.6, val_percent=.2, seed: int = -1, native: bool = True,
+                  workers: int = None, liif_mode: str = 'symlink') -> dict:
+    """This function rebuilds the whole prepared dataset: the train/val/test split,
+    the LR/HR/SR triplets of every split and their LIIF 'load' folders.
+
+    Args:
+        train_percent (float, optional): percentage of the images set to train group. Defaults to .6.
+        val_percent (float, optional): percentage of the images set to val group. Defaults to .2.
+        seed (int, optional): seed used to replicate the same subdivision. Defaults to -1.
+        native (bool, optional): build the triplets in process instead of running
+        'prepare_data.py' once per split. Defaults to True.
+        workers (int, optional): number of processes used by the native mode. Defaults to every core.
+        liif_mode (str, optional): how the splits are exposed to LIIF ('symlink', 'hardlink' or 'copy'). Defaults to 'symlink'.
+
+    Returns:
+        dict: {split: {'total': number of images, 'failed': list of (path, error)}}
+    """
+    # A full rebuild uses the random split, so the previous manifest is not valid anymore
+    delete_manifest()
+    train_val_test_split(train_percent=train_percent, val_percent=val_percent, seed=seed)
+    if native:
+        summary = prepare_splits(workers)
+    else:
+        summary = {}
+        for elem in SPLITS:
+            custom_parameters = PARAMETERS.copy()
+            custom_parameters[1] = os.path.join(PARAMETERS[1], elem)
+            custom_parameters[3] = os.path.join(PARAMETERS[3], elem)
+            print(custom_parameters)
+            summary[elem] = {'total': len(os.listdir(custom_parameters[1])), 'failed': []}
+            try:
+                call_prepare_data(SCRIPT, custom_parameters)
+            except subprocess.CalledProcessError as error:
+                summary[elem]['failed'].append((SCRIPT, f"exit status {error.returncode}"))
+
+    expose_to_liif(liif_mode)
+
+    for split, result in summary.items():
+        print(f"{split}: {result['total'] - len(result['failed'])}/{result['total']} prepared, "
+              f"{len(result['failed'])} failed")
+    return summary
+
+
+def split_dir_name(split: str) -> str:
+    """This function returns the name 'prepare_data.py' gives to the output
+    directory of a split, e.g. 'train_64_256'.
+
+    Args:
+        split (str): 'train', 'val' or 'test'
+
+    Returns:
+        str: name of the split output directory
+    """
+    return f"{split}_{SIZES[0]}_{SIZES[1]}"
+
+
+def expected_outputs(rel_path: str, split: str) -> list:
+    """This function lists every file generated from a source image: its copy in
+    READY_DIR and the SR3 triplet (LIIF sees the triplet through expose_to_liif).
+
+    Args:
+        rel_path (str): path of the image relative to the source directory
+        split (str): split the image is assigned to
+
+    Returns:
+        list: paths of the generated files
+    """
+    ready_path = os.path.join(READY_DIR, split, os.path.basename(rel_path))
+    sr3_paths = triplet_paths(rel_path, os.path.join(SR3_DATA_DIR, split_dir_name(split)), SIZES)
+    return [ready_path, *sr3_paths]
+
+
+def prepare_image(source: str, split: str) -> None:
+    """This function generates every output of a single source image, the same ones
+    pretrain_load generates for the whole dataset.
+
+    Args:
+        source (str): path to the source image
+        split (str): split the image is assigned to
+    """
+    ready_path = os.path.join(READY_DIR, split, os.path.basename(source))
+    os.makedirs(os.path.dirname(ready_path), exist_ok=True)
+    copy_file(source, ready_path)
+
+    prepare_triplet(source, os.path.join(SR3_DATA_DIR, split_dir_name(split)), SIZES)
+
+
+def clean_prepared_data() -> None:
+    """This function removes every prepared split, used when there is no
+    manifest telling which of the existing files are still valid.
+    """
+    split_dirs = [os.path.join(READY_DIR, split) for split in SPLITS]
+    for data_dir in (SR3_DATA_DIR, LIIF_DATA_DIR):
+        split_dirs.extend(os.path.join(data_dir, split_dir_name(split)) for split in SPLITS)
+    for split_dir in split_dirs:
+        if os.path.lexists(split_dir):
+            print(f"Removing previous content of {split_dir}")
+            remove_path(split_dir)
+
+
+@traced()
+def update_pretrain_load(train_percent=.6, val_percent=.2, seed: int = -1,
+                         data_dir: str = os.path.join(DATA_DIR, DATASET1_NAME, 'Images'),
+                         manifest_path: str = MANIFEST_PATH, workers: int = None,
+                         liif_mode: str = 'symlink') -> dict:
+    """This function prepares the data the same way pretrain_load does, but only for
+    the images that were added, modified or moved to another split since the last run,
+    and removes the outputs of the images that are not part of the dataset anymore.
+    What was done in every run is recorded in a manifest.
+
+    The images are assigned to a split from the hash of their content, so adding new
+    images never moves the existing ones. A seed of -1 reuses the seed of the previous
+    run (or draws a new one the first time).
+
+    Args:
+        train_percent (float, optional): percentage of the images set to train group. Defaults to .6.
+        val_percent (float, optional): percentage of the images set to val group. Defaults to .2.
+        seed (int, optional): seed used to assign the splits. Defaults to -1.
+        data_dir (str, optional): directory containing the source images.
+        manifest_path (str, optional): path to the manifest file. Defaults to MANIFEST_PATH.
+        workers (int, optional): number of processes preparing images. Defaults to every core.
+        liif_mode (str, optional): how the splits are exposed to LIIF ('symlink', 'hardlink' or 'copy'). Defaults to 'symlink'.
+
+    Returns:
+        dict: number of 'processed', 'unchanged', 'removed' and 'failed' images
+    """
+    manifest = load_manifest(manifest_path)
+    previous_params = manifest['params']
+    previous_images = manifest['images']
+
+    if seed == -1:
+        seed = previous_params.get('seed', random.randrange(2 ** 31))
+    params = {'seed': seed, 'train_percent': train_percent, 'val_percent': val_percent,
+              'sizes': list(SIZES)}
+    print(f"The data splitting process will be using the seed={seed}")
+
+    if not previous_images:
+        clean_prepared_data()
+    # Outputs of a different size can not be reused, but their hashes can
+    reusable_images = previous_images if previous_params.get('sizes') == params['sizes'] else {}
+
+    with span('scan_sources') as current:
+        sources = scan_sources(data_dir, previous_images)
+        current.add(files=len(sources))
+    images = {}
+    tasks = []
+    for rel_path, source in sources.items():
+        split = assign_split(source['sha1'], train_percent, val_percent, seed)
+        entry = dict(source, split=split, outputs=expected_outputs(rel_path, split))
+        images[rel_path] = entry
+        if not is_up_to_date(reusable_images.get(rel_path), entry):
+            tasks.append((os.path.join(data_dir, rel_path), split))
+
+    # Outputs generated before that no current image is going to produce
+    current_outputs = {path for entry in images.values() for path in entry['outputs']}
+    stale_outputs = [path for entry in previous_images.values() for path in entry.get('outputs', [])
+                     if path not in current_outputs]
+    with span('remove_stale_outputs', files=len(stale_outputs)):
+        removed = remove_outputs(stale_outputs)
+
+    print(f"{len(tasks)} images to prepare, {len(sources) - len(tasks)} unchanged, "
+          f"{removed} stale files removed")
+    failures = run_in_pool(prepare_image, tasks, workers=workers, description="Preparing images")
+
+    # Failed images are left out of the manifest so the next run retries them
+    failed = {os.path.relpath(path, data_dir) for path, _ in failures}
+    remove_outputs([path for rel_path in failed for path in images[rel_path]['outputs']])
+    manifest = {'version': manifest['version'], 'params': params,
+                'images': {rel_path: entry for rel_path, entry in images.items() if rel_path not in failed}}
+    with span('save_manifest', files=1):
+        save_manifest(manifest, manifest_path)
+    if os.path.isdir(SR3_DATA_DIR):
+        expose_to_liif(liif_mode)
+
+    return {'processed': len(tasks) - len(failed), 'unchanged': len(sources) - len(tasks),
+            'removed': removed, 'failed': len(failed)}
+
+@traced()
+def export_prepared_shards(liif_mode: str = 'symlink') -> list:
+    """This function packs every prepared split of the SR3 dataset folder into
+    shards and makes them available under the LIIF 'load' folder without copying
+    them, so the packed data is stored only once.
+
+    Args:
+        liif_mode (str, optional): how the shards are exposed to LIIF ('symlink', 'hardlink' or 'copy'). Defaults to 'symlink'.
+
+    Returns:
+        list: the SR3 shard directories that were written
+    """
+    shard_dirs = []
+    for split in SPLITS:
+        split_dir = os.path.join(SR3_DATA_DIR, split_dir_name(split))
+        if not os.path.isdir(split_dir):
+            print(f"'{split_dir}' has not been prepared yet and will not be packed")
+            continue
+        shard_dirs.append(export_shards(split_dir))
+    expose_to_liif(liif_mode)
+    return shard_dirs
 
 ###############################################################################
 #                                                                             #
@@ -0,0 +1,251 @@
+"""
+This module contains the functionality to pack the prepared LR/HR/SR images
+of a split into a few fixed-stride uint8 shard files, and to read them back
+through numpy.memmap so accessing an image is a page read instead of opening
+and decoding a file.
+
+A packed split looks like:
+
+    train_64_256.shards/
+        index.json              names, shapes and shard files of every key
+        hr_256-00000.bin        images 0..shard_size-1 of hr_256, one after the other
+        lr_64-00000.bin
+        sr_64_256-00000.bin
+
+The module does not import anything else from this project, so it can be
+copied as it is into the LIIF 'datasets' package and the SR3 'data' package
+(see models_storage.copy_dataset_adapters), where it provides the dataset
+classes their configuration files can point at:
+
+    LIIF:   dataset: {name: shard-folder, args: {root_path: ./load/train_64_256.shards}}
+            dataset: {name: shard-paired-folders, args: {root_path: ./load/test_64_256.shards}}
+    SR3:    "dataroot": "dataset/train_64_256", "datatype": "shard"
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+try:
+    import torch
+    from torch.utils.data import Dataset
+except ImportError:
+    torch = None
+    Dataset = object
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+SHARD_VERSION = 1
+SHARD_SUFFIX = '.shards'
+INDEX_NAME = 'index.json'
+DEFAULT_KEYS = ('hr_256', 'lr_64', 'sr_64_256')
+DEFAULT_SHARD_SIZE = 1024
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def shard_dir_for(split_dir: str) -> str:
+    """This function returns the directory where a split is packed.
+
+    Args:
+        split_dir (str): prepared split directory, e.g. 'dataset/train_64_256'
+
+    Returns:
+        str: the shard directory, e.g. 'dataset/train_64_256.shards'
+    """
+    split_dir = split_dir.rstrip('/\\')
+    return split_dir if split_dir.endswith(SHARD_SUFFIX) else split_dir + SHARD_SUFFIX
+
+
+def export_shards(split_dir: str, output_dir: str = None, keys: tuple = DEFAULT_KEYS,
+                  shard_size: int = DEFAULT_SHARD_SIZE) -> str:
+    """This function packs the images of a prepared split (the 'hr_256', 'lr_64'
+    and 'sr_64_256' folders written by 'prepare_data.py') into shard files. Only the
+    images found in every key folder are packed, sorted by name.
+
+    Args:
+        split_dir (str): prepared split directory, e.g. 'dataset/train_64_256'
+        output_dir (str, optional): shard directory. Defaults to split_dir + '.shards'.
+        keys (tuple, optional): sub folders to pack. Defaults to DEFAULT_KEYS.
+        shard_size (int, optional): number of images per shard file. Defaults to DEFAULT_SHARD_SIZE.
+
+    Raises:
+        FileNotFoundError: raised if one of the key folders does not exist
+        ValueError: raised if the images of a key do not share the same shape
+
+    Returns:
+        str: the shard directory
+    """
+    output_dir = output_dir or shard_dir_for(split_dir)
+    stems = None
+    for key in keys:
+        key_dir = os.path.join(split_dir, key)
+        if not os.path.isdir(key_dir):
+            raise FileNotFoundError(f"The folder '{key}' could not be found in '{split_dir}'!!")
+        found = {os.path.splitext(name)[0]: name for name in os.listdir(key_dir)}
+        stems = found if stems is None else {stem: stems[stem] for stem in stems if stem in found}
+    names = sorted(stems)
+
+    os.makedirs(output_dir, exist_ok=True)
+    arrays = {}
+    for key in keys:
+        shape = None
+        shards = []
+        shard_file = None
+        try:
+            for position, stem in enumerate(names):
+                if position % shard_size == 0:
+                    if shard_file is not None:
+                        shard_file.close()
+                    shards.append(f"{key}-{len(shards):05d}.bin")
+                    # Written aside and renamed later, so mapped shards are never truncated
+                    shard_file = open(os.path.join(output_dir, shards[-1] + '.tmp'), 'wb')
+                with Image.open(os.path.join(split_dir, key, stems[stem])) as img:
+                    pixels = np.asarray(img.convert('RGB'), dtype=np.uint8)
+                if shape is None:
+                    shape = pixels.shape
+                elif pixels.shape != shape:
+                    raise ValueError(f"'{stem}' in '{key}' has shape {pixels.shape} instead of {shape}")
+                shard_file.write(pixels.tobytes())
+        finally:
+            if shard_file is not None:
+                shard_file.close()
+        arrays[key] = {'shape': list(shape or ()), 'dtype': 'uint8', 'shard_size': shard_size,
+                       'shards': shards}
+
+    for array in arrays.values():
+        for shard in array['shards']:
+            os.replace(os.path.join(output_dir, shard + '.tmp'), os.path.join(output_dir, shard))
+
+    # The index is written last, so a half exported split is never readable
+    index = {'version': SHARD_VERSION, 'names': names, 'arrays': arrays}
+    tmp_path = os.path.join(output_dir, INDEX_NAME + '.tmp')
+    with open(tmp_path, 'w') as index_file:
+        json.dump(index, index_file)
+    os.replace(tmp_path, os.path.join(output_dir, INDEX_NAME))
+
+    # Shards of a previous, bigger export are not referenced anymore
+    current = {shard for array in arrays.values() for shard in array['shards']}
+    for name in os.listdir(output_dir):
+        if name.endswith('.bin') and name not in current:
+            os.remove(os.path.join(output_dir, name))
+    print(f"{len(names)} images of '{split_dir}' packed into '{output_dir}'")
+    return output_dir
+
+
+class ShardArray:
+    """Read only, random access view of one key of a shard directory. The shard
+    files are mapped on first access, so instances can be sent to DataLoader worker
+    processes and every worker maps the same pages of the page cache.
+    """
+
+    def __init__(self, shard_dir: str, key: str):
+        shard_dir = shard_dir_for(shard_dir)
+        index_path = os.path.join(shard_dir, INDEX_NAME)
+        if not os.path.isfile(index_path):
+            raise FileNotFoundError(f"The shard index '{index_path}' could not be found!!")
+        with open(index_path, 'r') as index_file:
+            index = json.load(index_file)
+        if key not in index['arrays']:
+            raise KeyError(f"'{key}' is not packed in '{shard_dir}', found {list(index['arrays'])}")
+
+        self.shard_dir = shard_dir
+        self.key = key
+        self.names = index['names']
+        self.shape = tuple(index['arrays'][key]['shape'])
+        self.shard_size = index['arrays'][key]['shard_size']
+        self.shards = index['arrays'][key]['shards']
+        self._maps = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_maps'] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, position: int) -> np.ndarray:
+        """Returns the image in the given position as an (h, w, c) uint8 array
+        backed by the mapped shard, without copying it.
+        """
+        if self._maps is None:
+            self._maps = [np.memmap(os.path.join(self.shard_dir, shard), dtype=np.uint8, mode='r')
+                          .reshape((-1,) + self.shape) for shard in self.shards]
+        return self._maps[position // self.shard_size][position % self.shard_size]
+
+
+def _to_tensor(pixels: np.ndarray) -> 'torch.Tensor':
+    """This function converts an (h, w, c) uint8 array into a (c, h, w) float
+    tensor in [0, 1], as torchvision's ToTensor does.
+    """
+    return torch.from_numpy(np.ascontiguousarray(pixels.transpose(2, 0, 1))).float().div_(255)
+
+
+class ShardImageFolder(Dataset):
+    """Packed replacement for the LIIF 'image-folder' dataset."""
+
+    def __init__(self, root_path: str, key: str = 'hr_256', repeat: int = 1, cache: str = 'none', **kwargs):
+        self.images = ShardArray(root_path, key)
+        self.repeat = repeat
+
+    def __len__(self) -> int:
+        return len(self.images) * self.repeat
+
+    def __getitem__(self, idx: int):
+        return _to_tensor(self.images[idx % len(self.images)])
+
+
+class ShardPairedFolders(Dataset):
+    """Packed replacement for the LIIF 'paired-image-folders' dataset."""
+
+    def __init__(self, root_path: str, key_1: str = 'lr_64', key_2: str = 'hr_256', **kwargs):
+        self.dataset_1 = ShardImageFolder(root_path, key_1, **kwargs)
+        self.dataset_2 = ShardImageFolder(root_path, key_2, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.dataset_1)
+
+    def __getitem__(self, idx: int):
+        return self.dataset_1[idx], self.dataset_2[idx]
+
+
+class ShardLRHRDataset(Dataset):
+    """Packed replacement for the SR3 'LRHRDataset' with datatype 'img'."""
+
+    def __init__(self, dataroot: str, datatype: str = 'shard', l_resolution: int = 64, r_resolution: int = 256,
+                 split: str = 'train', data_len: int = -1, need_LR: bool = False):
+        self.split = split
+        self.need_LR = need_LR
+        self.hr = ShardArray(dataroot, f"hr_{r_resolution}")
+        self.sr = ShardArray(dataroot, f"sr_{l_resolution}_{r_resolution}")
+        self.lr = ShardArray(dataroot, f"lr_{l_resolution}") if need_LR else None
+        self.data_len = len(self.hr) if data_len <= 0 else min(data_len, len(self.hr))
+
+    def __len__(self) -> int:
+        return self.data_len
+
+    def __getitem__(self, index: int) -> dict:
+        arrays = [self.lr[index]] if self.need_LR else []
+        images = [_to_tensor(pixels) for pixels in arrays + [self.sr[index], self.hr[index]]]
+        # Same augmentation and [-1, 1] range as SR3's Util.transform_augment
+        if self.split == 'train' and torch.rand(1).item() < 0.5:
+            images = [torch.flip(img, dims=[2]) for img in images]
+        images = [img * 2 - 1 for img in images]
+        result = {'SR': images[-2], 'HR': images[-1], 'Index': index}
+        if self.need_LR:
+            result['LR'] = images[0]
+        return result
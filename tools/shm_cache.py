@@ -0,0 +1,585 @@
+"""
+This module contains a cache of decoded images in shared memory, so the HR/LR
+images of a split are decoded once and then read by every DataLoader worker of
+every model, instead of being decoded every epoch or cached once per worker and
+per dataset copy.
+
+The images are stored in arenas, one file per image size under /dev/shm, holding
+fixed size uint8 slots:
+
+    /dev/shm/sr_cache_256x256x3.arena
+        header          magic, version, slot size, number of slots, reserved slots, counters
+        slot table      key (hash of the real path and stat of the image), sequence number,
+                        last use and shape of every slot
+        slots           the decoded pixels
+
+Every process maps the same pages, so the memory is used once whatever the number
+of workers. Readers do not take locks: a slot is read between two reads of its
+sequence number, which writers make odd while they fill it (a seqlock), and the
+read is discarded if it changed. Writers take a file lock.
+
+The size cap is shared by all the arenas, header and slot table included. Their slots
+are reserved with fallocate in chunks as they are needed, so a full /dev/shm is seen
+when reserving instead of as a SIGBUS when a slot is written. An arena may use the
+memory the others do not need, but every image size is entitled to an equal share of
+the cap: an arena under its share takes memory back from the arenas over theirs,
+which release their last reserved slots and punch them out of the file. When an
+arena can not reserve more slots the least recently used one is evicted, so corpora
+bigger than the size cap still work, with a lower hit rate.
+
+Like shard_storage, it does not import anything else from this project, so it is
+copied into the LIIF 'datasets' package and the SR3 'data' package (see
+models_storage.copy_dataset_adapters), where it provides:
+
+    LIIF:   dataset: {name: shm-folder, args: {root_path: ./load/train_64_256/hr_256, capacity_gb: 8}}
+            dataset: {name: shm-paired-folders, args: {root_path_1: ./load/val_64_256/lr_64, root_path_2: ...}}
+    SR3:    "dataroot": "dataset/train_64_256", "datatype": "shm"
+
+The LIIF folders are symlinks to the SR3 dataset (see pretrain_loader.expose_to_liif)
+and the keys use the real paths, so both models share the same cached images.
+Regenerating a split changes the size, modification time or inode of the files,
+so the images cached for the old ones are not returned.
+
+    python tools/shm_cache.py stats
+    python tools/shm_cache.py clear
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import argparse
+import contextlib
+import ctypes
+import fcntl
+import glob
+import errno
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+try:
+    import torch
+    from torch.utils.data import Dataset
+except ImportError:
+    torch = None
+    Dataset = object
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+ARENA_PREFIX = 'sr_cache'
+ARENA_SUFFIX = '.arena'
+ARENA_MAGIC = 0x5352434143484531
+ARENA_VERSION = 2
+# Size cap of all the arenas together, the files only take memory as slots are reserved
+DEFAULT_CAPACITY_GB = 4.0
+# Part of the free space of SHM_DIR an arena may take at most
+MAX_SHM_FRACTION = 0.8
+# Memory reserved at once when an arena runs out of reserved slots
+RESERVE_CHUNK_BYTES = 64 * 2 ** 20
+
+HEADER_DTYPE = np.dtype([('magic', '<u8'), ('version', '<u8'), ('slot_bytes', '<u8'), ('slots', '<u8'),
+                         ('hits', '<u8'), ('misses', '<u8'), ('evictions', '<u8'), ('reserved', '<u8')])
+SLOT_DTYPE = np.dtype([('key', '<i8'), ('seq', '<u8'), ('used', '<i8'), ('shape', '<i4', (3,)), ('pad', '<i4')])
+# Slots start on a page boundary, so releasing one frees whole pages
+PAGE_SIZE = 4096
+# Attempts of a reader before considering a slot that keeps changing a miss
+READ_ATTEMPTS = 3
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+# fallocate mode freeing the pages of a part of a file without changing its size
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def image_key(path: str) -> int:
+    """This function returns the cache key of an image file: a non zero 63 bit hash
+    of its real path, size, modification time and inode, so a symlink and its target
+    share the key and a regenerated image does not get the pixels cached for the old
+    file, which outlive the process in SHM_DIR."""
+    real_path = os.path.realpath(path)
+    stat = os.stat(real_path)
+    identity = f"{real_path}\0{stat.st_size}\0{stat.st_mtime_ns}\0{stat.st_ino}"
+    digest = hashlib.blake2b(identity.encode(), digest_size=8).digest()
+    return (int.from_bytes(digest, 'little') & 0x7FFFFFFFFFFFFFFF) or 1
+
+
+def _data_offset(slots: int) -> int:
+    table_end = HEADER_DTYPE.itemsize + slots * SLOT_DTYPE.itemsize
+    return -(-table_end // PAGE_SIZE) * PAGE_SIZE
+
+
+def _slot_stride(slot_bytes: int) -> int:
+    """This function returns the distance between two slots, a whole number of pages."""
+    return -(-slot_bytes // PAGE_SIZE) * PAGE_SIZE
+
+
+def _allocate(fd: int, offset: int, length: int) -> None:
+    """This function allocates the pages of a part of a file, raising OSError (ENOSPC)
+    if there is no room for them."""
+    if hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(fd, offset, length)
+        return
+    zeros = bytes(min(length, 2 ** 20))
+    for position in range(offset, offset + length, len(zeros)):
+        os.pwrite(fd, zeros[:offset + length - position], position)
+
+
+def _punch_hole(fd: int, offset: int, length: int) -> bool:
+    """This function frees the pages of a part of a file, keeping its size.
+
+    Returns:
+        bool: False if the system can not punch holes in the file
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fallocate = libc.fallocate
+    except (OSError, AttributeError):
+        return False
+    fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+    return fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) == 0
+
+
+def _arena_sizes(directory: str, prefix: str) -> dict:
+    """This function returns the memory taken by every arena of a prefix in a directory."""
+    sizes = {}
+    for path in glob.glob(os.path.join(directory, f"{prefix}_*{ARENA_SUFFIX}")):
+        with contextlib.suppress(FileNotFoundError):
+            sizes[path] = os.stat(path).st_blocks * 512
+    return sizes
+
+
+def _release_slots(path: str, max_bytes: int) -> int:
+    """This function makes an arena give back the pages of its last reserved slots,
+    at least max_bytes of them if it has enough. The cached images in those slots are
+    evicted. The writers lock of the arena is only tried, an arena busy writing is left
+    alone. Called with the lock of the prefix held.
+
+    Args:
+        path (str): path of the arena file
+        max_bytes (int): memory wanted back
+
+    Returns:
+        int: memory freed in bytes
+    """
+    with open(f"{path}.lock", 'a') as lock_file, open(path, 'r+b') as arena_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0
+        header = np.memmap(arena_file, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+        if header['magic'][0] != ARENA_MAGIC or header['version'][0] != ARENA_VERSION:
+            return 0
+        slots, reserved = int(header['slots'][0]), int(header['reserved'][0])
+        stride = _slot_stride(int(header['slot_bytes'][0]))
+        count = min(reserved, -(-max_bytes // stride))
+        if count <= 0:
+            return 0
+        table = np.memmap(arena_file, dtype=SLOT_DTYPE, mode='r+', offset=HEADER_DTYPE.itemsize, shape=(slots,))
+        released = slice(reserved - count, reserved)
+        before = os.fstat(arena_file.fileno()).st_blocks * 512
+        # Readers of the released slots see them change and their keys disappear
+        table['seq'][released] += 1
+        evicted = int(np.count_nonzero(table['key'][released]))
+        table['key'][released] = 0
+        punched = _punch_hole(arena_file.fileno(), _data_offset(slots) + (reserved - count) * stride,
+                              count * stride)
+        table['seq'][released] += 1
+        header['evictions'] += evicted
+        if not punched:
+            return 0
+        header['reserved'] = reserved - count
+        return max(before - os.fstat(arena_file.fileno()).st_blocks * 512, 0)
+
+
+def _reclaim(sizes: dict, share: int, needed: int, exclude: str) -> int:
+    """This function takes memory back from the arenas using more than their share of
+    the cap, the ones furthest over it first.
+
+    Args:
+        sizes (dict): memory taken by every arena, see _arena_sizes
+        share (int): share of the cap of every arena
+        needed (int): memory wanted back
+        exclude (str): path of the arena asking for the memory
+
+    Returns:
+        int: memory freed in bytes
+    """
+    freed = 0
+    for path, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        if freed >= needed or size <= share:
+            break
+        if path != exclude:
+            with contextlib.suppress(FileNotFoundError):
+                freed += _release_slots(path, min(size - share, needed - freed))
+    return freed
+
+
+class ShmArena:
+    """Shared memory arena of fixed size slots. The file is mapped lazily in every
+    process, so instances can be sent to DataLoader worker processes. The capacity is
+    shared with the other arenas of the same prefix in the directory."""
+
+    def __init__(self, path: str, slot_bytes: int, capacity_bytes: int, prefix: str = ARENA_PREFIX):
+        self.path = path
+        self.slot_bytes = slot_bytes
+        self.slot_stride = _slot_stride(slot_bytes)
+        self.capacity_bytes = capacity_bytes
+        self.prefix = prefix
+        self._pid = None
+
+    def __getstate__(self) -> dict:
+        return {'path': self.path, 'slot_bytes': self.slot_bytes, 'slot_stride': self.slot_stride,
+                'capacity_bytes': self.capacity_bytes, 'prefix': self.prefix, '_pid': None}
+
+    @property
+    def budget_lock_path(self) -> str:
+        """Lock held while the arenas of the prefix reserve memory."""
+        return os.path.join(os.path.dirname(self.path), f"{self.prefix}.lock")
+
+    @contextlib.contextmanager
+    def budget_locked(self):
+        """Holds the lock of the memory shared by the arenas of the prefix."""
+        with open(self.budget_lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _create(self) -> None:
+        """Creates the arena file, with room for the slots the whole cap could hold. Only
+        the header and slot table are allocated, the slots are reserved by _reserve. Called
+        with the lock of the prefix held.
+
+        Raises:
+            OSError: raised (ENOSPC) if the header and slot table do not fit under the cap
+        """
+        free = os.statvfs(os.path.dirname(self.path))
+        capacity = min(self.capacity_bytes, int((free.f_bavail * free.f_frsize) * MAX_SHM_FRACTION))
+        slots = max(capacity // self.slot_stride, 1)
+        sizes = _arena_sizes(os.path.dirname(self.path), self.prefix)
+        left = self.capacity_bytes - sum(sizes.values())
+        if left < _data_offset(slots):
+            left += _reclaim(sizes, self.capacity_bytes // (len(sizes) + 1), _data_offset(slots) - left, self.path)
+        if left < _data_offset(slots):
+            raise OSError(errno.ENOSPC, f"The slot table of '{self.path}' does not fit in the cache", self.path)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as arena_file:
+                arena_file.truncate(_data_offset(slots) + slots * self.slot_stride)
+                _allocate(arena_file.fileno(), 0, _data_offset(slots))
+            header = np.memmap(tmp_path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+            header[0] = (ARENA_MAGIC, ARENA_VERSION, self.slot_bytes, slots, 0, 0, 0, 0)
+            header.flush()
+            del header
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _reserve(self) -> bool:
+        """Allocates the next chunk of slots, as long as the memory of all the arenas of
+        the prefix stays under the cap and SHM_DIR has room for it. When the cap is
+        reached and this arena is under its share of it, the memory is taken back from
+        the arenas over theirs. Called with the writers lock held.
+
+        Returns:
+            bool: False if no slot could be reserved
+        """
+        reserved = int(self.header['reserved'][0])
+        wanted = min(max(RESERVE_CHUNK_BYTES // self.slot_stride, 1), len(self.keys) - reserved)
+        if wanted <= 0:
+            return False
+        with self.budget_locked():
+            sizes = _arena_sizes(os.path.dirname(self.path), self.prefix)
+            left = self.capacity_bytes - sum(sizes.values())
+            share = self.capacity_bytes // max(len(sizes), 1)
+            own = sizes.get(self.path, 0)
+            # Memory is taken back one slot at a time, evicting as few images of the others as possible
+            if left < self.slot_stride and own + self.slot_stride <= share:
+                left += _reclaim(sizes, share, self.slot_stride - left, self.path)
+            count = min(wanted, left // self.slot_stride)
+            if count <= 0:
+                return False
+            try:
+                with open(self.path, 'r+b') as arena_file:
+                    _allocate(arena_file.fileno(), _data_offset(len(self.keys)) + reserved * self.slot_stride,
+                              count * self.slot_stride)
+            except OSError as error:
+                if error.errno != errno.ENOSPC:
+                    raise
+                return False
+        self.header['reserved'] = reserved + count
+        return True
+
+    def _open(self) -> None:
+        """Maps the arena in this process, creating it if it does not exist yet."""
+        if self._pid == os.getpid():
+            return
+        # The lock is taken on a descriptor of this process, an inherited one would be shared
+        self._lock_file = open(f"{self.path}.lock", 'a')
+        if not os.path.isfile(self.path):
+            with self.budget_locked():
+                if not os.path.isfile(self.path):
+                    self._create()
+        self.header = np.memmap(self.path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+        if self.header['magic'][0] != ARENA_MAGIC or self.header['version'][0] != ARENA_VERSION \
+                or self.header['slot_bytes'][0] != self.slot_bytes:
+            raise ValueError(f"'{self.path}' is not an arena of {self.slot_bytes} bytes slots, clear the cache")
+        slots = int(self.header['slots'][0])
+        self.table = np.memmap(self.path, dtype=SLOT_DTYPE, mode='r+', offset=HEADER_DTYPE.itemsize,
+                               shape=(slots,))
+        self.data = np.memmap(self.path, dtype=np.uint8, mode='r+', offset=_data_offset(slots),
+                              shape=(slots, self.slot_stride))
+        self.keys, self.seqs, self.used, self.shapes = (self.table['key'], self.table['seq'], self.table['used'],
+                                                        self.table['shape'])
+        self._pid = os.getpid()
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Holds the writers lock of the arena."""
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def get(self, key: int) -> np.ndarray:
+        """Returns a copy of the image stored with the given key, None if it is not cached."""
+        self._open()
+        for _ in range(READ_ATTEMPTS):
+            found = np.flatnonzero(self.keys == key)
+            if not found.size:
+                break
+            slot = found[0]
+            before = int(self.seqs[slot])
+            if before % 2:
+                continue
+            shape = tuple(int(side) for side in self.shapes[slot])
+            pixels = np.array(self.data[slot, :int(np.prod(shape))]).reshape(shape)
+            if int(self.seqs[slot]) == before and self.keys[slot] == key:
+                self.used[slot] = time.monotonic_ns()
+                self.header['hits'] += 1
+                return pixels
+        self.header['misses'] += 1
+        return None
+
+    def put(self, key: int, pixels: np.ndarray) -> bool:
+        """Stores an image in a reserved slot, reserving more slots if all of them are
+        taken and evicting the least recently used one if no more can be reserved.
+
+        Returns:
+            bool: False if the image does not fit in a slot or no slot could be reserved
+        """
+        if pixels.nbytes > self.slot_bytes:
+            return False
+        self._open()
+        with self.locked():
+            if np.flatnonzero(self.keys == key).size:
+                return True
+            # Only the reserved slots are written, the pages of the others may not exist
+            reserved = int(self.header['reserved'][0])
+            empty = np.flatnonzero(self.keys[:reserved] == 0)
+            if not empty.size and self._reserve():
+                empty = np.array([reserved])
+            if empty.size:
+                slot = empty[0]
+            elif reserved:
+                slot = int(np.argmin(self.used[:reserved]))
+                self.header['evictions'] += 1
+            else:
+                return False
+            self.seqs[slot] += 1
+            self.keys[slot] = 0
+            self.data[slot, :pixels.nbytes] = np.ascontiguousarray(pixels, dtype=np.uint8).reshape(-1)
+            self.shapes[slot] = pixels.shape if pixels.ndim == 3 else pixels.shape + (1,)
+            self.used[slot] = time.monotonic_ns()
+            self.keys[slot] = key
+            self.seqs[slot] += 1
+        return True
+
+    def stats(self) -> dict:
+        self._open()
+        return {'path': self.path, 'slots': int(self.header['slots'][0]),
+                'reserved_slots': int(self.header['reserved'][0]), 'used_slots': int(np.count_nonzero(self.keys)), 'slot_bytes': self.slot_bytes,
+                'allocated_bytes': os.stat(self.path).st_blocks * 512,
+                'hits': int(self.header['hits'][0]), 'misses': int(self.header['misses'][0]),
+                'evictions': int(self.header['evictions'][0])}
+
+
+class SharedImageCache:
+    """Decodes images through the arenas of SHM_DIR, one per image size, which share
+    capacity_gb of memory."""
+
+    def __init__(self, capacity_gb: float = DEFAULT_CAPACITY_GB, prefix: str = ARENA_PREFIX,
+                 directory: str = SHM_DIR):
+        self.capacity_bytes = int(capacity_gb * 2 ** 30)
+        self.prefix = prefix
+        self.directory = directory
+        self.arenas = {}
+
+    def arena_for(self, shape: tuple) -> ShmArena:
+        if shape not in self.arenas:
+            name = f"{self.prefix}_{'x'.join(str(side) for side in shape)}{ARENA_SUFFIX}"
+            self.arenas[shape] = ShmArena(os.path.join(self.directory, name), int(np.prod(shape)),
+                                          self.capacity_bytes, self.prefix)
+        return self.arenas[shape]
+
+    def _discover(self) -> None:
+        """Adds the arenas other processes created."""
+        for path in glob.glob(os.path.join(self.directory, f"{self.prefix}_*{ARENA_SUFFIX}")):
+            sides = os.path.basename(path)[len(self.prefix) + 1:-len(ARENA_SUFFIX)].split('x')
+            if all(side.isdigit() for side in sides):
+                self.arena_for(tuple(int(side) for side in sides))
+
+    def load(self, path: str) -> np.ndarray:
+        """Returns the (h, w, 3) uint8 pixels of an image, decoding it only if it is
+        not in the cache yet."""
+        key = image_key(path)
+        if not self.arenas:
+            self._discover()
+        for arena in self.arenas.values():
+            pixels = arena.get(key)
+            if pixels is not None:
+                return pixels
+        with Image.open(path) as img:
+            pixels = np.asarray(img.convert('RGB'))
+        try:
+            self.arena_for(pixels.shape).put(key, pixels)
+        except OSError as error:
+            # No room for a new arena in SHM_DIR, the image is used without caching it
+            if error.errno != errno.ENOSPC:
+                raise
+            del self.arenas[pixels.shape]
+        return pixels
+
+    def stats(self) -> list:
+        self._discover()
+        return [arena.stats() for arena in self.arenas.values()]
+
+    def clear(self) -> int:
+        """Removes the arena files and returns how many were removed."""
+        self._discover()
+        for arena in self.arenas.values():
+            if os.path.exists(arena.path):
+                os.remove(arena.path)
+        for path in glob.glob(os.path.join(self.directory, f"{self.prefix}*.lock")):
+            os.remove(path)
+        removed = len(self.arenas)
+        self.arenas = {}
+        return removed
+
+
+def list_images(folder: str) -> list:
+    """This function lists the images of a folder in the order the LIIF and SR3
+    folder datasets use (sorted names)."""
+    if not os.path.isdir(folder):
+        raise FileNotFoundError(f"The directory '{folder}' could not be found!!")
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+            if name.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def _to_tensor(pixels: np.ndarray) -> 'torch.Tensor':
+    """This function converts an (h, w, c) uint8 array into a (c, h, w) float tensor in [0, 1]."""
+    return torch.from_numpy(np.ascontiguousarray(pixels.transpose(2, 0, 1))).float().div_(255)
+
+
+class ShmImageFolder(Dataset):
+    """Shared memory cached replacement for the LIIF 'image-folder' dataset."""
+
+    def __init__(self, root_path: str, repeat: int = 1, cache: str = 'none', capacity_gb: float = DEFAULT_CAPACITY_GB,
+                 first_k: int = None, **kwargs):
+        self.files = list_images(root_path)[:first_k]
+        self.repeat = repeat
+        self.cache = SharedImageCache(capacity_gb)
+
+    def __len__(self) -> int:
+        return len(self.files) * self.repeat
+
+    def __getitem__(self, idx: int):
+        return _to_tensor(self.cache.load(self.files[idx % len(self.files)]))
+
+
+class ShmPairedFolders(Dataset):
+    """Shared memory cached replacement for the LIIF 'paired-image-folders' dataset."""
+
+    def __init__(self, root_path_1: str, root_path_2: str, **kwargs):
+        self.dataset_1 = ShmImageFolder(root_path_1, **kwargs)
+        self.dataset_2 = ShmImageFolder(root_path_2, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.dataset_1)
+
+    def __getitem__(self, idx: int):
+        return self.dataset_1[idx], self.dataset_2[idx]
+
+
+class ShmLRHRDataset(Dataset):
+    """Shared memory cached replacement for the SR3 'LRHRDataset' with datatype 'img'."""
+
+    def __init__(self, dataroot: str, datatype: str = 'shm', l_resolution: int = 64, r_resolution: int = 256,
+                 split: str = 'train', data_len: int = -1, need_LR: bool = False,
+                 capacity_gb: float = DEFAULT_CAPACITY_GB):
+        self.split = split
+        self.need_LR = need_LR
+        self.cache = SharedImageCache(capacity_gb)
+        self.hr = list_images(os.path.join(dataroot, f"hr_{r_resolution}"))
+        self.sr = list_images(os.path.join(dataroot, f"sr_{l_resolution}_{r_resolution}"))
+        self.lr = list_images(os.path.join(dataroot, f"lr_{l_resolution}")) if need_LR else None
+        self.data_len = len(self.hr) if data_len <= 0 else min(data_len, len(self.hr))
+
+    def __len__(self) -> int:
+        return self.data_len
+
+    def __getitem__(self, index: int) -> dict:
+        paths = ([self.lr[index]] if self.need_LR else []) + [self.sr[index], self.hr[index]]
+        images = [_to_tensor(self.cache.load(path)) for path in paths]
+        # Same augmentation and [-1, 1] range as SR3's Util.transform_augment
+        if self.split == 'train' and torch.rand(1).item() < 0.5:
+            images = [torch.flip(img, dims=[2]) for img in images]
+        images = [img * 2 - 1 for img in images]
+        result = {'SR': images[-2], 'HR': images[-1], 'Index': index}
+        if self.need_LR:
+            result['LR'] = images[0]
+        return result
+
+
+###############################################################################
+#                                                                             #
+#                                   MAIN                                      #
+#                                                                             #
+###############################################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect or clear the shared memory image cache.")
+    parser.add_argument('command', choices=['stats', 'clear', 'warm'])
+    parser.add_argument('folders', nargs='*', help="folders decoded into the cache by 'warm'")
+    parser.add_argument('--capacity-gb', type=float, default=DEFAULT_CAPACITY_GB)
+    args = parser.parse_args()
+    image_cache = SharedImageCache(args.capacity_gb)
+    if args.command == 'stats':
+        for arena_stats in image_cache.stats():
+            print(f"{arena_stats['path']}: {arena_stats['used_slots']}/{arena_stats['reserved_slots']} reserved "
+                  f"(of {arena_stats['slots']}) slots of "
+                  f"{arena_stats['slot_bytes']} bytes, {arena_stats['hits']} hits, {arena_stats['misses']} misses, "
+                  f"{arena_stats['evictions']} evictions")
+    elif args.command == 'clear':
+        print(f"Removed {image_cache.clear()} arenas from '{SHM_DIR}'")
+    else:
+        for folder in args.folders:
+            images = list_images(folder)
+            for image_path in images:
+                image_cache.load(image_path)
+            print(f"{len(images)} images of '{folder}' are in the cache")
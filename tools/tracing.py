@@ -0,0 +1,316 @@
+"""
+This module contains a lightweight tracer of the steps of the pipeline. Every
+step is recorded as a span with its wall time, CPU time (of its thread and of
+the subprocesses it waited for), files processed and bytes read and written.
+
+The bytes read from /proc and the CPU time of the subprocesses are counted for the
+whole process, so they are only measured for spans that do not overlap a span of
+another thread. Overlapping spans, like the stages of a pipeline running in
+threads, are marked as 'shared' and only record the bytes they give themselves.
+
+Tracing is enabled with the SR_TRACE environment variable, or the '--trace'
+option of main.py, giving the file where the trace is written when the program
+ends:
+
+    SR_TRACE=trace.json python tools/main.py
+
+The file follows the Chrome trace event format, so it can be opened with
+https://ui.perfetto.dev or chrome://tracing, and a summary table of the spans
+is printed. When tracing is disabled span() returns a shared object that does
+nothing, so the instrumented code does not pay for it.
+
+    with span('split', files=len(pairs)) as current:
+        ...
+        current.add(bytes_written=size)
+
+    @traced('copy_configs')
+    def copy_config_files_sr3(): ...
+
+:author: Ruben Moya Vazquez <rmoyav@uoc.edu>
+:date: 18/10/2026
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+###############################################################################
+#                                                                             #
+#                                 CONSTANTS                                   #
+#                                                                             #
+###############################################################################
+
+TRACE_ENV = 'SR_TRACE'
+# File used when SR_TRACE is set to a true value instead of a path
+DEFAULT_TRACE_FILE = 'sr_trace.json'
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+# Linux only: bytes read and written by this process, page cache included
+PROC_IO_PATH = '/proc/self/io'
+
+###############################################################################
+#                                                                             #
+#                                 FUNCTIONS                                   #
+#                                                                             #
+###############################################################################
+
+
+def _read_proc_io() -> tuple:
+    """This function returns the bytes read and written by this process so far,
+    or None where /proc is not available."""
+    try:
+        with open(PROC_IO_PATH, 'r') as io_file:
+            counters = dict(line.split(': ') for line in io_file.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class _NullSpan:
+    """Span returned while tracing is disabled, every method does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+    def add(self, files: int = 0, bytes_read: int = 0, bytes_written: int = 0, **args) -> None:
+        pass
+
+    def add_paths(self, paths, written: bool = False, count_files: bool = True) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """A traced step. The files and bytes can be given when the span is created or
+    added while it runs. The bytes are measured from /proc for the spans that do not
+    give them and do not overlap spans of other threads, which misses the work done
+    by child processes."""
+
+    def __init__(self, tracer: 'Tracer', name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.files = args.pop('files', 0)
+        self.bytes_read = args.pop('bytes_read', 0)
+        self.bytes_written = args.pop('bytes_written', 0)
+        self.args = args
+        self.thread = threading.get_ident()
+        # Set by the tracer when a span of another thread runs at the same time
+        self.shared = False
+
+    def add(self, files: int = 0, bytes_read: int = 0, bytes_written: int = 0, **args) -> None:
+        """Adds processed files and bytes to the span, and any other value to its arguments."""
+        self.files += files
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+        self.args.update(args)
+
+    def add_paths(self, paths, written: bool = False, count_files: bool = True) -> None:
+        """Adds the sizes of the given files as read (or written) by the span, and the
+        files themselves to the processed ones unless count_files is False."""
+        size = 0
+        count = 0
+        for path in paths:
+            count += 1
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        count = count if count_files else 0
+        if written:
+            self.add(files=count, bytes_written=size)
+        else:
+            self.add(files=count, bytes_read=size)
+
+    def __enter__(self) -> 'Span':
+        self.tracer.opened(self)
+        self._io = _read_proc_io()
+        self._times = os.times()
+        self._cpu = time.thread_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        end = time.perf_counter()
+        cpu = time.thread_time() - self._cpu
+        times = os.times()
+        io = _read_proc_io()
+        self.tracer.closed(self)
+        child_cpu = 0.0
+        if self.shared:
+            self.args['shared'] = True
+        else:
+            child_cpu = (times.children_user - self._times.children_user) + \
+                (times.children_system - self._times.children_system)
+            if not (self.bytes_read or self.bytes_written) and io and self._io:
+                self.bytes_read = io[0] - self._io[0]
+                self.bytes_written = io[1] - self._io[1]
+        if exc_type is not None:
+            self.args['error'] = f"{exc_type.__name__}: {exc_value}"
+        self.tracer.record(self, self._start, end, cpu, child_cpu)
+        return False
+
+
+class Tracer:
+    """Collects the finished spans of this process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.events = []
+        self._open = set()
+        self._lock = threading.Lock()
+
+    def opened(self, span: Span) -> None:
+        """Adds a running span, marking it and the running spans of other threads as
+        shared if they overlap."""
+        with self._lock:
+            others = [other for other in self._open if other.thread != span.thread]
+            for other in others:
+                other.shared = True
+            span.shared = bool(others)
+            self._open.add(span)
+
+    def closed(self, span: Span) -> None:
+        with self._lock:
+            self._open.discard(span)
+
+    def record(self, span: Span, start: float, end: float, cpu: float, child_cpu: float) -> None:
+        # Forked pool workers inherit the tracer, their spans are not part of this trace
+        if os.getpid() != self.pid:
+            return
+        event = {'name': span.name, 'cat': span.category, 'ph': 'X', 'pid': self.pid,
+                 'tid': threading.get_ident(), 'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6,
+                 'args': dict(span.args, cpu_s=cpu, child_cpu_s=child_cpu, files=span.files,
+                              bytes_read=span.bytes_read, bytes_written=span.bytes_written)}
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self) -> list:
+        """Returns one row per span name, in order of first appearance, with the
+        number of calls and the totals of their measures."""
+        rows = {}
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event['ts'])
+        for event in events:
+            row = rows.setdefault(event['name'], {'name': event['name'], 'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                                  'child_cpu_s': 0.0, 'files': 0, 'bytes_read': 0,
+                                                  'bytes_written': 0})
+            row['calls'] += 1
+            row['wall_s'] += event['dur'] / 1e6
+            for key in ('cpu_s', 'child_cpu_s', 'files', 'bytes_read', 'bytes_written'):
+                row[key] += event['args'][key]
+        return list(rows.values())
+
+    def write(self, path: str = None) -> str:
+        """Writes the trace in Chrome trace event format and returns its path."""
+        path = path or self.path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock:
+            trace = {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+        with open(path, 'w') as trace_file:
+            json.dump(trace, trace_file)
+        return path
+
+
+_tracer = None
+
+
+def enable(path: str = DEFAULT_TRACE_FILE, at_exit: bool = True) -> Tracer:
+    """This function starts tracing the spans of this process.
+
+    Args:
+        path (str, optional): file where the trace is written. Defaults to DEFAULT_TRACE_FILE.
+        at_exit (bool, optional): write the trace and print the summary when the program ends. Defaults to True.
+
+    Returns:
+        Tracer: the tracer collecting the spans
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(path)
+        if at_exit:
+            atexit.register(finish)
+    else:
+        _tracer.path = path
+    return _tracer
+
+
+def is_enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, category: str = 'tools', **args):
+    """This function returns a span to be used as a context manager around a step.
+
+    Args:
+        name (str): name of the step
+        category (str, optional): group of the step in the trace viewer. Defaults to 'tools'.
+        **args: 'files', 'bytes_read' and 'bytes_written' processed by the step, and any
+        other value to show with it
+
+    Returns:
+        Span: the span, or NULL_SPAN if tracing is disabled
+    """
+    if _tracer is None:
+        return NULL_SPAN
+    return Span(_tracer, name, category, args)
+
+
+def traced(name: str = None, category: str = 'tools'):
+    """This function returns a decorator that runs the decorated function inside a span.
+
+    Args:
+        name (str, optional): name of the span. Defaults to the function name.
+        category (str, optional): group of the span in the trace viewer. Defaults to 'tools'.
+    """
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with Span(_tracer, span_name, category, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def print_summary(rows: list) -> None:
+    """This function prints the rows returned by Tracer.summary."""
+    print(f"{'span':32}{'calls':>6}{'wall s':>10}{'cpu s':>9}{'child s':>9}{'files':>8}"
+          f"{'read MB':>10}{'write MB':>10}")
+    for row in rows:
+        print(f"{row['name'][:31]:32}{row['calls']:6d}{row['wall_s']:10.2f}{row['cpu_s']:9.2f}"
+              f"{row['child_cpu_s']:9.2f}{row['files']:8d}{row['bytes_read'] / 2 ** 20:10.1f}"
+              f"{row['bytes_written'] / 2 ** 20:10.1f}")
+
+
+def finish() -> str:
+    """This function writes the trace, prints its summary and stops tracing.
+
+    Returns:
+        str: path of the trace file, None if tracing was not enabled
+    """
+    global _tracer
+    tracer = _tracer
+    if tracer is None or os.getpid() != tracer.pid:
+        return None
+    _tracer = None
+    path = tracer.write()
+    print_summary(tracer.summary())
+    print(f"Trace written to '{path}', open it with https://ui.perfetto.dev")
+    return path
+
+
+if os.environ.get(TRACE_ENV):
+    enable(DEFAULT_TRACE_FILE if os.environ[TRACE_ENV].lower() in TRUE_VALUES else os.environ[TRACE_ENV])
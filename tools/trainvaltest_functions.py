@@ -9,7 +9,9 @@ automated process of training, validating and testing the models.
 import os
 import subprocess
 
-from models_storage import LIIF_REPO_NAME, SR3_REPO_NAME, LIIF_DIR
+from checkpoint_catalog import refresh_catalog
+from models_storage import LIIF_DIR, SR3_DIR
+from tracing import traced
 
 ###############################################################################
 #                                                                             #
@@ -20,12 +22,15 @@ from models_storage import LIIF_REPO_NAME, SR3_REPO_NAME, LIIF_DIR
 # SR3 CONFIG CONSTANTS
 SR3_TRAIN_SCRIPT = "sr.py"
 SR3_TEST_SCRIPT = "infer.py"
+SR3_FAST_TEST_SCRIPT = "infer_fast.py"
 SR3_CONFIG_DIR = os.path.join('.', 'config')
 
 # LIIF CONFIG CONSTANTS
 LIIF_TRAIN_SCRIPT = "train_liif.py"
 LIIF_VAL_SCRIPT = "test.py"
 LIIF_TEST_SCRIPT = "infer.py"
+LIIF_SERVER_SCRIPT = "infer_server.py"
+LIIF_EXPORT_SCRIPT = "export_model.py"
 LIIF_CONFIG_DIR = os.path.join('.', 'configs', 'train-UCMerced_LandUse')
 LIIF_OUTPUT_DIR = os.path.join('.', 'output')
 
@@ -70,7 +75,7 @@ def select_file_from_config_dir(config_dir:str) -> str:
 
 def select_model(save_dir:str) -> str:
     """This function will ask the user to chose one checkpoint to use for their
-    validation/test jobs.
+    validation/test jobs, among the ones of the checkpoint catalog.
 
     Args:
         save_dir (str): Path to the 'save' directory were checkpoints are stored
@@ -78,23 +83,21 @@ def select_model(save_dir:str) -> str:
     Returns:
         str: relative path to the selected checkpoint
     """
-    checkpoints = []
+    checkpoints = refresh_catalog(save_dir)
 
-    for root, dirs, files in os.walk(save_dir):
-        for found in files:
-            if found.endswith('.pth'):
-                checkpoints.append(os.path.relpath(os.path.join(root, found), LIIF_DIR))
-    
     if checkpoints:
+        checkpoints = sorted(checkpoints.items())
         print("Liif checkpoints found:")
-        for index, checkpoint in enumerate(checkpoints, start=1):
-            print(f"{index}. {checkpoint}")
+        for index, (checkpoint, entry) in enumerate(checkpoints, start=1):
+            details = [f"epoch {entry['epoch']}"] if entry['epoch'] is not None else []
+            details += [f"val psnr {entry['val_psnr']:.4f}"] if entry['val_psnr'] is not None else []
+            print(f"{index}. {checkpoint}" + (f" ({', '.join(details)})" if details else ""))
 
         while True:
             try:
                 chosen = int(input("Chose one by number: "))
                 if 1 <= chosen <= len(checkpoints):
-                    return checkpoints[chosen-1]
+                    return checkpoints[chosen-1][0]
                 else:
                     print(f"Please, enter a number between 1 and {len(checkpoints)}")
             except ValueError:
@@ -104,81 +107,182 @@ def select_model(save_dir:str) -> str:
         return None
 
 
+def sr3_command(phase: str, config_file: str) -> list:
+    """This function builds the command running a SR3 phase, to be run from SR3_DIR.
+
+    Args:
+        phase (str): 'train', 'val' or 'test'
+        config_file (str): name of the config file under the SR3 config dir
+
+    Returns:
+        list: the command
+    """
+    if phase == 'test':
+        return ["python", SR3_TEST_SCRIPT, "-c", os.path.join(SR3_CONFIG_DIR, config_file)]
+    return ["python", SR3_TRAIN_SCRIPT, "-p", phase, "-c", os.path.join(SR3_CONFIG_DIR, config_file)]
+
+
+def sr3_fast_test_command(config_file: str, steps: list = None, sampler: str = 'ddim', limit: int = None) -> list:
+    """This function builds the command inferring with SR3 in fewer steps, to be run from SR3_DIR.
+
+    Args:
+        config_file (str): name of the config file under the SR3 config dir
+        steps (list, optional): steps of every run of the ddim sampler. Defaults to the script's ones.
+        sampler (str, optional): 'ddim' or 'ancestral'. Defaults to 'ddim'.
+        limit (int, optional): infer only the first images. Defaults to all.
+
+    Returns:
+        list: the command
+    """
+    cmd = ["python", SR3_FAST_TEST_SCRIPT, "-c", os.path.join(SR3_CONFIG_DIR, config_file), "--sampler", sampler]
+    if steps:
+        cmd += ["--steps"] + [str(step_count) for step_count in steps]
+    if limit:
+        cmd += ["--limit", str(limit)]
+    return cmd
+
+
+def liif_train_command(config_file: str) -> list:
+    """This function builds the command training liif, to be run from LIIF_DIR."""
+    return ["python", LIIF_TRAIN_SCRIPT, "--config", os.path.join(LIIF_CONFIG_DIR, config_file)]
+
+
+def liif_val_command(config_file: str, model_path: str) -> list:
+    """This function builds the command validating a liif checkpoint, to be run from LIIF_DIR.
+
+    Args:
+        config_file (str): name of the config file under the liif config dir
+        model_path (str): path to the checkpoint, relative to the liif repository
+
+    Returns:
+        list: the command, None if the checkpoint does not exist
+    """
+    if not os.path.isfile(os.path.join(LIIF_DIR, model_path)):
+        return None
+    return ["python", LIIF_VAL_SCRIPT, "--config", os.path.join(LIIF_CONFIG_DIR, config_file), '--model', model_path]
+
+
+def liif_test_command(input_dir: str, model_path: str, device: str = None) -> list:
+    """This function builds the command inferring a folder with a liif checkpoint, to be
+    run from LIIF_DIR. The output folder is created.
+
+    Args:
+        input_dir (str): the directory containing the images, relative to the liif repository
+        model_path (str): path to the checkpoint, relative to the liif repository
+        device (str, optional): 'cpu', 'cuda' or 'cuda:N'. Defaults to cuda if available, else cpu.
+
+    Returns:
+        list: the command, None if the checkpoint or the input dir do not exist
+    """
+    if not (os.path.isfile(os.path.join(LIIF_DIR, model_path)) and os.path.isdir(os.path.join(LIIF_DIR, input_dir))):
+        return None
+    os.makedirs(os.path.join(LIIF_DIR, LIIF_OUTPUT_DIR), exist_ok=True)
+    cmd = ["python", LIIF_TEST_SCRIPT, "--input", input_dir, '--model', model_path, '--output', LIIF_OUTPUT_DIR]
+    if device:
+        cmd += ['--device', device]
+    return cmd
+
+
+@traced(category='subprocess')
 def train_sr3(config_file:str) -> None:
     """This function is meant to start SR3 training process
     """
-    current_dir = os.getcwd()
-    try:
-        os.chdir(os.path.join(current_dir, "models", SR3_REPO_NAME))
-        subprocess.run(["python", SR3_TRAIN_SCRIPT, "-p", "train", "-c", os.path.join(SR3_CONFIG_DIR, config_file)], check=True)
-    finally:
-        os.chdir(current_dir)
+    subprocess.run(sr3_command('train', config_file), cwd=SR3_DIR, check=True)
 
 
+@traced(category='subprocess')
 def val_sr3(config_file:str) -> None:
     """This function will start the SR3 model validation
     """
-    current_dir = os.getcwd() 
-    try:
-        os.chdir(os.path.join(current_dir, "models", SR3_REPO_NAME))
-        subprocess.run(["python", SR3_TRAIN_SCRIPT, "-p", "val", "-c", os.path.join(SR3_CONFIG_DIR, config_file)], check=True)
-    finally:
-        os.chdir(current_dir)
+    subprocess.run(sr3_command('val', config_file), cwd=SR3_DIR, check=True)
 
 
+@traced(category='subprocess')
 def test_sr3(config_file:str) -> None:
     """This function is meant to start the SR3 infering process
     """
-    current_dir = os.getcwd()                                                                                                                                                       
-    try:
-        os.chdir(os.path.join(current_dir, "models", SR3_REPO_NAME))
-        subprocess.run(["python", SR3_TEST_SCRIPT, "-c",  os.path.join(SR3_CONFIG_DIR, config_file)], check=True)
-    finally:
-        os.chdir(current_dir)
+    subprocess.run(sr3_command('test', config_file), cwd=SR3_DIR, check=True)
+
 
+@traced(category='subprocess')
+def test_sr3_fast(config_file: str, steps: list = None, sampler: str = 'ddim', limit: int = None) -> None:
+    """This function is meant to start the SR3 infering process in fewer steps, which
+    appends the quality and the time of every run to its report.
+    """
+    subprocess.run(sr3_fast_test_command(config_file, steps, sampler, limit), cwd=SR3_DIR, check=True)
 
+
+@traced(category='subprocess')
 def train_liif(config_file) -> None:
     """This function is meant to start liif training
     """
-    current_dir = os.getcwd()
-    try:
-        os.chdir(os.path.join(current_dir, "models", LIIF_REPO_NAME))
-        subprocess.run(["python", LIIF_TRAIN_SCRIPT, "--config", os.path.join(LIIF_CONFIG_DIR, config_file)], check=True)
-    finally:
-        os.chdir(current_dir)
+    subprocess.run(liif_train_command(config_file), cwd=LIIF_DIR, check=True)
 
 
+@traced(category='subprocess')
 def val_liif(config_file: str, model_path:str) -> None:
     """This function will start the validation process of a given trained liif model.
 
     Args:
         model_path (str): the path to the trained model to be used
     """
-    current_dir = os.getcwd()
-    try:
-        os.chdir(os.path.join(current_dir, "models", LIIF_REPO_NAME))
-        full_model_path = os.path.abspath(model_path)
-        if os.path.isfile(full_model_path):
-            subprocess.run(["python", LIIF_VAL_SCRIPT, "--config", os.path.join(LIIF_CONFIG_DIR, config_file), '--model', model_path], check=True)
-    finally:
-        os.chdir(current_dir)
+    cmd = liif_val_command(config_file, model_path)
+    if cmd:
+        subprocess.run(cmd, cwd=LIIF_DIR, check=True)
 
 
-def test_liif(input_dir:str, model_path:str) -> None:
+@traced(category='subprocess')
+def test_liif(input_dir:str, model_path:str, device: str = None) -> None:
     """This function is meant to infer images using a given trained liif model.
 
     Args:
         input_dir (str): the directory containing the images to use for the inference
         model_path (str): path to the trained model to use
+        device (str, optional): 'cpu', 'cuda' or 'cuda:N'. Defaults to cuda if available, else cpu.
+    """
+    cmd = liif_test_command(input_dir, model_path, device)
+    if cmd:
+        subprocess.run(cmd, cwd=LIIF_DIR, check=True)
+
+
+def serve_liif(model_paths: list, port: int = None, device: str = None) -> None:
+    """This function starts the liif inference server with the given checkpoints loaded.
+    It runs until it is interrupted (Ctrl+c), answering the requests of liif_client.py.
+
+    Args:
+        model_paths (list): paths to the trained models, relative to the liif repository
+        port (int, optional): port to listen on. Defaults to the server's default.
+        device (str, optional): 'cpu', 'cuda' or 'cuda:N'. Defaults to cuda if available, else cpu.
+    """
+    save_dir = os.path.join(LIIF_DIR, 'save')
+    models = [os.path.relpath(os.path.join(LIIF_DIR, model_path), save_dir) for model_path in model_paths]
+    cmd = ["python", LIIF_SERVER_SCRIPT, "--save-dir", save_dir, "--model", *models]
+    if port:
+        cmd += ['--port', str(port)]
+    if device:
+        cmd += ['--device', device]
+    subprocess.run(cmd, cwd=LIIF_DIR, check=True)
+
+
+@traced(category='subprocess')
+def export_liif(model_path: str, quantize: bool = True, bf16: bool = False) -> bool:
+    """This function exports a trained liif model into an optimized CPU model, stored
+    next to the checkpoint, and compares its speed and PSNR with the original one on
+    the test split.
+
+    Args:
+        model_path (str): path to the trained model to export
+        quantize (bool, optional): quantize the MLP to int8. Defaults to True.
+        bf16 (bool, optional): run the model in bf16 precision. Defaults to False.
+
+    Returns:
+        bool: True if the exported model keeps the PSNR of the original one
     """
-    current_dir = os.getcwd()                                                                     
-    try:
-        os.chdir(os.path.join(current_dir, "models", LIIF_REPO_NAME))
-        full_model_path = os.path.abspath(model_path)
-        full_input_path = os.path.abspath(input_dir)
-        full_output_path = os.path.abspath(LIIF_OUTPUT_DIR)
-        if os.path.isfile(full_model_path) and os.path.isdir(full_input_path):
-            os.makedirs(full_output_path, exist_ok=True)
-            subprocess.run(["python", LIIF_TEST_SCRIPT, "--input", input_dir, '--model', model_path, '--output', LIIF_OUTPUT_DIR], check=True)
-    finally:
-        os.chdir(current_dir)
+    if not os.path.isfile(os.path.join(LIIF_DIR, model_path)):
+        return False
+    cmd = ["python", LIIF_EXPORT_SCRIPT, "--model", model_path]
+    if not quantize:
+        cmd.append('--no-quantize')
+    if bf16:
+        cmd.append('--bf16')
+    return subprocess.run(cmd, cwd=LIIF_DIR).returncode == 0